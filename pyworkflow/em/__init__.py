@@ -28,6 +28,8 @@ This modules contains classes related with EM
 """
 import os
 import sys
+import json
+import types
 
 import pyworkflow as pw
 from pyworkflow.utils.reflection import getSubclassesFromModules, getSubclasses, getModules
@@ -39,6 +41,8 @@ from pyworkflow.wizard import Wizard
 from viewer import *
 
 PACKAGES_PATH = os.path.join(pw.HOME, 'em', 'packages')
+# Module of each Protocol and EMObject subclass found in EM-packages
+REGISTRY = os.path.join(pw.SCIPION_USER_DATA, 'em_registry.json')
 
 _emPackagesDict = None
 
@@ -47,6 +51,11 @@ def getPackages():
     if _emPackagesDict is None:
         sys.path.insert(0, PACKAGES_PATH)
         _emPackagesDict = getModules(PACKAGES_PATH)
+        for m in _emPackagesDict.values():
+            if getattr(m, '_lazyPackage', False):
+                # Run the __init__ skipped when importing single modules
+                del m._lazyPackage
+                reload(m)
         sys.path.pop(0)
     return _emPackagesDict
 
@@ -90,6 +99,115 @@ def getWizards():
     return _emWizardsDict
         
         
+def getPackagesStamp():
+    """ Newest modification time and number of python files of each package. """
+    stamp = {}
+    for f in os.listdir(PACKAGES_PATH):
+        packagePath = os.path.join(PACKAGES_PATH, f)
+        if os.path.exists(os.path.join(packagePath, '__init__.py')):
+            times = [os.path.getmtime(os.path.join(packagePath, fn))
+                     for fn in os.listdir(packagePath) if fn.endswith('.py')]
+            stamp[f] = [max(times), len(times)]
+    return stamp
+
+_emRegistry = None
+
+def getRegistry():
+    """ Return a dict with the module name of each Protocol and EMObject
+    subclass of the EM-packages. It is read from REGISTRY, and generated
+    with the full packages import if that file is outdated.
+    """
+    global _emRegistry
+    if _emRegistry is None:
+        stamp = getPackagesStamp()
+        try:
+            with open(REGISTRY) as f:
+                registry = json.load(f)
+            if registry['path'] == PACKAGES_PATH and registry['stamp'] == stamp:
+                _emRegistry = dict((str(k), str(v)) for k, v in registry['classes'].iteritems())
+        except (IOError, ValueError, KeyError):
+            pass
+        if _emRegistry is None:
+            _emRegistry = dict((k, v.__module__) for k, v in getProtocols().iteritems())
+            _emRegistry.update((k, v.__module__) for k, v in getObjects().iteritems())
+            try:
+                # Write and rename, other processes may be reading it
+                tmpFn = '%s.%d' % (REGISTRY, os.getpid())
+                with open(tmpFn, 'w') as f:
+                    json.dump({'path': PACKAGES_PATH, 'stamp': stamp,
+                               'classes': _emRegistry}, f)
+                os.rename(tmpFn, REGISTRY)
+            except (IOError, OSError) as e:
+                print "Could not write the EM-packages registry: %s" % e
+    return _emRegistry
+
+
+def importPackageModule(moduleName):
+    """ Import a module of an EM-package without running the package
+    __init__, that imports all the protocols, viewers and wizards of it.
+    """
+    if moduleName not in sys.modules:
+        packageName = moduleName.split('.')[0]
+        packagePath = os.path.join(PACKAGES_PATH, packageName)
+        if packageName not in sys.modules and os.path.isdir(packagePath):
+            package = types.ModuleType(packageName)
+            package.__path__ = [packagePath]
+            package.__file__ = os.path.join(packagePath, '__init__.py')
+            package._lazyPackage = True
+            sys.modules[packageName] = package
+        __import__(moduleName)
+    return sys.modules[moduleName]
+
+
+class ClassesDict(dict):
+    """ Dictionary of classes for the mappers. Protocols and objects of
+    the EM-packages are only imported when they are requested, so running
+    a protocol does not import all the packages. Iterating over it
+    imports all of them.
+    """
+    def __loadClass(self, className):
+        moduleName = getRegistry().get(className)
+        if moduleName is not None:
+            cls = getattr(importPackageModule(moduleName), className, None)
+            if cls is not None:
+                self[className] = cls
+                return True
+        return False
+
+    def __loadAll(self):
+        self.update(getProtocols())
+        self.update(getObjects())
+
+    def __missing__(self, className):
+        if not self.__loadClass(className):
+            self.__loadAll()
+            if not dict.__contains__(self, className):
+                raise KeyError(className)
+        return dict.__getitem__(self, className)
+
+    def __contains__(self, className):
+        try:
+            self[className]
+            return True
+        except KeyError:
+            return False
+
+    def get(self, className, default=None):
+        return self[className] if className in self else default
+
+    def iteritems(self):
+        self.__loadAll()
+        return dict.iteritems(self)
+
+    def itervalues(self):
+        self.__loadAll()
+        return dict.itervalues(self)
+
+    def values(self):
+        self.__loadAll()
+        return dict.values(self)
+
+
 def findClass(className):
     
     if className in getProtocols():
@@ -411,7 +411,7 @@ class PKPDVia:
         if self.via == "iv":
             return retval
         else:
-            return np.concatenate((np.asarray(retval),self.viaProfile.areParametersSignificant(lowerBound[currentIdx:], upperBound[currentIdx:])))
+            return retval+self.viaProfile.areParametersSignificant(lowerBound[currentIdx:], upperBound[currentIdx:])
 
     def areParametersValid(self, p):
         retval=True
@@ -621,6 +621,47 @@ class PKPDDose:
             doseAmount=0
         return doseAmount
 
+    def isInstantaneous(self):
+        return self.via.viaProfile == None and self.doseType == PKPDDose.TYPE_BOLUS
+
+    def getReleaseRateAt(self,t,h=1e-3):
+        """Release rate at t (amount/min) of a dose that is not instantaneous, h is the time step used to
+           differentiate the via profile"""
+        if self.via.viaProfile == None:
+            if self.doseType == PKPDDose.TYPE_INFUSION and self.t0+self.via.tlag<=t and t<self.tF+self.via.tlag:
+                return self.doseAmount
+            return 0.0
+        return self.getAmountReleasedAt(t-0.5*h,h)/h
+
+    def getBreakpoints(self):
+        """Times at which the release is discontinuous"""
+        if self.doseType == PKPDDose.TYPE_INFUSION:
+            return [self.t0+self.via.tlag, self.tF+self.via.tlag]
+        return [self.t0+self.via.tlag]
+
+    def getReleaseEvent(self):
+        """Returns (t, amount, duration, Ka): the dose reaches the system at t as a bolus (duration=0 and Ka=0),
+           at a constant rate during duration (Ka=0) or with a first order absorption (Ka>0).
+           Returns None if the via profile cannot be expressed in this way"""
+        t = self.t0+self.via.tlag
+        if self.via.viaProfile == None:
+            if self.doseType == PKPDDose.TYPE_BOLUS:
+                return (t, self.doseAmount, 0.0, 0.0)
+            elif self.doseType == PKPDDose.TYPE_INFUSION:
+                return (t, self.doseAmount*(self.tF-self.t0), self.tF-self.t0, 0.0)
+        elif self.doseType == PKPDDose.TYPE_BOLUS:
+            Amax = self.via.bioavailability*self.doseAmount
+            self.via.viaProfile.Amax = Amax
+            if self.via.via=="ev1":
+                Ka = self.via.viaProfile.parameters[0]
+                if Ka>0:
+                    return (t, Amax, 0.0, Ka)
+            elif self.via.via=="ev0":
+                Rin = self.via.viaProfile.parameters[0]
+                if Rin>0:
+                    return (t, Amax, Amax/Rin, 0.0)
+        return None
+
     def isDoseABolus(self):
         if self.doseType != PKPDDose.TYPE_BOLUS:
             return False
@@ -653,8 +694,10 @@ class DrugSource:
         self.parameterNames = []
         self.parameterUnits = []
         self.vias = []
+        self.releaseSchedule = None
 
     def setDoses(self, parsedDoseList, t0, tF):
+        self.releaseSchedule = None
         self.originalDoseList = parsedDoseList
         self.parsedDoseList = []
         collectedVias = []
@@ -688,6 +731,54 @@ class DrugSource:
             doseAmount+=dose.getAmountReleasedAt(t0,dt)
         return doseAmount
 
+    def getReleaseEvents(self):
+        """List of release events of all doses (see PKPDDose.getReleaseEvent), None if any of them is not supported"""
+        retval = []
+        for dose in self.parsedDoseList:
+            event = dose.getReleaseEvent()
+            if event is None:
+                return None
+            retval.append(event)
+        return retval
+
+    def getBolusEvents(self):
+        """List of (t, amount) of the doses that are released instantaneously"""
+        return [(dose.t0+dose.via.tlag, dose.doseAmount) for dose in self.parsedDoseList if dose.isInstantaneous()]
+
+    def getReleaseRateAt(self,t):
+        """Release rate at t of the doses that are not released instantaneously"""
+        rate = 0.0
+        for dose in self.parsedDoseList:
+            if not dose.isInstantaneous():
+                rate+=dose.getReleaseRateAt(t)
+        return rate
+
+    def getBreakpoints(self):
+        retval = []
+        for dose in self.parsedDoseList:
+            retval+=dose.getBreakpoints()
+        return sorted(set(retval))
+
+    def getViaState(self):
+        retval = []
+        for via,_ in self.vias:
+            retval.append((via.tlag,via.bioavailability))
+            if via.viaProfile != None:
+                retval.append(tuple(via.viaProfile.parameters))
+        return tuple(retval)
+
+    def getReleaseSchedule(self, t0, deltaT, Nsamples):
+        """Amounts released at t0+i*deltaT during half a step and a full step (i=0,...,Nsamples-1).
+           The schedule is computed once per grid and via parameters"""
+        key = (t0, deltaT, Nsamples, self.getViaState())
+        if self.releaseSchedule is None or self.releaseSchedule[0]!=key:
+            delta_2 = 0.5*deltaT
+            t = [t0 + i*deltaT for i in range(Nsamples)]
+            self.releaseSchedule = (key,
+                                    np.array([self.getAmountReleasedAt(ti,delta_2) for ti in t],np.double),
+                                    np.array([self.getAmountReleasedAt(ti,deltaT) for ti in t],np.double))
+        return self.releaseSchedule[1], self.releaseSchedule[2]
+
     def getEquation(self):
         retval = ""
         for via,_ in self.vias:
@@ -24,15 +24,19 @@
 # *
 # **************************************************************************
 
+import ast
 import copy
 import json
 import math
+import os
 import numpy as np
+import re
 import sys
 
 from pyworkflow.em.pkpd_units import PKPDUnit, convertUnits, changeRateToMinutes, changeRateToWeight
 from pyworkflow.object import *
-from pyworkflow.utils.path import writeMD5, verifyMD5
+from pyworkflow.utils.path import writeMD5, verifyMD5, getMD5String
+from pyworkflow.utils.process import MethodPool
 from pyworkflow.em.biopharmaceutics import PKPDDose, PKPDVia
 
 class EMObject(OrderedObject):
@@ -186,7 +190,133 @@ class PKPDVariable:
         return "%s [%s]" % (self.varName, self.getUnitsString())
 
 
+class _VectorizeExpression(ast.NodeTransformer):
+    """ Rewrite the boolean operators of an expression so that it can be evaluated on numpy arrays """
+    def _call(self, funcName, args):
+        return ast.Call(func=ast.Name(id=funcName, ctx=ast.Load()), args=args, keywords=[], starargs=None, kwargs=None)
+
+    def _isBoolean(self, node):
+        if isinstance(node,ast.Compare):
+            return True
+        if isinstance(node,ast.Name):
+            return node.id in ["True","False"]
+        return isinstance(node,ast.Call) and isinstance(node.func,ast.Name) and node.func.id in ["_and","_or","_not"]
+
+    def visit_BoolOp(self, node):
+        self.generic_visit(node)
+        # and/or return one of their operands, e.g. $(weight)>70 and 1 or 0 is 1 or 0.
+        # Only when all the operands are booleans this is the same as logical_and/or
+        for value in node.values:
+            if not self._isBoolean(value):
+                raise Exception("Only and/or of comparisons can be vectorized")
+        funcName = "_and" if isinstance(node.op,ast.And) else "_or"
+        retval = node.values[0]
+        for value in node.values[1:]:
+            retval = self._call(funcName,[retval,value])
+        return retval
+
+    def visit_UnaryOp(self, node):
+        self.generic_visit(node)
+        if isinstance(node.op,ast.Not):
+            return self._call("_not",[node.operand])
+        return node
+
+    def visit_Compare(self, node):
+        self.generic_visit(node)
+        if len(node.ops)==1:
+            return node
+        # a<b<c -> (a<b) and (b<c)
+        left = node.left
+        retval = None
+        for op, right in zip(node.ops,node.comparators):
+            comparison = ast.Compare(left=left, ops=[op], comparators=[right])
+            retval = comparison if retval is None else self._call("_and",[retval,comparison])
+            left = right
+        return retval
+
+    def visit_IfExp(self, node):
+        self.generic_visit(node)
+        return self._call("_where",[node.test,node.body,node.orelse])
+
+
+class PKPDExpression:
+    """ Expression on the variables of an experiment, e.g., $(weight)*60/1000 or $(sex)=='M'.
+    The expression is parsed once and can then be evaluated for a single sample or for
+    all the samples at once, passing one numpy array per variable. """
+    safeGlobals = {"__builtins__" : {"True": True, "False": False, "None": None}}
+    vectorGlobals = {"__builtins__" : {"True": True, "False": False, "None": None},
+                     "_and": np.logical_and, "_or": np.logical_or, "_not": np.logical_not, "_where": np.where}
+
+    def __init__(self, expression, prefix=""):
+        self.expression = expression
+        self.variables = []
+        def replaceVariable(match):
+            varName = match.group(1)
+            if not varName in self.variables:
+                self.variables.append(varName)
+            return "_v%d"%self.variables.index(varName)
+        expressionPython = re.sub(r"\$%s\(([^()]*)\)"%re.escape(prefix), replaceVariable, expression.strip())
+        self.identifiers = ["_v%d"%i for i in range(len(self.variables))]
+        self.code = compile(expressionPython, "<expression>", "eval")
+        try:
+            tree = _VectorizeExpression().visit(ast.parse(expressionPython, mode="eval"))
+            self.vectorCode = compile(ast.fix_missing_locations(tree), "<expression>", "eval")
+        except:
+            # It will be evaluated row by row
+            self.vectorCode = None
+
+    def evaluate(self, values):
+        """ values is a list with the value of each variable in self.variables """
+        return eval(self.code, self.safeGlobals, dict(zip(self.identifiers,values)))
+
+    def evaluateColumns(self, columns, N):
+        """ columns is a list with a numpy array (of length N) for each variable in self.variables.
+        Returns a numpy array of length N. """
+        retval = None
+        if self.vectorCode is not None:
+            try:
+                with np.errstate(all='ignore'):
+                    retval = np.asarray(eval(self.vectorCode, self.vectorGlobals, dict(zip(self.identifiers,columns))))
+                if retval.shape!=(N,):
+                    retval = np.array([retval.item()]*N) if retval.shape==() else None
+                if retval is not None and retval.dtype.kind in 'fc':
+                    # numpy gives inf or nan where Python raises (e.g., a division by zero)
+                    finiteInputs = np.ones(N,dtype=bool)
+                    for column in columns:
+                        column = np.asarray(column)
+                        if column.dtype.kind in 'fc' and column.shape==(N,):
+                            finiteInputs &= np.isfinite(column)
+                    if np.any(finiteInputs & ~np.isfinite(retval)):
+                        retval = None
+            except:
+                retval = None
+        if retval is None:
+            # The expression cannot be vectorized, evaluate it row by row with Python values
+            columns = [column.tolist() if isinstance(column,np.ndarray) else column for column in columns]
+            retval = [self.evaluate([column[n] for column in columns]) for n in range(N)]
+            retval = np.array(retval, dtype=object)
+        return retval
+
+_compiledExpressions = {}
+def getCompiledExpression(expression, prefix=""):
+    key = (expression, prefix)
+    if not key in _compiledExpressions:
+        _compiledExpressions[key] = PKPDExpression(expression, prefix)
+    return _compiledExpressions[key]
+
+
 class PKPDSample:
+    MEASUREMENT_OK = 0
+    MEASUREMENT_NA = 1
+    MEASUREMENT_LLOQ = 2
+    MEASUREMENT_ULOQ = 3
+    MEASUREMENT_NAMES = {MEASUREMENT_NA: 'NA',
+                         MEASUREMENT_LLOQ: 'LLOQ',
+                         MEASUREMENT_ULOQ: 'ULOQ'}
+    MEASUREMENT_CODES = {'NA': MEASUREMENT_NA,
+                         'LLOQ': MEASUREMENT_LLOQ,
+                         'ULOQ': MEASUREMENT_ULOQ}
+
     def __init__(self):
         self.sampleName = ""
         self.variableDictPtr = None
@@ -196,6 +326,23 @@ class PKPDSample:
         self.descriptors = None
         self.measurementPattern = None
 
+        # One column per measured variable. Numeric variables are float64 arrays (NaN if there is no value) and
+        # text variables are lists of strings. The flags are the MEASUREMENT_* code of each value.
+        self.measurementValues = {}
+        self.measurementFlags = {}
+        self.pendingMeasurements = {} # Tokens read but not converted yet
+        self.pendingLines = [] # Measurement lines read but not parsed yet
+
+    def __copy__(self):
+        # The columns are shared but not the dictionaries, so that setting a column does not change the original
+        sampleCopy = PKPDSample()
+        sampleCopy.__dict__.update(self.__dict__)
+        sampleCopy.measurementValues = dict(self.measurementValues)
+        sampleCopy.measurementFlags = dict(self.measurementFlags)
+        sampleCopy.pendingMeasurements = dict((key,list(value)) for key, value in self.pendingMeasurements.iteritems())
+        sampleCopy.pendingLines = list(self.pendingLines)
+        return sampleCopy
+
     def parseTokens(self,tokens,variableDict,doseDict,groupDict):
         # FemaleRat1; dose=Dose1[,Dose2]; weight=207; [group=Group1,Group2]
 
@@ -285,11 +432,12 @@ class PKPDSample:
 
     def addMeasurementPattern(self,tokens):
         self.measurementPattern = []
+        self.pendingLines = []
         for n in range(1,len(tokens)):
             varName = tokens[n].strip()
             if varName in self.variableDictPtr:
                 self.measurementPattern.append(varName)
-                setattr(self,"measurement_%s"%varName,[])
+                self.setMeasurementColumn(varName,[])
             else:
                 raise Exception("Unrecognized variable %s"%varName)
 
@@ -300,27 +448,120 @@ class PKPDSample:
         tokens = line.split()
         if len(tokens)<len(self.measurementPattern):
             raise Exception("Not enough values to fill measurement pattern")
-        for n in range(0,len(tokens)):
-            ok=True
-            varName = self.measurementPattern[n]
-            if tokens[n]=="NA" or tokens[n]=="ULOQ" or tokens[n]=="LLOQ":
-                ok = (self.variableDictPtr[varName].role != PKPDVariable.ROLE_TIME)
-            if ok:
-                exec("self.measurement_%s.append('%s')"%(varName,tokens[n]))
-            else:
-                raise Exception("Time measurements cannot be NA")
+        for varName, token in izip(self.measurementPattern,tokens):
+            self.addMeasurementToken(varName,token)
+
+    def addMeasurementLines(self,lines):
+        """Append a block of measurement lines as read from a file. They are parsed in bulk when the columns are used"""
+        self.pendingLines += lines
+
+    def addMeasurementToken(self,varName,token):
+        """Append a value as read from a file (a number, NA, LLOQ or ULOQ). It is converted when the column is used"""
+        if not varName in self.measurementValues:
+            self.measurementPattern.append(varName)
+            self.setMeasurementColumn(varName,[])
+        self.pendingMeasurements.setdefault(varName,[]).append(token)
 
     def addMeasurementColumn(self,varName,values):
         self.measurementPattern.append(varName)
-        setattr(self, "measurement_%s"%varName, [])
-        for value in values:
-            exec("self.measurement_%s.append('%s')"%(varName,str(value)))
+        self.setMeasurementColumn(varName,values)
+
+    def isNumericMeasurement(self,varName):
+        return self.variableDictPtr[varName].varType == PKPDVariable.TYPE_NUMERIC
+
+    def parseMeasurements(self,varName,values):
+        """Convert a list of values (numbers or strings) into a column and its flags"""
+        if isinstance(values,np.ndarray) and values.dtype.kind in 'biuf':
+            return values.astype(np.double), np.zeros(values.shape[0],np.int8)
+        flags = np.array([self.MEASUREMENT_CODES.get(value,self.MEASUREMENT_OK) for value in values],np.int8)
+        if flags.size>0 and self.variableDictPtr[varName].role == PKPDVariable.ROLE_TIME and flags.any():
+            raise Exception("Time measurements cannot be NA")
+        if not self.isNumericMeasurement(varName):
+            return [str(value) for value in values], flags
+        if flags.any():
+            column = np.nan*np.ones(flags.size)
+            ok = flags==self.MEASUREMENT_OK
+            column[ok] = np.asarray([value for value, flag in izip(values,flags) if flag==self.MEASUREMENT_OK],
+                                    np.double)
+        else:
+            column = np.asarray(values,np.double).reshape(flags.size)
+        return column, flags
+
+    def _appendMeasurements(self,varName,values,flags):
+        if self.isNumericMeasurement(varName):
+            self.measurementValues[varName] = np.concatenate([self.measurementValues[varName],values])
+        else:
+            self.measurementValues[varName] = self.measurementValues[varName]+values
+        self.measurementFlags[varName] = np.concatenate([self.measurementFlags[varName],flags])
+
+    def _flushMeasurementLines(self):
+        lines = self.pendingLines
+        self.pendingLines = []
+        Nvars = len(self.measurementPattern)
+        rows = [line.split() for line in lines]
+        rows = [row for row in rows if row]
+        if not rows or Nvars==0:
+            return
+        if any(len(row)!=Nvars for row in rows):
+            if any(len(row)<Nvars for row in rows):
+                raise Exception("Not enough values to fill measurement pattern")
+            rows = [row[0:Nvars] for row in rows]
+
+        # Most blocks are plain numbers, they are converted at once
+        block = None
+        if all(self.isNumericMeasurement(varName) for varName in self.measurementPattern):
+            try:
+                block = np.array(rows,np.double)
+            except ValueError:
+                pass
+        noFlags = np.zeros(len(rows),np.int8)
+        for n, varName in enumerate(self.measurementPattern):
+            if block is not None:
+                self._appendMeasurements(varName,block[:,n],noFlags)
+            else:
+                values, flags = self.parseMeasurements(varName,[row[n] for row in rows])
+                self._appendMeasurements(varName,values,flags)
+
+    def flushMeasurements(self):
+        if self.pendingLines:
+            self._flushMeasurementLines()
+        for varName, tokens in self.pendingMeasurements.iteritems():
+            values, flags = self.parseMeasurements(varName,tokens)
+            self._appendMeasurements(varName,values,flags)
+        self.pendingMeasurements = {}
+
+    def getMeasurementColumn(self,varName):
+        """Values and flags of a measured variable, they are not copied"""
+        if self.pendingLines or self.pendingMeasurements:
+            self.flushMeasurements()
+        return self.measurementValues[varName], self.measurementFlags[varName]
+
+    def setMeasurementColumn(self,varName,values,flags=None):
+        if self.pendingLines:
+            self.flushMeasurements()
+        if flags is None:
+            values, flags = self.parseMeasurements(varName,values)
+        self.measurementValues[varName] = values
+        self.measurementFlags[varName] = np.asarray(flags,np.int8)
+        if varName in self.pendingMeasurements:
+            del self.pendingMeasurements[varName]
 
     def getNumberOfVariables(self):
         return len(self.measurementPattern)
 
     def getNumberOfMeasurements(self):
-        return len(getattr(self,"measurement_%s"%self.measurementPattern[0]))
+        return len(self.getMeasurementColumn(self.measurementPattern[0])[1])
+
+    def _formatMeasurements(self, varName, values, flags):
+        if self.isNumericMeasurement(varName):
+            # repr keeps all the digits, integers are written without decimals (0 and not 0.0)
+            values = [value[:-2] if value.endswith(".0") else value for value in map(repr,values.tolist())]
+        return [value if flag==self.MEASUREMENT_OK else self.MEASUREMENT_NAMES[flag]
+                for value, flag in izip(values,flags)]
+
+    def getMeasurementString(self, varName, n):
+        values, flags = self.getMeasurementColumn(varName)
+        return self._formatMeasurements(varName,values[n:n+1],flags[n:n+1])[0]
 
     def _printToStream(self,fh):
         fh.write("%s"%self.sampleName)
@@ -341,68 +582,43 @@ class PKPDSample:
             patternString += "; %s"%self.measurementPattern[n]
         fh.write("%s %s\n"%(self.sampleName,patternString))
         if len(self.measurementPattern)>0:
-            aux=getattr(self,"measurement_%s"%self.measurementPattern[0])
-            N = len(aux)
-            for i in range(0,self.getNumberOfMeasurements()):
-                lineString = ""
-                for n in range(0,len(self.measurementPattern)):
-                    aux=getattr(self,"measurement_%s"%self.measurementPattern[n])
-                    lineString += aux[i]+" "
-                fh.write("%s\n"%lineString)
+            columns = [self.getValues(varName) for varName in self.measurementPattern]
+            for row in izip(*columns):
+                fh.write("%s \n"%" ".join(row))
         fh.write("\n")
 
     def getRange(self, varName):
         if varName not in self.measurementPattern:
             return [None, None]
         else:
-            aux = getattr(self,"measurement_%s"%varName)
-            aux = [x for x in aux if x != "NA" and x!="LLOQ" and x!="ULOQ"]
-            x = np.asarray(aux, dtype=np.double)
+            values, flags = self.getMeasurementColumn(varName)
+            x = values[flags==self.MEASUREMENT_OK]
             return [x.min(),x.max()]
 
     def getValues(self, varName):
+        """Values as strings (numbers, NA, LLOQ or ULOQ) as they are written in the experiment file"""
         if type(varName)==list:
-            retval=[]
-            for vName in varName:
-                if vName not in self.measurementPattern:
-                    retval.append(None)
-                else:
-                    retval.append(getattr(self,"measurement_%s"%vName))
-            return retval
+            return [self.getValues(vName) for vName in varName]
         else:
             if varName not in self.measurementPattern:
                 return None
             else:
-                return getattr(self,"measurement_%s"%varName)
+                return self._formatMeasurements(varName,*self.getMeasurementColumn(varName))
 
     def setValues(self, varName, varValues):
-        setattr(self,"measurement_%s"%varName,varValues)
+        self.setMeasurementColumn(varName,varValues)
 
     def getXYValues(self,varNameX,varNameY):
         xl = []
         yl = []
-        xs = self.getValues(varNameX)
-        if type(varNameY)==list:
-            ys = self.getValues(varNameY)
-            for ysi in ys:
-                xPartial =[]
-                yPartial = []
-                for x, y in izip(xs, ysi):
-                    if x != "NA" and x!="LLOQ" and y!="ULOQ" and y != "NA" and y!= "LLOQ" and y!="ULOQ":
-                        xPartial.append(float(x))
-                        yPartial.append(float(y))
-                xl.append(np.array(xPartial))
-                yl.append(np.array(yPartial))
-        else:
-            ys = self.getValues(varNameY)
-            xPartial =[]
-            yPartial = []
-            for x, y in izip(xs, ys):
-                if x != "NA" and x!="LLOQ" and y!="ULOQ" and y != "NA" and y!= "LLOQ" and y!="ULOQ":
-                    xPartial.append(float(x))
-                    yPartial.append(float(y))
-            xl.append(np.array(xPartial))
-            yl.append(np.array(yPartial))
+        x, xFlags = self.getMeasurementColumn(varNameX)
+        if type(varNameY)!=list:
+            varNameY = [varNameY]
+        for varNameYi in varNameY:
+            y, yFlags = self.getMeasurementColumn(varNameYi)
+            idx = np.logical_and(xFlags==self.MEASUREMENT_OK,yFlags==self.MEASUREMENT_OK)
+            xl.append(x[idx])
+            yl.append(y[idx])
         return xl, yl
 
     def getSampleMeasurements(self):
@@ -424,8 +640,21 @@ class PKPDSample:
         return expressionPython
 
     def evaluateExpression(self, expression, prefix=""):
-        expressionPython=self.substituteValuesInExpression(expression,prefix)
-        return eval(expressionPython, {"__builtins__" : {"True": True, "False": False, "None": None} }, {})
+        compiledExpression = getCompiledExpression(expression, prefix)
+        values = []
+        for varName in compiledExpression.variables:
+            if varName in self.variableDictPtr and varName in self.descriptors:
+                value = self.descriptors[varName]
+                if value=="NA" or value=="LLOQ" or value=="ULOQ":
+                    return None
+                if self.variableDictPtr[varName].varType == PKPDVariable.TYPE_NUMERIC:
+                    value = float(value)
+                values.append(value)
+            elif varName=="sampleName":
+                values.append(self.sampleName)
+            else:
+                raise Exception("Cannot find %s in the sample %s"%(varName,self.sampleName))
+        return compiledExpression.evaluate(values)
 
     def getDescriptorValue(self,descriptorName):
         if descriptorName in self.descriptors.keys():
@@ -443,11 +672,7 @@ class PKPDSampleMeasurement():
         self.n = n
 
     def getValues(self):
-        values = []
-        for i in range(0,self.sample.getNumberOfVariables()):
-            aux=getattr(self.sample,"measurement_%s"%self.sample.measurementPattern[i])
-            values.append(aux[self.n])
-        return values
+        return [self.sample.getMeasurementString(varName,self.n) for varName in self.sample.measurementPattern]
 
 class PKPDGroup():
     def __init__(self, groupName):
@@ -481,12 +706,15 @@ class PKPDExperiment(EMObject):
 
     def __str__(self):
         if not self.infoStr.hasValue():
-            self.load()
+            self.load(lazy=True)
             self.infoStr.set("variables: %d, samples: %d"
                              % (len(self.variables), len(self.samples)))
         return self.infoStr.get()
 
-    def load(self, fnExperiment="", verifyIntegrity=True):
+    def load(self, fnExperiment="", verifyIntegrity=True, lazy=False):
+        """The measurements of each sample are read in blocks and parsed in bulk. If lazy, they are
+        not parsed until the sample measurements are first used. If there is an up to date binary
+        sidecar, the measurements are taken from it"""
         if fnExperiment!="":
             self.fnPKPD.set(fnExperiment)
         if verifyIntegrity and not verifyMD5(self.fnPKPD.get()):
@@ -494,12 +722,20 @@ class PKPDExperiment(EMObject):
         fh=open(self.fnPKPD.get(),'r')
         if not fh:
             raise Exception("Cannot open the file "+self.fnPKPD)
+        sidecar = readSidecar(self.fnPKPD.get())
 
-        for line in fh.readlines():
+        state = None
+        measurementLines = []
+        for line in fh:
             line=line.strip()
+            if state==PKPDExperiment.READING_A_MEASUREMENT:
+                if line!="" and line[0]!='[':
+                    measurementLines.append(line)
+                    continue
+                self.samples[samplename].addMeasurementLines(measurementLines)
+                measurementLines = []
+                state=PKPDExperiment.READING_MEASUREMENTS
             if line=="":
-                if state==PKPDExperiment.READING_A_MEASUREMENT:
-                    state=PKPDExperiment.READING_MEASUREMENTS
                 continue
             if line[0]=='[':
                 section = line.split('=')[0].strip().lower()
@@ -516,6 +752,8 @@ class PKPDExperiment(EMObject):
                 elif section=="[samples]":
                     state=PKPDExperiment.READING_SAMPLES
                 elif section=="[measurements]":
+                    if sidecar is not None:
+                        break
                     state=PKPDExperiment.READING_MEASUREMENTS
                 else:
                     print("Skipping: ",line)
@@ -585,10 +823,66 @@ class PKPDExperiment(EMObject):
                     state=PKPDExperiment.READING_A_MEASUREMENT
                 else:
                     print("Skipping measurement: %s"%line)
-            elif state==PKPDExperiment.READING_A_MEASUREMENT:
-                self.samples[samplename].addMeasurement(line)
 
+        if state==PKPDExperiment.READING_A_MEASUREMENT:
+            self.samples[samplename].addMeasurementLines(measurementLines)
         fh.close()
+        if sidecar is not None:
+            self._readSidecar(sidecar)
+        elif not lazy:
+            for sample in self.samples.values():
+                sample.flushMeasurements()
+
+    def _readSidecar(self, arrays):
+        numericValues = arrays["numericValues"]
+        textValues = arrays["textValues"].tolist()
+        flags = arrays["flags"]
+        iNumeric = 0
+        iText = 0
+        iFlags = 0
+        for sampleName, pattern, count in izip(arrays["samples"].tolist(), arrays["patterns"].tolist(),
+                                               arrays["counts"].tolist()):
+            sample = self.samples[sampleName]
+            sample.measurementPattern = []
+            for varName in pattern.split(';') if pattern!="" else []:
+                if sample.isNumericMeasurement(varName):
+                    values = numericValues[iNumeric:iNumeric+count]
+                    iNumeric += count
+                else:
+                    values = textValues[iText:iText+count]
+                    iText += count
+                sample.measurementPattern.append(varName)
+                sample.setMeasurementColumn(varName,values,flags[iFlags:iFlags+count])
+                iFlags += count
+
+    def _writeSidecar(self, fnExperiment):
+        # The sidecar is only a cache, the text file is always the reference and it has already been written
+        try:
+            sampleNames = []
+            patterns = []
+            counts = []
+            numericValues = [np.empty(0)]
+            textValues = []
+            flags = [np.empty(0,np.int8)]
+            for sampleName, sample in self.samples.iteritems():
+                sampleNames.append(sampleName)
+                patterns.append(';'.join(sample.measurementPattern))
+                counts.append(sample.getNumberOfMeasurements() if sample.measurementPattern else 0)
+                for varName in sample.measurementPattern:
+                    values, varFlags = sample.getMeasurementColumn(varName)
+                    if sample.isNumericMeasurement(varName):
+                        numericValues.append(np.asarray(values,np.double))
+                    else:
+                        textValues += [str(value) for value in values]
+                    flags.append(np.asarray(varFlags,np.int8))
+            writeSidecar(fnExperiment, {"samples": np.array(sampleNames,dtype=str),
+                                        "patterns": np.array(patterns,dtype=str),
+                                        "counts": np.array(counts,np.int64),
+                                        "numericValues": np.concatenate(numericValues),
+                                        "textValues": np.array(textValues,dtype=str),
+                                        "flags": np.concatenate(flags)})
+        except Exception as e:
+            print("Cannot write the binary sidecar of %s: %s"%(fnExperiment,e))
 
     def write(self, fnExperiment):
         fh=open(fnExperiment,'w')
@@ -596,6 +890,7 @@ class PKPDExperiment(EMObject):
         fh.close()
         self.fnPKPD.set(fnExperiment)
         writeMD5(fnExperiment)
+        self._writeSidecar(fnExperiment)
         self.infoStr.set("variables: %d, samples: %d" % (len(self.variables),
                                                          len(self.samples)))
 
@@ -711,19 +1006,58 @@ class PKPDExperiment(EMObject):
                 sample.descriptors={}
             sample.descriptors[varName] = varValue
 
+    def getDescriptorColumns(self, varNames, sampleNames):
+        """ Return a numpy array for each variable with its value in each one of the samples,
+        and a boolean array with the samples for which any of the values is not available """
+        N = len(sampleNames)
+        columns = []
+        missing = np.zeros(N,np.bool)
+        for varName in varNames:
+            if varName in self.variables:
+                isNumeric = self.variables[varName].varType == PKPDVariable.TYPE_NUMERIC
+                column = np.empty(N, np.double if isNumeric else object)
+                for n, sampleName in enumerate(sampleNames):
+                    descriptors = self.samples[sampleName].descriptors
+                    if descriptors is None or not varName in descriptors:
+                        raise Exception("Cannot find %s in the sample %s"%(varName,sampleName))
+                    value = descriptors[varName]
+                    if value=="NA" or value=="LLOQ" or value=="ULOQ":
+                        missing[n] = True
+                        value = np.nan if isNumeric else None
+                    column[n] = float(value) if isNumeric and not missing[n] else value
+            elif varName=="sampleName":
+                column = np.array(sampleNames, dtype=object)
+            else:
+                raise Exception("Cannot find %s amongst the experiment variables"%varName)
+            columns.append(column)
+        return columns, missing
+
+    def evaluateExpression(self, expression, sampleNames=None, prefix=""):
+        """ Evaluate the expression for all samples at once. Returns a dictionary sampleName -> value,
+        the value is None for those samples with missing values """
+        if sampleNames is None:
+            sampleNames = self.samples.keys()
+        compiledExpression = getCompiledExpression(expression, prefix)
+        columns, missing = self.getDescriptorColumns(compiledExpression.variables, sampleNames)
+        values = compiledExpression.evaluateColumns(columns, len(sampleNames)).tolist()
+        return dict([(sampleName, None if missing[n] else values[n]) for n, sampleName in enumerate(sampleNames)])
+
     def getSubGroup(self,condition):
         if condition=="":
             return self.samples
+        values = self.evaluateExpression(condition)
         samplesSubGroup = {}
         for sampleName, sample in self.samples.iteritems():
-            if sample.evaluateExpression(condition):
+            if values[sampleName]:
                 samplesSubGroup[sampleName] = sample
         return samplesSubGroup
 
     def getSubGroupLabels(self,condition,labelName):
+        if condition!="":
+            values = self.evaluateExpression(condition)
         subgroupLabels = []
         for sampleName, sample in self.samples.iteritems():
-            if condition!="" and sample.evaluateExpression(condition) or condition=="":
+            if condition=="" or values[sampleName]:
                 subgroupLabels.append(sample.descriptors[labelName])
         return subgroupLabels
 
@@ -735,6 +1069,12 @@ class PKPDExperiment(EMObject):
                 nonBolusList.append(sampleName)
         return nonBolusList
 
+def finiteDifferenceSteps(parameters):
+    # Same steps as MINPACK with the default epsfcn
+    h = math.sqrt(np.finfo(np.double).eps)*np.abs(parameters)
+    h[h==0] = math.sqrt(np.finfo(np.double).eps)
+    return h
+
 class PKPDModelBase(object):
     def __init__(self):
         self.fnExperiment = None
@@ -807,6 +1147,24 @@ class PKPDModelBase2(PKPDModelBase):
     def forwardModel(self, parameters, x=None):
         pass
 
+    def hasJacobian(self):
+        """True if forwardModelJacobian gives the derivative of the model, checked without simulating it"""
+        return hasattr(self,"forwardModelBatch") or \
+               type(self).forwardModelJacobian.im_func is not PKPDModelBase2.forwardModelJacobian.im_func
+
+    def forwardModelJacobian(self, parameters, x=None):
+        """
+        Derivative of forwardModel with respect to the parameters. Returns a list (one per response) of
+        len(x[j]) x P matrices, or None if the model cannot provide it. Models with a forwardModelBatch
+        simulate all the forward differences together in a single batch.
+        """
+        if not hasattr(self,"forwardModelBatch"):
+            return None
+        parameters = np.asarray(parameters,np.double)
+        h = finiteDifferenceSteps(parameters)
+        y = self.forwardModelBatch(np.vstack([parameters,parameters+np.diag(h)]),x)
+        return [((yj[1:,:]-yj[0,:])/h[:,np.newaxis]).T for yj in y]
+
     def printSetup(self):
         print("Model: %s"%self.getModelEquation())
         print("Variables: "+str(self.getParameterNames()))
@@ -888,12 +1246,16 @@ class PKPDModel(PKPDModelBase2):
         pass
 
 class PKPDODEModel(PKPDModelBase2):
+    INTEGRATORS = ["RK4", "RK45", "BDF", "LSODA"]
+
     def __init__(self):
         PKPDModelBase2.__init__(self)
         self.t0 = None # (min)
         self.tF = None # (min)
         self.deltaT = 0.25 # (min)
         self.drugSource = None
+        self.integrator = "RK4" # One of INTEGRATORS, the adaptive ones ignore deltaT
+        self.NFevaluations = 0 # Number of evaluations of F in the last simulation
         # self.show = False
 
     def setXYValues(self, x, y):
@@ -936,9 +1298,22 @@ class PKPDODEModel(PKPDModelBase2):
     def getStateDimension(self):
         return None
 
+    def getLinearSystem(self):
+        """Linear models return (A,B) such that dy/dt = A*y + B*dD/dt for the current parameters"""
+        return None
+
     def forwardModel(self, parameters, x=None):
         self.parameters = parameters
 
+        # Linear models with supported drug sources are solved analytically
+        system = self.getLinearSystem()
+        if system is not None:
+            events = self.drugSource.getReleaseEvents()
+            if events is not None:
+                return self.forwardModelLinear(system[0], system[1], events, x)
+        if self.integrator!="RK4":
+            return self.forwardModelAdaptive(x)
+
         # Simulate the system response
         t = self.t0
         Nsamples = int(math.ceil((self.tF-self.t0)/self.deltaT))+1
@@ -951,6 +1326,8 @@ class PKPDODEModel(PKPDModelBase2):
         Xt = np.zeros(Yt.shape[0])
         delta_2 = 0.5*self.deltaT
         K = self.deltaT/3
+        releasedHalfStep, releasedStep = self.drugSource.getReleaseSchedule(self.t0, self.deltaT, Nsamples)
+        self.NFevaluations = 4*Nsamples
         for i in range(0,Nsamples):
             t = self.t0 + i*self.deltaT # More accurate than t+= self.deltaT
             Xt[i]=t
@@ -958,7 +1335,7 @@ class PKPDODEModel(PKPDModelBase2):
             # Internal evolution
             # Runge Kutta's 4th order (http://lpsa.swarthmore.edu/NumInt/NumIntFourth.html)
             k1 = self.F(t,yt)
-            dD1 = self.drugSource.getAmountReleasedAt(t,delta_2)
+            dD1 = releasedHalfStep[i]
             dyD1 = self.G(t, dD1)
             y1 = yt+k1*delta_2+dyD1
             # print("t=",t," y0=",yt," k1=",k1," dD1=",dD1," dyD1=",dyD1," y1=",y1)
@@ -968,7 +1345,7 @@ class PKPDODEModel(PKPDModelBase2):
             y2 = yt+k2*delta_2+dyD1
             # print("k2=",k2," y2=",y2)
 
-            dD = self.drugSource.getAmountReleasedAt(t,self.deltaT)
+            dD = releasedStep[i]
             dyD = self.G(t, dD)
             k3 = self.F(t_delta_2,y2)
             y3 = yt+k3*self.deltaT+dyD
@@ -1010,6 +1387,247 @@ class PKPDODEModel(PKPDModelBase2):
                 self.yPredicted.append(np.interp(x[j],Xt,Yt[:,j]))
         return self.yPredicted
 
+    def forwardModelLinear(self, A, B, events, x=None):
+        """
+        Exact solution of dy/dt = A*y + B*dD/dt as a superposition of the responses to each release event
+        (see DrugSource.getReleaseEvents), evaluated directly at x. As in forwardModel, x is clipped to the
+        simulated time range and only the doses released after t0 are considered.
+        """
+        A = np.atleast_2d(np.asarray(A,np.double))
+        B = np.asarray(B,np.double).ravel()
+        self.yPredicted = [y[0] for y in self.forwardModelLinearBatch(A[np.newaxis],B[np.newaxis],events,x)]
+        return self.yPredicted
+
+    def forwardModelLinearBatch(self, A, B, events, x=None):
+        """
+        Same as forwardModelLinear for N systems at once, A is N x S x S and B is N x S.
+        Returns a list (one per response) of N x len(x[j]) matrices.
+        """
+        if x is None:
+            x = self.x
+        self.NFevaluations = 0
+        N, S = B.shape
+        tLast = self.t0+(int(math.ceil((self.tF-self.t0)/self.deltaT)))*self.deltaT
+
+        xList = [np.clip(np.asarray(x[j],np.double),self.t0,tLast) for j in range(self.getResponseDimension())]
+        t = np.unique(np.concatenate(xList))
+        Yt = np.zeros((N,t.size,S))
+
+        # Augmented systems for constant rate (last state is the input) and first order inputs (first state is the depot)
+        Mrate = np.zeros((N,S+1,S+1))
+        Mrate[:,0:S,0:S]=A
+        Mrate[:,0:S,S]=B
+        eRate = np.zeros((N,S+1))
+        eRate[:,S]=1
+        Mdepot = np.zeros((N,S+1,S+1))
+        Mdepot[:,1:,1:]=A
+        eDepot = np.zeros((N,S+1))
+        eDepot[:,0]=1
+
+        for tEvent, amount, duration, Ka in events:
+            if tEvent<self.t0:
+                continue
+            k = np.searchsorted(t,tEvent) # t is sorted, the event affects t[k:]
+            if k==t.size:
+                continue
+            dt = t[k:]-tEvent
+            if Ka>0:
+                Mdepot[:,0,0]=-Ka
+                Mdepot[:,1:,0]=B*Ka
+                Yt[:,k:,:] += expmTimesVectorBatch(Mdepot,dt,eDepot)[:,:,1:]*amount
+            elif duration>0:
+                rate = amount/duration
+                yt = np.zeros((N,dt.size,S))
+                during = dt<=duration
+                if np.any(during):
+                    yt[:,during,:] = expmTimesVectorBatch(Mrate,dt[during],eRate)[:,:,0:S]*rate
+                after = np.logical_not(during)
+                if np.any(after):
+                    yEnd = expmTimesVectorBatch(Mrate,np.array([duration]),eRate)[:,0,0:S]*rate
+                    yt[:,after,:] = expmTimesVectorBatch(A,dt[after]-duration,yEnd)
+                Yt[:,k:,:] += yt
+            else:
+                Yt[:,k:,:] += expmTimesVectorBatch(A,dt,B)*amount
+        Yt[Yt<0]=0
+
+        yPredicted = []
+        for j in range(0,self.getResponseDimension()):
+            yPredicted.append(Yt[:,np.searchsorted(t,xList[j]),j])
+        return yPredicted
+
+    def forwardModelAdaptive(self, x=None):
+        """
+        Integrate with an adaptive step (RK45) or an implicit method for stiff systems (BDF, LSODA). The doses released
+        instantaneously are applied as jumps of the state and the integration is restarted at every discontinuity
+        of the drug release.
+        """
+        from scipy.integrate import ode
+
+        if x is None:
+            x = self.x
+        S = self.getStateDimension()
+        tLast = self.t0+(int(math.ceil((self.tF-self.t0)/self.deltaT)))*self.deltaT
+        xList = [np.clip(np.asarray(x[j],np.double),self.t0,tLast) for j in range(self.getResponseDimension())]
+        tOut = np.unique(np.concatenate(xList))
+
+        self.NFevaluations = 0
+        def dydt(t, y):
+            self.NFevaluations += 1
+            return self.F(t,y)+self.G(t,self.drugSource.getReleaseRateAt(t))
+
+        solver = ode(dydt)
+        if self.integrator=="RK45":
+            solver.set_integrator('dopri5', rtol=1e-6, atol=1e-12, nsteps=100000)
+        elif self.integrator=="BDF":
+            solver.set_integrator('vode', method='bdf', rtol=1e-6, atol=1e-12, nsteps=100000)
+        elif self.integrator=="LSODA":
+            solver.set_integrator('lsoda', rtol=1e-6, atol=1e-12, nsteps=100000)
+        else:
+            raise Exception("Unknown integrator %s"%self.integrator)
+
+        boluses = [(t,amount) for t,amount in self.drugSource.getBolusEvents() if t>=self.t0]
+        breakpoints = [t for t in self.drugSource.getBreakpoints() if t>self.t0 and t<=tLast]
+        tStop = np.union1d(tOut, breakpoints)
+
+        yt = np.zeros(S,np.double)
+        for t,amount in boluses:
+            if t==self.t0:
+                yt += self.G(t,amount)
+        solver.set_initial_value(yt,self.t0)
+        Yt = np.zeros((tOut.size,S))
+        i = 0
+        for t in tStop:
+            if t>solver.t:
+                yt = solver.integrate(t)
+                if not solver.successful():
+                    raise Exception("The integrator %s failed at t=%f"%(self.integrator,t))
+            if t in breakpoints:
+                for tBolus,amount in boluses:
+                    if tBolus==t:
+                        yt = yt+self.G(t,amount)
+                solver.set_initial_value(yt,t)
+            if i<tOut.size and tOut[i]==t:
+                yOut = np.copy(yt)
+                self.imposeConstraints(yOut)
+                self.H(yOut)
+                Yt[i,:]=yOut
+                i+=1
+
+        self.yPredicted = []
+        for j in range(0,self.getResponseDimension()):
+            self.yPredicted.append(Yt[np.searchsorted(tOut,xList[j]),j])
+        return self.yPredicted
+
+    def forwardModelBatch(self, parameters, x=None, releaseSchedule=None):
+        """
+        Simulate N parameter vectors at once. parameters is a N x P matrix (one parameter vector per row).
+        F, G and H are called with self.parameters[k] being a vector of N values and with the state being
+        a S x N matrix (or a vector of N values if S=1). All vectors share the same drug source. Linear models
+        are solved analytically and the adaptive integrators integrate each vector separately. Returns a list (one per response) of N x len(x[j]) matrices.
+        releaseSchedule may give the amounts released by a different drug source for each vector (the half step
+        and full step amounts of DrugSource.getReleaseSchedule as two Nsamples x N matrices), only with RK4.
+        """
+        parameters = np.atleast_2d(np.asarray(parameters,np.double))
+        N = parameters.shape[0]
+        S = self.getStateDimension()
+        if x is None:
+            x = self.x
+        previousParameters = self.parameters
+        if releaseSchedule is not None and self.integrator!="RK4":
+            raise Exception("A release schedule per vector can only be integrated with RK4")
+
+        # Linear models with supported drug sources are solved analytically for each vector, as in forwardModel
+        events = self.drugSource.getReleaseEvents() if releaseSchedule is None else None
+        if events is not None:
+            self.parameters = parameters[0]
+            linear = self.getLinearSystem() is not None
+            self.parameters = previousParameters
+            if linear:
+                A = np.zeros((N,S,S))
+                B = np.zeros((N,S))
+                try:
+                    for i in range(N):
+                        self.parameters = parameters[i]
+                        A[i], B[i] = self.getLinearSystem()
+                finally:
+                    self.parameters = previousParameters
+
+                # The vectors are solved in chunks to limit the memory used by the intermediate N x Nt x S arrays
+                Nt = sum([len(xj) for xj in x])
+                Nchunk = max(1,2**22/(Nt*(S+1)))
+                self.yPredictedBatch = [np.zeros((N,len(x[j]))) for j in range(0,self.getResponseDimension())]
+                for i0 in range(0,N,Nchunk):
+                    y = self.forwardModelLinearBatch(A[i0:i0+Nchunk],B[i0:i0+Nchunk],events,x)
+                    for j in range(0,self.getResponseDimension()):
+                        self.yPredictedBatch[j][i0:i0+Nchunk,:] = y[j]
+                return self.yPredictedBatch
+
+        # The adaptive integrators choose their own steps for each vector
+        if self.integrator!="RK4":
+            self.yPredictedBatch = [np.zeros((N,len(x[j]))) for j in range(0,self.getResponseDimension())]
+            try:
+                for i in range(N):
+                    y = self.forwardModel(parameters[i],x)
+                    for j in range(0,self.getResponseDimension()):
+                        self.yPredictedBatch[j][i,:] = y[j]
+            finally:
+                self.parameters = previousParameters
+            return self.yPredictedBatch
+
+        self.parameters = parameters.T
+        try:
+            Nsamples = int(math.ceil((self.tF-self.t0)/self.deltaT))+1
+            if S>1:
+                yt = np.zeros((S,N),np.double)
+                Yt = np.zeros((Nsamples,S,N),np.double)
+            else:
+                yt = np.zeros(N,np.double)
+                Yt = np.zeros((Nsamples,N),np.double)
+            delta_2 = 0.5*self.deltaT
+            K = self.deltaT/3
+            if releaseSchedule is None:
+                releasedHalfStep, releasedStep = self.drugSource.getReleaseSchedule(self.t0, self.deltaT, Nsamples)
+            else:
+                releasedHalfStep, releasedStep = releaseSchedule
+            for i in range(0,Nsamples):
+                t = self.t0 + i*self.deltaT
+
+                # Same Runge Kutta scheme as forwardModel
+                k1 = self.F(t,yt)
+                dyD1 = self.G(t, releasedHalfStep[i]*np.ones(N))
+                y1 = yt+k1*delta_2+dyD1
+
+                t_delta_2=t+delta_2
+                k2 = self.F(t_delta_2,y1)
+                y2 = yt+k2*delta_2+dyD1
+
+                dyD = self.G(t, releasedStep[i]*np.ones(N))
+                k3 = self.F(t_delta_2,y2)
+                y3 = yt+k3*self.deltaT+dyD
+
+                k4 = self.F(t+self.deltaT,y3)
+
+                yt += (0.5*(k1+k4)+k2+k3)*K+dyD
+                self.imposeConstraints(yt)
+                self.H(yt)
+                Yt[i]=yt
+        finally:
+            self.parameters = previousParameters
+
+        # Get the values at x, the time grid is regular so that the interpolation weights are direct
+        self.yPredictedBatch = []
+        for j in range(0,self.getResponseDimension()):
+            u = np.clip((np.asarray(x[j],np.double)-self.t0)/self.deltaT,0,Nsamples-1)
+            i0 = np.minimum(np.floor(u).astype(int),max(Nsamples-2,0))
+            i1 = np.minimum(i0+1,Nsamples-1)
+            w = (u-i0)[:,np.newaxis]
+            if S==1:
+                Ytj = Yt
+            else:
+                Ytj = Yt[:,j,:]
+            self.yPredictedBatch.append(((1-w)*Ytj[i0]+w*Ytj[i1]).T)
+        return self.yPredictedBatch
+
 class PKPDOptimizer:
     def __init__(self,model,fitType,goalFunction="RMSE"):
         self.model = model
@@ -1038,7 +1656,21 @@ class PKPDOptimizer:
         else:
             raise Exception("Unknown goal function")
 
+        # All the responses are concatenated in a single residual vector, the targets are flattened once
+        self.yTargetAll = np.concatenate(self.yTarget).astype(np.double)
+        self.yTargetLogsAll = np.concatenate(self.yTargetLogs).astype(np.double)
+        self.residualLimits = []
+        i0 = 0
+        for yTarget in self.yTarget:
+            self.residualLimits.append((i0,i0+yTarget.size))
+            i0 += yTarget.size
+        self.residuals = np.zeros(i0)
+        self.validResiduals = np.ones(i0,np.bool)
+        self.hugeErrorResiduals = 1e38*np.ones(i0)
+
         self.verbose = 1
+        self.bestRmseReported = 1e38
+        self.lastParameters = None
 
     def inBounds(self,parameters):
         if self.bounds==None or len(self.bounds)!=len(parameters):
@@ -1049,74 +1681,75 @@ class PKPDOptimizer:
         return True
 
     def hugeError(self):
-        allDiffs = None
-        for yTarget in self.yTarget:
-            diff = 1e38*np.ones(yTarget.shape)
-            if allDiffs==None:
-                allDiffs = diff
-            else:
-                allDiffs = np.concatenate([allDiffs, diff])
-        return allDiffs
+        return self.hugeErrorResiduals
 
     def getResiduals(self,parameters):
+        return self.evaluateResiduals(parameters)[0]
+
+    def evaluateResiduals(self,parameters):
+        """Residuals and their RMSE. The residuals are written in a buffer that is reused by the next evaluation"""
         if not self.inBounds(parameters):
-            return self.hugeError()
+            return self.hugeErrorResiduals, 1e38
         yPredicted = self.model.forwardModel(parameters)
 
-        allDiffs = None
-        for y, yTarget,yTargetLog in izip(yPredicted,self.yTarget,self.yTargetLogs):
+        e = self.residuals
+        iEnd = 0
+        for y, (i0,iEnd) in izip(yPredicted,self.residualLimits):
+            ei = e[i0:iEnd]
             if self.takeYLogs:
-                idx = np.logical_and(np.isfinite(y),y>=1e-20)
-                diff = yTargetLog[idx]-np.log10(y[idx])
+                y = np.asarray(y,np.double)
+                validi = self.validResiduals[i0:iEnd]
+                np.logical_and(np.isfinite(y),y>=1e-20,out=validi)
+                np.log10(y,out=ei,where=validi)
+                np.subtract(self.yTargetLogsAll[i0:iEnd],ei,out=ei)
             else:
-                diff = yTarget - y
+                np.subtract(self.yTargetAll[i0:iEnd],y,out=ei)
             if self.takeRelative:
-                diff = diff/yTarget
+                np.divide(ei,self.yTargetAll[i0:iEnd],out=ei)
+        e = e[0:iEnd]
+        if self.takeYLogs and not self.validResiduals[0:iEnd].all():
+            e = e[self.validResiduals[0:iEnd]]
+        e[np.logical_not(np.isfinite(e))]=1e38
+        if e.size<parameters.size:
+            return self.hugeErrorResiduals, 1e38
 
-            if allDiffs==None:
-                allDiffs = diff
-            else:
-                allDiffs = np.concatenate([allDiffs, diff])
+        rmse = math.sqrt(np.dot(e,e)/e.size)
+        self.reportEvaluation(rmse,parameters,e)
+        self.Nevaluations+=1
 
-            idx = np.logical_not(np.isfinite(allDiffs))
-            allDiffs[idx]=1e38
-        e = allDiffs
-        if e.size<parameters.size:
-            return self.hugeError()
+        # Keep the last evaluation so that the Jacobian at the same point does not simulate again
+        self.lastParameters = np.copy(parameters)
+        self.lastPredicted = yPredicted
+        self.lastResiduals = e
+        return e, rmse
 
-        rmse = math.sqrt(np.power(e,2).mean())
+    def reportEvaluation(self, rmse, parameters, e=None):
+        # Improvements below 1% of the last reported error and the residuals are only shown with verbose>1
         if rmse<self.bestRmse:
-            print("   Best rmse so far=%f"%rmse)
-            print("      at x=%s"%str(parameters))
-            print("      e=%s"%str(e))
+            if self.verbose>1 or (self.verbose>0 and rmse<0.99*self.bestRmseReported):
+                print("   Best rmse so far=%f"%rmse)
+                print("      at x=%s"%str(parameters))
+                if self.verbose>1 and e is not None:
+                    print("      e=%s"%str(e))
+                self.bestRmseReported=rmse
             self.bestRmse=rmse
-        elif self.Nevaluations%100==0:
+        elif self.verbose>0 and self.Nevaluations%100==0:
             print("   Neval=%d RMSE=%f"%(self.Nevaluations,rmse))
             sys.stdout.flush()
-        self.Nevaluations+=1
-        return e
 
     def goalRMSE(self,parameters):
-        e = self.getResiduals(parameters)
-        rmse = math.sqrt(np.power(e,2).mean())
-        return rmse
+        return self.evaluateResiduals(parameters)[1]
 
     def _evaluateQuality(self, x, y, yp):
         # Spiess and Neumeyer, BMC Pharmacology 2010, 10:6
-        self.e = None
-        yToUse = None
+        diffs = []
         for yi, ypi in izip(y,yp):
-            diff = []
-            for yii, ypii in izip(yi,ypi):
-                if np.isfinite(yii) and np.isfinite(ypii):
-                    diff.append(yii-ypii)
-            diff = np.asarray(diff)
-            if self.e==None:
-                self.e = diff
-                yToUse = np.asarray(yi)
-            else:
-                self.e = np.concatenate([self.e, diff])
-                yToUse = np.concatenate([yToUse, yi])
+            n = min(len(yi),len(ypi))
+            yi = np.asarray(yi[0:n],np.double)
+            ypi = np.asarray(ypi[0:n],np.double)
+            diffs.append((yi-ypi)[np.logical_and(np.isfinite(yi),np.isfinite(ypi))])
+        self.e = np.concatenate(diffs)
+        yToUse = np.concatenate([np.asarray(yi) for yi in y[0:len(diffs)]])
 
         self.R2 = (1-np.var(self.e)/np.var(yToUse))
         n=len(self.e) # Number of samples
@@ -1215,11 +1848,23 @@ class PKPDOptimizer:
             self._printFitting(self.model.x, logY, logYp)
 
 class PKPDDEOptimizer(PKPDOptimizer):
+    def __init__(self,model,fitType,goalFunction="RMSE"):
+        PKPDOptimizer.__init__(self,model,fitType,goalFunction)
+        self.popsize = 15
+        self.maxiter = 1000
+        self.tol = 0.01
+        self.seed = None
+        self.batch = False
+
     def optimize(self):
         from scipy.optimize import differential_evolution
         if self.verbose>0:
             print("Optimizing with Differential Evolution (DE), a global optimizer")
-        self.optimum = differential_evolution(self.goalFunction, self.model.getBounds())
+        if self.batch:
+            self.optimum = self.differentialEvolutionBatch()
+        else:
+            self.optimum = differential_evolution(self.goalFunction, self.model.getBounds(), popsize=self.popsize,
+                                                  maxiter=self.maxiter, tol=self.tol, seed=self.seed)
         if self.verbose>0:
             print("Best DE function value: "+str(self.optimum.fun))
             print("Best DE parameters: "+str(self.optimum.x))
@@ -1230,13 +1875,123 @@ class PKPDDEOptimizer(PKPDOptimizer):
             print(" ")
         return self.optimum
 
+    def goalFunctionBatch(self, parameters):
+        """RMSE of each row of parameters. If the model has a forwardModelBatch, all rows are simulated together"""
+        if not hasattr(self.model,"forwardModelBatch"):
+            return np.array([self.goalFunction(p) for p in parameters])
+
+        N = parameters.shape[0]
+        sumSquares = np.zeros(N)
+        count = np.zeros(N)
+        yPredicted = self.model.forwardModelBatch(parameters)
+        with np.errstate(divide='ignore',invalid='ignore'):
+            for y, yTarget, yTargetLog in izip(yPredicted,self.yTarget,self.yTargetLogs):
+                if self.takeYLogs:
+                    valid = np.logical_and(np.isfinite(y),y>=1e-20)
+                    diff = yTargetLog-np.log10(y)
+                else:
+                    valid = np.ones(y.shape,np.bool)
+                    diff = yTarget - y
+                if self.takeRelative:
+                    diff = diff/yTarget
+                diff[np.logical_not(np.isfinite(diff))]=1e38
+                sumSquares += np.sum(np.where(valid,diff*diff,0),axis=1)
+                count += np.sum(valid,axis=1)
+            rmse = np.sqrt(sumSquares/count)
+        inBounds = np.array([self.inBounds(p) for p in parameters])
+        rmse[np.logical_or(count<parameters.shape[1],np.logical_not(inBounds))]=1e38
+
+        n = np.argmin(rmse)
+        self.reportEvaluation(rmse[n],parameters[n])
+        self.Nevaluations+=N
+        return rmse
+
+    def differentialEvolutionBatch(self):
+        """
+        Differential evolution with the same strategy (best1bin), initialization (latin hypercube) and final
+        polishing as scipy's differential_evolution, but all the trial vectors of a generation are built from
+        the previous generation and evaluated together with goalFunctionBatch.
+        """
+        from scipy.optimize import minimize, OptimizeResult
+        bounds = np.asarray(self.model.getBounds(),np.double)
+        lower = bounds[:,0]
+        width = bounds[:,1]-bounds[:,0]
+        D = bounds.shape[0]
+        N = max(self.popsize*D,5)
+        rng = np.random.RandomState(self.seed)
+
+        # The population lives in the unit cube
+        population = (rng.random_sample((N,D))+np.arange(N)[:,np.newaxis])/N
+        for d in range(D):
+            population[:,d] = population[rng.permutation(N),d]
+        energies = self.goalFunctionBatch(lower+population*width)
+        nfev = N
+
+        rows = np.arange(N)
+        nit = 0
+        for nit in range(1,self.maxiter+1):
+            best = np.argmin(energies)
+
+            # Mutate the best member with the difference of two others, different from the candidate
+            F = rng.uniform(0.5,1)
+            keys = rng.random_sample((N,N))
+            keys[rows,rows] = 2
+            others = np.argsort(keys,axis=1)[:,0:2]
+            mutant = population[best]+F*(population[others[:,0]]-population[others[:,1]])
+
+            # Binomial crossover, at least one parameter comes from the mutant
+            crossover = rng.random_sample((N,D))<0.7
+            crossover[rows,rng.randint(0,D,N)] = True
+            trial = np.where(crossover,mutant,population)
+            outside = np.logical_or(trial<0,trial>1)
+            trial[outside] = rng.random_sample(np.sum(outside))
+
+            trialEnergies = self.goalFunctionBatch(lower+trial*width)
+            nfev += N
+            improved = trialEnergies<energies
+            population[improved] = trial[improved]
+            energies[improved] = trialEnergies[improved]
+            if np.std(energies)<=self.tol*np.abs(np.mean(energies)):
+                break
+
+        best = np.argmin(energies)
+        optimum = OptimizeResult(x=lower+population[best]*width, fun=energies[best], nfev=nfev, nit=nit)
+        polished = minimize(self.goalFunction, np.copy(optimum.x), method='L-BFGS-B', bounds=bounds)
+        if polished.fun<optimum.fun:
+            optimum.x = polished.x
+            optimum.fun = polished.fun
+        return optimum
+
 class PKPDLSOptimizer(PKPDOptimizer):
+    def __init__(self,model,fitType,goalFunction="RMSE"):
+        PKPDOptimizer.__init__(self,model,fitType,goalFunction)
+        self.Nprocesses = 1
+        self.pool = None
+
     def optimize(self):
         from scipy.optimize import leastsq
         if self.verbose>0:
             print("Optimizing with Least Squares (LS), a local optimizer")
             print("Initial parameters: "+str(self.model.parameters))
-        self.optimum, self.cov_x, self.info, mesg, _ = leastsq(self.getResiduals, self.model.parameters, full_output=True)
+
+        # Use the Jacobian of the model if it has one, otherwise the finite differences may be computed in parallel
+        Dfun = None
+        if self.model.hasJacobian():
+            Dfun = self.getJacobian
+            if self.verbose>0:
+                print("Jacobian provided by the model")
+        elif self.Nprocesses>1:
+            self.pool = MethodPool(self.model.forwardModel, min(self.Nprocesses,len(self.model.parameters)+1))
+            Dfun = self.getJacobian
+            if self.verbose>0:
+                print("Jacobian by finite differences in %d processes"%self.Nprocesses)
+        try:
+            self.optimum, self.cov_x, self.info, mesg, _ = leastsq(self.getResiduals, self.model.parameters, Dfun=Dfun,
+                                                                   full_output=True)
+        finally:
+            if self.pool is not None:
+                self.pool.close()
+                self.pool = None
         if self.verbose>0:
             print("Best LS function value: "+str(self.goalFunction(self.optimum)))
             print("Best LS parameters: "+str(self.optimum))
@@ -1253,6 +2008,44 @@ class PKPDLSOptimizer(PKPDOptimizer):
             print(" ")
         return self.optimum
 
+    def finiteDifferencesInParallel(self, parameters):
+        h = finiteDifferenceSteps(parameters)
+        y = self.pool.map([(p,) for p in [parameters]+[parameters+hk for hk in np.diag(h)]])
+        return [np.array([(np.asarray(y[k+1][j])-np.asarray(y[0][j]))/h[k] for k in range(len(h))]).T
+                for j in range(len(y[0]))]
+
+    def getJacobian(self, parameters):
+        """Derivative of getResiduals with respect to the parameters (one row per residual)"""
+        if not self.inBounds(parameters):
+            return np.zeros((self.hugeError().size,parameters.size))
+        if self.pool is not None:
+            dyPredicted = self.finiteDifferencesInParallel(parameters)
+        else:
+            dyPredicted = self.model.forwardModelJacobian(parameters)
+        if not np.array_equal(parameters,self.lastParameters):
+            self.getResiduals(parameters)
+            if not np.array_equal(parameters,self.lastParameters):
+                # The residuals are the constant huge error
+                return np.zeros((self.hugeError().size,parameters.size))
+
+        allJacobians = []
+        for y, dy, yTarget in izip(self.lastPredicted,dyPredicted,self.yTarget):
+            y = np.asarray(y,np.double)
+            if self.takeYLogs:
+                idx = np.logical_and(np.isfinite(y),y>=1e-20)
+                J = -dy[idx,:]/(y[idx,np.newaxis]*math.log(10))
+            else:
+                J = -dy
+            if self.takeRelative:
+                J = J/yTarget[:,np.newaxis]
+            allJacobians.append(J)
+        J = np.vstack(allJacobians)
+
+        # The residuals that were replaced by a huge error do not change
+        J[self.lastResiduals==1e38,:] = 0
+        J[np.logical_not(np.isfinite(J))] = 0
+        return J
+
     def setConfidenceInterval(self,confidenceInterval):
         if self.cov_x!=None:
             from scipy.stats import norm
@@ -1309,14 +2102,13 @@ class PKPDSampleFit:
 
         self.multiOutputSeries = False
 
-    def printForPopulation(self,fh,observations):
+    def printForPopulation(self,fh,n0):
         outputStr = ""
         for parameter in self.parameters:
             outputStr += "%f "%parameter
-        observations = np.vstack([observations, self.parameters])
         outputStr += " # %f %f %f %f %f"%(self.R2,self.R2adj,self.AIC,self.AICc,self.BIC)
         fh.write(outputStr+"\n")
-        return observations
+        return n0+1
 
     def getBasicInfo(self):
         """ Return a string with some basic information of the fitting. """
@@ -1354,6 +2146,9 @@ class PKPDSampleFit:
     def restartReadingState(self):
         self.state = PKPDSampleFit.READING_SAMPLEFITTINGS_NAME
 
+    def finishReadingState(self):
+        pass
+
     def readFromLine(self, line):
         if self.state==PKPDSampleFit.READING_SAMPLEFITTINGS_NAME:
             tokens = line.split(':')
@@ -1436,6 +2231,51 @@ class PKPDSampleFit:
                     self.yl.append(tokens[0])
                     self.yu.append(tokens[1])
 
+    def _toArrays(self, arrays, prefix):
+        arrays[prefix+"sampleName"] = np.array(self.sampleName)
+        arrays[prefix+"modelEquation"] = np.array(self.modelEquation)
+        # The values are rounded as in the text file so that both give the same fitting
+        arrays[prefix+"quality"] = roundAsText([self.R2,self.R2adj,self.AIC,self.AICc,self.BIC])
+        arrays[prefix+"parameters"] = roundAsText(self.parameters)
+        # As in the text file, one bound and significance string per parameter
+        Nparameters = len(self.parameters)
+        arrays[prefix+"lowerBound"] = np.array([str(value) for value in self.lowerBound[0:Nparameters]],dtype=str)
+        arrays[prefix+"upperBound"] = np.array([str(value) for value in self.upperBound[0:Nparameters]],dtype=str)
+        arrays[prefix+"significance"] = np.array(self.significance[0:Nparameters],dtype=str)
+        arrays[prefix+"multiOutputSeries"] = np.array(self.multiOutputSeries)
+        if self.multiOutputSeries:
+            arrays[prefix+"seriesLength"] = np.array([len(xj) for xj in self.x],np.int64)
+        for key in ["x","y","yp","yl","yu"]:
+            values = getattr(self,key)
+            if self.multiOutputSeries:
+                values = [value for serie in values for value in serie]
+            if key=="x":
+                arrays[prefix+key] = roundAsText(values)
+            elif key in ["y","yp"]:
+                arrays[prefix+key] = roundAsText(values,"%.12g")
+            else:
+                arrays[prefix+key] = np.array(values,dtype=str)
+
+    def _fromArrays(self, arrays, prefix):
+        self.sampleName = str(arrays[prefix+"sampleName"])
+        self.modelEquation = str(arrays[prefix+"modelEquation"])
+        self.R2, self.R2adj, self.AIC, self.AICc, self.BIC = arrays[prefix+"quality"].tolist()
+        self.parameters = arrays[prefix+"parameters"].tolist()
+        self.lowerBound = arrays[prefix+"lowerBound"].tolist()
+        self.upperBound = arrays[prefix+"upperBound"].tolist()
+        self.significance = arrays[prefix+"significance"].tolist()
+        self.multiOutputSeries = bool(arrays[prefix+"multiOutputSeries"])
+        for key in ["x","y","yp","yl","yu"]:
+            values = arrays[prefix+key].tolist()
+            if self.multiOutputSeries:
+                series = []
+                i0 = 0
+                for length in arrays[prefix+"seriesLength"].tolist():
+                    series.append(values[i0:i0+length])
+                    i0 += length
+                values = series
+            setattr(self,key,values)
+
     def copyFromOptimizer(self,optimizer):
         self.R2 = optimizer.R2
         self.R2adj = optimizer.R2adj
@@ -1455,43 +2295,89 @@ class PKPDSampleFitBootstrap:
 
     def __init__(self):
         self.sampleName = ""
-        self.R2 = []
-        self.R2adj = []
-        self.AIC = []
-        self.AICc = []
-        self.BIC = []
+        self.allocate(0,0)
         self.parameters = None
-        self.xB = []
-        self.yB = []
 
-    def _printSample(self,fh,n, n0=0):
-        outputStr = "%d: "%(n+n0)
-        for parameter in self.parameters[n,:]:
-            outputStr += "%f "%parameter
-        outputStr += " # %f %f %f %f %f"%(self.R2[n],self.R2adj[n],self.AIC[n],self.AICc[n],self.BIC[n])
-        fh.write(outputStr+"\n")
-
-    def printForPopulation(self,fh,observations):
-        for n in range(0,self.parameters.shape[0]):
-            self._printSample(fh,n,observations.shape[0])
-        observations = np.vstack([observations, self.parameters])
-        return observations
+    def allocate(self, Nreplicas, Nparameters):
+        """Preallocate the population: one row of parameters per replica and one vector per quality measure.
+        The replicas are filled with setReplica"""
+        self.parameters = np.zeros((Nreplicas,Nparameters),np.double)
+        self.R2, self.R2adj, self.AIC, self.AICc, self.BIC = np.zeros((5,Nreplicas),np.double)
+        self.xB = np.empty(Nreplicas,dtype=object)
+        self.yB = np.empty(Nreplicas,dtype=object)
+
+    def setReplica(self, n, parameters, quality, xB, yB):
+        self.parameters[n,:] = parameters
+        self.R2[n], self.R2adj[n], self.AIC[n], self.AICc[n], self.BIC[n] = quality
+        self.xB[n] = xB
+        self.yB[n] = yB
+
+    def getNumberOfReplicas(self):
+        return 0 if self.parameters is None else self.parameters.shape[0]
+
+    def getReplicas(self, idx):
+        """Sample fit with the replicas selected by idx (a slice, a list of indexes or a boolean mask).
+        With a slice the arrays are shared with this sample fit"""
+        sampleFit = PKPDSampleFitBootstrap()
+        sampleFit.sampleName = self.sampleName
+        if self.parameters is not None:
+            sampleFit.parameters = self.parameters[idx]
+            for key in ["R2","R2adj","AIC","AICc","BIC","xB","yB"]:
+                setattr(sampleFit,key,getattr(self,key)[idx])
+        return sampleFit
+
+    def concatenate(self, sampleFits):
+        """Take the replicas of all the sample fits one after the other. With a single sample fit the arrays
+        are shared"""
+        sampleFits = [sampleFit for sampleFit in sampleFits if sampleFit.parameters is not None]
+        if len(sampleFits)==0:
+            return
+        if len(sampleFits)==1:
+            concatenateOrShare = lambda arrays: arrays[0]
+        else:
+            concatenateOrShare = np.concatenate
+        self.parameters = concatenateOrShare([sampleFit.parameters for sampleFit in sampleFits])
+        for key in ["R2","R2adj","AIC","AICc","BIC","xB","yB"]:
+            setattr(self,key,concatenateOrShare([getattr(sampleFit,key) for sampleFit in sampleFits]))
+
+    def _getPopulationLines(self):
+        if self.parameters is None:
+            return []
+        lineFormat = "%f "*self.parameters.shape[1]+" # %f %f %f %f %f"
+        rows = np.hstack([self.parameters,np.transpose([self.R2,self.R2adj,self.AIC,self.AICc,self.BIC])])
+        return [lineFormat%tuple(row) for row in rows.tolist()]
+
+    def printForPopulation(self,fh,n0):
+        for n, line in enumerate(self._getPopulationLines()):
+            fh.write("%d: %s\n"%(n+n0,line))
+        return n0+self.getNumberOfReplicas()
 
     def _printToStream(self,fh):
         fh.write("Sample name: %s\n"%self.sampleName)
-        for n in range(0,self.parameters.shape[0]):
-            fh.write("xB: %s\n"%self.xB[n])
-            fh.write("yB: %s\n"%self.yB[n])
-
-            outputStr = ""
-            for parameter in self.parameters[n,:]:
-                outputStr += "%f "%parameter
-            outputStr += " # %f %f %f %f %f"%(self.R2[n],self.R2adj[n],self.AIC[n],self.AICc[n],self.BIC[n])
-            fh.write(outputStr+"\n")
+        for xB, yB, line in izip(self.xB,self.yB,self._getPopulationLines()):
+            fh.write("xB: %s\n"%xB)
+            fh.write("yB: %s\n"%yB)
+            fh.write(line+"\n")
         fh.write("\n")
 
     def restartReadingState(self):
         self.state = PKPDSampleFitBootstrap.READING_SAMPLEFITTINGS_NAME
+        # The replicas are collected in lists and converted to arrays at the end
+        self.parameters = []
+        self.R2 = []
+        self.R2adj = []
+        self.AIC = []
+        self.AICc = []
+        self.BIC = []
+        self.xB = []
+        self.yB = []
+
+    def finishReadingState(self):
+        self.parameters = np.array(self.parameters,np.double) if len(self.parameters)>0 else None
+        for key in ["R2","R2adj","AIC","AICc","BIC"]:
+            setattr(self,key,np.array(getattr(self,key),np.double))
+        self.xB = np.array(self.xB,dtype=object)
+        self.yB = np.array(self.yB,dtype=object)
 
     def readFromLine(self, line):
         if self.state==PKPDSampleFitBootstrap.READING_SAMPLEFITTINGS_NAME:
@@ -1526,9 +2412,7 @@ class PKPDSampleFitBootstrap:
             tokens = line.split('#')
             tokensParameters = tokens[0].strip().split(' ')
             tokensQuality = tokens[1].strip().split(' ')
-            if self.parameters == None:
-                self.parameters = np.empty((0,len(tokensParameters)),np.double)
-            self.parameters = np.vstack([self.parameters, [float(prm) for prm in tokensParameters]])
+            self.parameters.append([float(prm) for prm in tokensParameters])
 
             self.R2.append(float(tokensQuality[0]))
             self.R2adj.append(float(tokensQuality[1]))
@@ -1538,12 +2422,28 @@ class PKPDSampleFitBootstrap:
 
             self.state = PKPDSampleFitBootstrap.READING_SAMPLEFITTINGS_XB
 
-    def copyFromOptimizer(self,optimizer):
-        self.R2.append(optimizer.R2)
-        self.R2adj.append(optimizer.R2adj)
-        self.AIC.append(optimizer.AIC)
-        self.AICc.append(optimizer.AICc)
-        self.BIC.append(optimizer.BIC)
+    def _toArrays(self, arrays, prefix):
+        arrays[prefix+"sampleName"] = np.array(self.sampleName)
+        if self.parameters is not None:
+            arrays[prefix+"parameters"] = roundAsText(self.parameters)
+        arrays[prefix+"quality"] = roundAsText([self.R2,self.R2adj,self.AIC,self.AICc,self.BIC])
+        # As in the text file, the bootstrap indexes are kept as strings in a single line
+        arrays[prefix+"xB"] = np.array(["".join(line.strip() for line in ("%s"%xB).split("\n")) for xB in self.xB],dtype=str)
+        arrays[prefix+"yB"] = np.array(["".join(line.strip() for line in ("%s"%yB).split("\n")) for yB in self.yB],dtype=str)
+
+    def _fromArrays(self, arrays, prefix):
+        self.sampleName = str(arrays[prefix+"sampleName"])
+        self.parameters = arrays.get(prefix+"parameters")
+        self.R2, self.R2adj, self.AIC, self.AICc, self.BIC = arrays[prefix+"quality"]
+        self.xB = arrays[prefix+"xB"].astype(object)
+        self.yB = arrays[prefix+"yB"].astype(object)
+
+    def copyFromOptimizer(self,optimizer,n):
+        self.R2[n] = optimizer.R2
+        self.R2adj[n] = optimizer.R2adj
+        self.AIC[n] = optimizer.AIC
+        self.AICc[n] = optimizer.AICc
+        self.BIC[n] = optimizer.BIC
 
 
 class PKPDFitting(EMObject):
@@ -1582,12 +2482,35 @@ class PKPDFitting(EMObject):
         fh.close()
         self.fnFitting.set(fnFitting)
         writeMD5(fnFitting)
+        self._writeSidecar(fnFitting)
+
+    def _writeSidecar(self, fnFitting):
+        # As for the experiments, the sidecar is only a cache of the text file
+        try:
+            arrays = {"sampleFittingClass": np.array(self.sampleFittingClass),
+                      "sampleFits": np.array(len(self.sampleFits))}
+            for n, sampleFit in enumerate(self.sampleFits):
+                sampleFit._toArrays(arrays,"fit%d_"%n)
+            writeSidecar(fnFitting, arrays)
+        except Exception as e:
+            print("Cannot write the binary sidecar of %s: %s"%(fnFitting,e))
+
+    def _readSidecar(self, arrays):
+        for n in range(int(arrays["sampleFits"])):
+            newSampleFit = eval("%s()"%self.sampleFittingClass)
+            newSampleFit._fromArrays(arrays,"fit%d_"%n)
+            self.sampleFits.append(newSampleFit)
 
     def getAllParameters(self):
-        allParameters = np.empty((0,len(self.modelParameters)),np.double)
-        for sampleFitting in self.sampleFits:
-            allParameters = np.vstack([allParameters, sampleFitting.parameters])
-        return allParameters
+        """One row per sample fit or bootstrap replica. With a single population the matrix is not copied"""
+        Nparameters = len(self.modelParameters)
+        allParameters = [np.asarray(sampleFitting.parameters,np.double).reshape(-1,Nparameters)
+                         for sampleFitting in self.sampleFits if sampleFitting.parameters is not None]
+        if len(allParameters)==0:
+            return np.empty((0,Nparameters),np.double)
+        elif len(allParameters)==1:
+            return allParameters[0]
+        return np.vstack(allParameters)
 
     def getStats(self, observations=None):
         if observations is None:
@@ -1620,10 +2543,11 @@ class PKPDFitting(EMObject):
             auxUnit.unit = paramUnits
             fh.write("%s [%s] "%(paramName,auxUnit._toString()))
         fh.write(" # R2 R2adj AIC AICc BIC\n")
-        observations = np.empty((0,len(self.modelParameters)),np.double)
+        n0 = 0
         for sampleFitting in self.sampleFits:
-            observations = sampleFitting.printForPopulation(fh,observations)
+            n0 = sampleFitting.printForPopulation(fh,n0)
         fh.write("\n")
+        observations = self.getAllParameters()
 
         mu=np.mean(observations,axis=0)
         if observations.shape[0]>2:
@@ -1651,8 +2575,12 @@ class PKPDFitting(EMObject):
         if not verifyMD5(fnFitting):
             raise Exception("The file %s has been modified since its creation" % fnFitting)
         self.fnFitting.set(fnFitting)
+        sidecar = readSidecar(fnFitting)
+        if sidecar is not None and str(sidecar["sampleFittingClass"])!=self.sampleFittingClass:
+            sidecar = None
 
         auxUnit = PKPDUnit()
+        Nfits0 = len(self.sampleFits)
         for line in fh.readlines():
             line=line.strip()
             if line=="":
@@ -1668,6 +2596,8 @@ class PKPDFitting(EMObject):
                     state=PKPDFitting.READING_POPULATION_HEADER
                     self.summaryLines.append(line)
                 elif section=="[sample fittings]":
+                    if sidecar is not None:
+                        break
                     state=PKPDFitting.READING_SAMPLEFITTINGS_BEGIN
                 else:
                     print("Skipping: ",line)
@@ -1736,6 +2666,11 @@ class PKPDFitting(EMObject):
                 self.sampleFits[-1].readFromLine(line)
 
         fh.close()
+        if sidecar is not None:
+            self._readSidecar(sidecar)
+        else:
+            for sampleFit in self.sampleFits[Nfits0:]:
+                sampleFit.finishReadingState()
 
     def getSampleFit(self, sampleName):
         for sampleFit in self.sampleFits:
@@ -2136,6 +3071,79 @@ class PKPDDoseResponse(EMObject):
             self.Nresponses[n]+=1
 
 
+def expmTimesVector(M, t, v):
+    """expm(M*ti)*v for each ti in t (one row per time)"""
+    return expmTimesVectorBatch(M[np.newaxis],t,v[np.newaxis])[0]
+
+def expmTimesVectorBatch(M, t, v):
+    """expm(M[n]*ti)*v[n] for each of the N matrices in M and each ti in t (N x len(t) x S)"""
+    # Invalid parameters (e.g. V=0) give non finite matrices, their response is NaN as with the integrators
+    finite = np.isfinite(M).all(axis=2).all(axis=1)
+    if not np.all(finite):
+        result = np.nan*np.ones((M.shape[0],t.size,M.shape[1]))
+        if np.any(finite):
+            result[finite] = expmTimesVectorBatch(M[finite],t,v[finite])
+        return result
+    w, V = np.linalg.eig(M)
+    if not np.any(np.iscomplex(w)):
+        w = np.real(w)
+        V = np.real(V)
+    result = np.zeros((M.shape[0],t.size,M.shape[1]))
+    with np.errstate(divide='ignore'):
+        ok = np.linalg.cond(V)<1e8
+    if np.any(ok):
+        c = np.linalg.solve(V[ok],v[ok])
+        result[ok] = np.real(np.matmul(np.exp(w[ok][:,np.newaxis,:]*t[:,np.newaxis])*c[:,np.newaxis,:],
+                                       np.transpose(V[ok],(0,2,1))))
+    for n in np.nonzero(np.logical_not(ok))[0]:
+        from scipy.linalg import expm
+        result[n] = np.array([np.dot(expm(M[n]*ti),v[n]) for ti in t])
+    return result
+
+def latinHypercube(N, D, seed=None):
+    """N points of a random Latin hypercube in [0,1)^D (N x D): each dimension is divided in N
+    intervals and each interval is sampled exactly once"""
+    randomState = np.random.RandomState(seed)
+    u = randomState.uniform(0,1,(N,D))
+    for d in range(D):
+        u[:,d] = (randomState.permutation(N)+u[:,d])/N
+    return u
+
+# Degree, coefficients and initial direction numbers of the primitive polynomials of the dimensions 2,3,...
+# of the Sobol sequence (Joe and Kuo, new-joe-kuo-6.21201)
+SOBOL_POLYNOMIALS = [(1,0,[1]), (2,1,[1,3]), (3,1,[1,3,1]), (3,2,[1,1,1]), (4,1,[1,1,3,3]), (4,4,[1,3,5,13]),
+                     (5,2,[1,1,5,5,17]), (5,4,[1,1,5,5,5]), (5,7,[1,1,7,11,19]), (5,11,[1,1,5,1,1]),
+                     (5,13,[1,1,1,3,11]), (5,14,[1,3,5,5,31])]
+
+def sobolSequence(N, D):
+    """First N points of the Sobol sequence in [0,1)^D (N x D), starting at the origin"""
+    if D>len(SOBOL_POLYNOMIALS)+1:
+        raise Exception("The Sobol sequence is only available up to %d dimensions"%(len(SOBOL_POLYNOMIALS)+1))
+    Nbits = max(1,int(math.ceil(math.log(max(N,2),2))))
+    V = np.zeros((D,Nbits+1),np.int64) # V[d,i] is the i-th direction number (i>=1) scaled by 2^Nbits
+    for i in range(1,Nbits+1):
+        V[0,i] = 1<<(Nbits-i)
+    for d in range(1,D):
+        s, a, m = SOBOL_POLYNOMIALS[d-1]
+        for i in range(1,Nbits+1):
+            if i<=s:
+                V[d,i] = m[i-1]<<(Nbits-i)
+            else:
+                V[d,i] = V[d,i-s]^(V[d,i-s]>>s)
+                for k in range(1,s):
+                    if (a>>(s-1-k))&1:
+                        V[d,i] ^= V[d,i-k]
+    X = np.zeros((N,D),np.int64)
+    for n in range(1,N):
+        # Gray code order, the direction of the rightmost zero bit of n-1 is added
+        c = 1
+        k = n-1
+        while k&1:
+            k >>= 1
+            c += 1
+        X[n] = X[n-1]^V[:,c]
+    return X/float(1<<Nbits)
+
 def flattenArray(y):
     if type(y[0])!=list and type(y[0])!=np.ndarray:
         y = [np.array(y,dtype=np.float32)]
@@ -2144,4 +3152,32 @@ def flattenArray(y):
     return y
 
 def smartLog(y):
-    return np.array([math.log10(yi) if np.isfinite(yi) and yi>0 else float("inf") for yi in y])
\ No newline at end of file
+    return np.array([math.log10(yi) if np.isfinite(yi) and yi>0 else float("inf") for yi in y])
+
+def roundAsText(values, fmt="%f"):
+    """Values as they are read back after writing them with fmt"""
+    return np.char.mod(fmt, np.asarray(values,np.double)).astype(np.double)
+
+def getSidecarFile(fn):
+    return os.path.splitext(fn)[0]+".npz"
+
+def writeSidecar(fn, arrays):
+    """Save arrays in a binary file along fn. They are tied to the current contents of fn"""
+    arrays["md5"] = np.array(getMD5String(fn))
+    np.savez(getSidecarFile(fn), **arrays)
+
+def readSidecar(fn):
+    """Arrays saved along fn or None if there are not or fn has changed since they were written"""
+    fnSidecar = getSidecarFile(fn)
+    if not os.path.exists(fnSidecar):
+        return None
+    try:
+        fh = np.load(fnSidecar)
+        arrays = dict((key, fh[key]) for key in fh.files)
+        fh.close()
+    except Exception:
+        print("Cannot read %s, it is ignored"%fnSidecar)
+        return None
+    if str(arrays.get("md5")) != getMD5String(fn):
+        return None
+    return arrays
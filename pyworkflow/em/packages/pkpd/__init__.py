@@ -77,6 +77,7 @@ from protocol_pkpd_monocompartment_pd import ProtPKPDMonoCompartmentPD
 from protocol_pkpd_twocompartments_both_pd import ProtPKPDTwoCompartmentsBothPD
 from protocol_pkpd_simulate_dose_escalation import ProtPKPDSimulateDoseEscalation
 from protocol_pkpd_dose_escalation import ProtPKPDDoseEscalation
+from protocol_pkpd_simulate_dose_escalation_trials import ProtPKPDSimulateDoseEscalationTrials
 
 from protocol_batch_create_experiment import BatchProtCreateExperiment
 
@@ -53,6 +53,13 @@ class PDLinear(PDGenericModel):
         self.yPredicted = [self.yPredicted] # From array(...) to [array(...)]
         return self.yPredicted
 
+    def forwardModelJacobian(self, parameters, x=None):
+        if x == None:
+            x = self.x
+        xToUse = x[0] if type(x)==list else x # From [array(...)] to array(...)
+        J = np.column_stack([np.ones(xToUse.shape[0]), xToUse])
+        return [J]
+
     def getDescription(self):
         return "Linear (%s)"%self.__class__.__name__
 
@@ -115,6 +122,17 @@ class PDLogLinear(PDGenericModel):
         self.yPredicted = [self.yPredicted] # From array(...) to [array(...)]
         return self.yPredicted
 
+    def forwardModelJacobian(self, parameters, x=None):
+        if x == None:
+            x = self.x
+        xToUse = x[0] if type(x)==list else x # From [array(...)] to array(...)
+        m = parameters[0]
+        C0 = parameters[1]
+        valid = np.logical_and(np.isfinite(xToUse),xToUse>C0)
+        xprime = np.where(valid,xToUse-C0,1)
+        J = np.column_stack([np.where(valid,np.log(xprime),0), np.where(valid,-m/xprime,0)])
+        return [J]
+
     def getDescription(self):
         return "Log-Linear (%s)"%self.__class__.__name__
 
@@ -183,6 +201,16 @@ class PDSaturated(PDGenericModel):
         self.yPredicted = [self.yPredicted] # From array(...) to [array(...)]
         return self.yPredicted
 
+    def forwardModelJacobian(self, parameters, x=None):
+        if x == None:
+            x = self.x
+        xToUse = x[0] if type(x)==list else x # From [array(...)] to array(...)
+        emax = parameters[1]
+        eC50 = parameters[2]
+        den = eC50 + xToUse
+        J = np.column_stack([np.ones(xToUse.shape[0]), xToUse/den, -emax*xToUse/den**2])
+        return [J]
+
     def getDescription(self):
         return "Saturated (%s)"%self.__class__.__name__
 
@@ -251,6 +279,21 @@ class PDSigmoid(PDGenericModel):
         self.yPredicted = [self.yPredicted] # From array(...) to [array(...)]
         return self.yPredicted
 
+    def forwardModelJacobian(self, parameters, x=None):
+        if x == None:
+            x = self.x
+        xToUse = x[0] if type(x)==list else x # From [array(...)] to array(...)
+        emax = parameters[1]
+        eC50 = parameters[2]
+        h = parameters[3]
+        eC50prime = eC50**h
+        xprime = xToUse**h
+        den = eC50prime + xprime
+        with np.errstate(divide='ignore', invalid='ignore'):
+            dh = emax*xprime*eC50prime*(np.log(xToUse)-math.log(eC50))/den**2
+        J = np.column_stack([np.ones(xToUse.shape[0]), xprime/den, -emax*xprime*h*eC50**(h-1)/den**2, np.where(xToUse>0,dh,0)])
+        return [J]
+
     def getDescription(self):
         return "Sigmoid (%s)"%self.__class__.__name__
 
@@ -325,6 +368,18 @@ class PDGompertz(PDGenericModel):
         self.yPredicted = [self.yPredicted] # From array(...) to [array(...)]
         return self.yPredicted
 
+    def forwardModelJacobian(self, parameters, x=None):
+        if x == None:
+            x = self.x
+        xToUse = x[0] if type(x)==list else x # From [array(...)] to array(...)
+        a = parameters[1]
+        b = parameters[2]
+        g = parameters[3]
+        d = np.exp(b - (g*xToUse))
+        expd = np.exp(-d)
+        J = np.column_stack([np.ones(xToUse.shape[0]), expd, -a*expd*d, a*expd*d*xToUse])
+        return [J]
+
 
     def getDescription(self):
         return "Gompertz (%s)"%self.__class__.__name__
@@ -404,6 +459,17 @@ class PDLogistic1(PDGenericModel):
         self.yPredicted = [self.yPredicted] # From array(...) to [array(...)]
         return self.yPredicted
 
+    def forwardModelJacobian(self, parameters, x=None):
+        if x == None:
+            x = self.x
+        xToUse = x[0] if type(x)==list else x # From [array(...)] to array(...)
+        a = parameters[1]
+        b = parameters[2]
+        g = parameters[3]
+        d = np.exp(b - (g * xToUse))
+        J = np.column_stack([np.ones(xToUse.shape[0]), 1/(1 + d), -a*d/(1 + d)**2, a*d*xToUse/(1 + d)**2])
+        return [J]
+
     def getDescription(self):
         return "Logistic1 (%s)" % self.__class__.__name__
 
@@ -484,6 +550,17 @@ class PDLogistic2(PDGenericModel):
         self.yPredicted = [self.yPredicted] # From array(...) to [array(...)]
         return self.yPredicted
 
+    def forwardModelJacobian(self, parameters, x=None):
+        if x == None:
+            x = self.x
+        xToUse = x[0] if type(x)==list else x # From [array(...)] to array(...)
+        a = parameters[1]
+        b = parameters[2]
+        g = parameters[3]
+        d = np.exp(b - (g * xToUse))
+        J = np.column_stack([np.ones(xToUse.shape[0]), -1/(a + d)**2, -d/(a + d)**2, d*xToUse/(a + d)**2])
+        return [J]
+
     def getDescription(self):
         return "Logistic2 (%s)" % self.__class__.__name__
 
@@ -565,6 +642,17 @@ class PDLogistic3(PDGenericModel):
         self.yPredicted = [self.yPredicted] # From array(...) to [array(...)]
         return self.yPredicted
 
+    def forwardModelJacobian(self, parameters, x=None):
+        if x == None:
+            x = self.x
+        xToUse = x[0] if type(x)==list else x # From [array(...)] to array(...)
+        a = parameters[1]
+        b = parameters[2]
+        g = parameters[3]
+        d = np.exp(-(g * xToUse))
+        J = np.column_stack([np.ones(xToUse.shape[0]), 1/(1 + b*d), -a*d/(1 + b*d)**2, a*b*d*xToUse/(1 + b*d)**2])
+        return [J]
+
     def getDescription(self):
         return "Logistic3 (%s)" % self.__class__.__name__
 
@@ -644,6 +732,17 @@ class PDLogistic4(PDGenericModel):
         self.yPredicted = [self.yPredicted] # From array(...) to [array(...)]
         return self.yPredicted
 
+    def forwardModelJacobian(self, parameters, x=None):
+        if x == None:
+            x = self.x
+        xToUse = x[0] if type(x)==list else x # From [array(...)] to array(...)
+        a = parameters[1]
+        b = parameters[2]
+        g = parameters[3]
+        d = np.exp(-(g * xToUse))
+        J = np.column_stack([np.ones(xToUse.shape[0]), -1/(a + b*d)**2, -d/(a + b*d)**2, b*d*xToUse/(a + b*d)**2])
+        return [J]
+
     def getDescription(self):
         return "Logistic4 (%s)" % self.__class__.__name__
 
@@ -723,6 +822,20 @@ class PDRichards(PDGenericModel):
         self.yPredicted = [self.yPredicted] # From array(...) to [array(...)]
         return self.yPredicted
 
+    def forwardModelJacobian(self, parameters, x=None):
+        if x == None:
+            x = self.x
+        xToUse = x[0] if type(x)==list else x # From [array(...)] to array(...)
+        a = parameters[1]
+        b = parameters[2]
+        g = parameters[3]
+        d = parameters[4]
+        p = np.exp(b-(g * xToUse))
+        q = (1+p)**(-1/d)
+        dp = -a/d*q/(1+p)*p # Derivative with respect to b-g*X
+        J = np.column_stack([np.ones(xToUse.shape[0]), q, dp, -dp*xToUse, a*q*np.log(1+p)/d**2])
+        return [J]
+
     def getDescription(self):
         return "Richards (%s)" % self.__class__.__name__
 
@@ -808,6 +921,21 @@ class PDMorgan(PDGenericModel):
         self.yPredicted = [self.yPredicted] # From array(...) to [array(...)]
         return self.yPredicted
 
+    def forwardModelJacobian(self, parameters, x=None):
+        if x == None:
+            x = self.x
+        xToUse = x[0] if type(x)==list else x # From [array(...)] to array(...)
+        b = parameters[1]
+        g = parameters[2]
+        a = parameters[3]
+        d = parameters[4]
+        xprime = xToUse**d
+        den = g + xprime
+        with np.errstate(divide='ignore', invalid='ignore'):
+            dd = (a-b)*g/den**2*xprime*np.log(xToUse)
+        J = np.column_stack([np.ones(xToUse.shape[0]), g/den, (b-a)*xprime/den**2, xprime/den, np.where(xToUse>0,dd,0)])
+        return [J]
+
     def getDescription(self):
         return "Morgan-Mercer-Flodin (%s)" % self.__class__.__name__
 
@@ -892,6 +1020,20 @@ class PDWeibull(PDGenericModel):
         self.yPredicted = [self.yPredicted] # From array(...) to [array(...)]
         return self.yPredicted
 
+    def forwardModelJacobian(self, parameters, x=None):
+        if x == None:
+            x = self.x
+        xToUse = x[0] if type(x)==list else x # From [array(...)] to array(...)
+        b = parameters[1]
+        g = parameters[2]
+        d = parameters[3]
+        xprime = xToUse**d
+        expx = np.exp(- g * xprime)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            dd = b*g*expx*xprime*np.log(xToUse)
+        J = np.column_stack([np.ones(xToUse.shape[0]), -expx, b*xprime*expx, np.where(xToUse>0,dd,0)])
+        return [J]
+
     def getDescription(self):
         return "Weibull (%s)" % self.__class__.__name__
 
@@ -969,6 +1111,21 @@ class PDHill(PDGenericModel):
         self.yPredicted = [self.yPredicted] # From array(...) to [array(...)]
         return self.yPredicted
 
+    def forwardModelJacobian(self, parameters, x=None):
+        if x == None:
+            x = self.x
+        xToUse = x[0] if type(x)==list else x # From [array(...)] to array(...)
+        b = parameters[1]
+        g = parameters[2]
+        d = parameters[3]
+        xprime = xToUse**d
+        gprime = g**d
+        den = gprime + xprime
+        with np.errstate(divide='ignore', invalid='ignore'):
+            dd = b*xprime*gprime*(np.log(xToUse)-math.log(g))/den**2
+        J = np.column_stack([np.ones(xToUse.shape[0]), xprime/den, -b*xprime*d*g**(d-1)/den**2, np.where(xToUse>0,dd,0)])
+        return [J]
+
     def getDescription(self):
         return "Hill (%s)" % self.__class__.__name__
 
@@ -1042,6 +1199,17 @@ class PDOQuigley0(PDGenericModel):
         self.yPredicted = [self.yPredicted] # From array(...) to [array(...)]
         return self.yPredicted
 
+    def forwardModelJacobian(self, parameters, x=None):
+        if x == None:
+            x = self.x
+        xToUse = x[0] if type(x)==list else x # From [array(...)] to array(...)
+        a = parameters[0]
+        s = (np.tanh(xToUse)+1)/2
+        with np.errstate(divide='ignore', invalid='ignore'):
+            da = s**a*np.log(s)
+        J = np.column_stack([np.where(s>0,da,0)])
+        return [J]
+
     def getDescription(self):
         return "OQuigley0 (%s)" % self.__class__.__name__
 
@@ -1096,6 +1264,19 @@ class PDOQuigley1(PDGenericModel):
         self.yPredicted = [self.yPredicted] # From array(...) to [array(...)]
         return self.yPredicted
 
+    def forwardModelJacobian(self, parameters, x=None):
+        if x == None:
+            x = self.x
+        xToUse = x[0] if type(x)==list else x # From [array(...)] to array(...)
+        x0 = parameters[0]
+        a = parameters[1]
+        tanhx = np.tanh(xToUse-x0)
+        s = (tanhx+1)/2
+        with np.errstate(divide='ignore', invalid='ignore'):
+            da = s**a*np.log(s)
+        J = np.column_stack([-a*s**(a-1)*(1-tanhx**2)/2, np.where(s>0,da,0)])
+        return [J]
+
     def getDescription(self):
         return "OQuigley1 (%s)" % self.__class__.__name__
 
@@ -1155,6 +1336,17 @@ class PDOQuigley2(PDGenericModel):
         self.yPredicted = [self.yPredicted] # From array(...) to [array(...)]
         return self.yPredicted
 
+    def forwardModelJacobian(self, parameters, x=None):
+        if x == None:
+            x = self.x
+        xToUse = x[0] if type(x)==list else x # From [array(...)] to array(...)
+        x0 = parameters[0]
+        g = parameters[1]
+        expx = np.exp(g * (xToUse - x0))
+        y = expx/(1+expx)
+        J = np.column_stack([-g*y*(1-y), (xToUse-x0)*y*(1-y)])
+        return [J]
+
     def getDescription(self):
         return "OQuigley2 (%s)" % self.__class__.__name__
 
@@ -86,6 +86,22 @@ class PKPDExponentialModel(PKGenericModel):
         self.yPredicted = [self.yPredicted] # From array(...) to [array(...)]
         return self.yPredicted
 
+    def forwardModelJacobian(self, parameters, x=None):
+        if x==None:
+            x=self.x
+        xToUse = x[0] # From [array(...)] to array(...)
+        J = np.zeros((xToUse.shape[0],2*self.Nexp))
+        for k in range(1,self.Nexp):
+            if parameters[2*(k-1)]<parameters[2*k]:
+                return [J] # The prediction is constant out of the valid region
+        for k in range(0,self.Nexp):
+            ck = parameters[2*k]
+            lk = parameters[2*k+1]
+            expx = np.exp(-lk*xToUse)
+            J[:,2*k] = expx
+            J[:,2*k+1] = -ck*xToUse*expx
+        return [J]
+
     def getDescription(self):
         return "Sum of exponentials (%s)"%self.__class__.__name__
 
@@ -303,6 +319,11 @@ class PK_Monocompartment(PKPDODEModel):
         # print("G t=",t," dD=",dD," incC=",dD/V)
         return dD/V
 
+    def getLinearSystem(self):
+        Cl=self.parameters[0]
+        V=self.parameters[1]
+        return np.array([[-Cl/V]]), np.array([1.0/V])
+
     def getResponseDimension(self):
         return 1
 
@@ -456,7 +477,15 @@ class PK_Twocompartments(PKPDODEModel):
 
     def G(self, t, dD):
         V=self.parameters[1]
-        return np.array([dD/V,0.0],np.double)
+        return np.array([dD/V,0.0*dD],np.double)
+
+    def getLinearSystem(self):
+        Cl=self.parameters[0]
+        V=self.parameters[1]
+        Clp=self.parameters[2]
+        Vp=self.parameters[3]
+        return np.array([[-(Cl+Clp)/V, Clp/V],
+                         [Clp/Vp,     -Clp/Vp]]), np.array([1.0/V,0.0])
 
     def getResponseDimension(self):
         return 1
@@ -555,7 +584,7 @@ class PK_TwocompartmentsClint(PKPDODEModel):
 
     def G(self, t, dD):
         V=self.parameters[2]
-        return np.array([dD/V,0.0],np.double)
+        return np.array([dD/V,0.0*dD],np.double)
 
     def getResponseDimension(self):
         return 1
@@ -672,7 +701,7 @@ class PK_TwocompartmentsClintMetabolite(PKPDODEModel):
 
     def G(self, t, dD):
         V=self.parameters[2]
-        return np.array([dD/V,0.0,0.0],np.double)
+        return np.array([dD/V,0.0*dD,0.0*dD],np.double)
 
     def getResponseDimension(self):
         return 2
@@ -812,7 +841,7 @@ class PK_TwocompartmentsAutoinduction(PKPDODEModel):
 
     def G(self, t, dD):
         V=self.parameters[3]
-        return np.array([dD/V,0.0,0.0],np.double)
+        return np.array([dD/V,0.0*dD,0.0*dD],np.double)
 
     def getResponseDimension(self):
         return 1
@@ -928,7 +957,14 @@ class PK_MonocompartmentUrine(PKPDODEModel):
 
     def G(self, t, dD):
         V=self.parameters[1]
-        return np.array([dD/V,0.0],np.double)
+        return np.array([dD/V,0.0*dD],np.double)
+
+    def getLinearSystem(self):
+        Cl=self.parameters[0]
+        V=self.parameters[1]
+        fe=self.parameters[2]
+        return np.array([[-Cl/V, 0.0],
+                         [fe*Cl, 0.0]]), np.array([1.0/V,0.0])
 
     def getResponseDimension(self):
         return 2
@@ -1009,11 +1045,11 @@ class PK_MonocompartmentLinkPD(PKPDODEModel):
         Vb=self.parameters[3]
         Q12 = Clb * (C-Cb)
 
-        return np.array([-(Cl*C + Q12)/V, 0.0, Q12/Vb],np.double)
+        return np.array([-(Cl*C + Q12)/V, 0.0*C, Q12/Vb],np.double)
 
     def G(self, t, dD):
         V=self.parameters[1]
-        return np.array([dD/V,0.0,0.0],np.double)
+        return np.array([dD/V,0.0*dD,0.0*dD],np.double)
 
     def H(self, y):
         Cb = y[2]
@@ -1022,9 +1058,9 @@ class PK_MonocompartmentLinkPD(PKPDODEModel):
         a=self.parameters[5]
         b=self.parameters[6]
         Cbm=self.parameters[7]
-        Cbb=math.pow(Cb,b)
+        Cbb=np.power(Cb,b)
 
-        y[1]=E0*(1+a*Cbb/(math.pow(Cbm,b)+Cbb))
+        y[1]=E0*(1+a*Cbb/(np.power(Cbm,b)+Cbb))
 
     def getResponseDimension(self):
         return 2
@@ -1089,11 +1125,11 @@ class PK_MonocompartmentPD(PKPDODEModel):
         Cl=self.parameters[0]
         V=self.parameters[1]
 
-        return np.array([-Cl*C/V, 0.0],np.double)
+        return np.array([-Cl*C/V, 0.0*C],np.double)
 
     def G(self, t, dD):
         V=self.parameters[1]
-        return np.array([dD/V,0.0],np.double)
+        return np.array([dD/V,0.0*dD],np.double)
 
     def H(self, y):
         C = y[0]
@@ -1102,12 +1138,11 @@ class PK_MonocompartmentPD(PKPDODEModel):
         a=self.parameters[3]
         b=self.parameters[4]
         Cm=self.parameters[5]
-        try:
-            Cb=math.pow(C,b)
-            Cmb=math.pow(Cm,b)
-            y[1] = E0*(1+a*Cb/(Cmb+Cb))
-        except:
-            y[1] = E0
+        with np.errstate(all='ignore'):
+            Cb=np.power(C,b)
+            Cmb=np.power(Cm,b)
+            E = E0*(1+a*Cb/(Cmb+Cb))
+        y[1] = np.where(np.isfinite(E),E,E0)
 
     def getResponseDimension(self):
         return 2
@@ -1177,7 +1212,17 @@ class PK_TwocompartmentsUrine(PKPDODEModel):
 
     def G(self, t, dD):
         V=self.parameters[1]
-        return np.array([dD/V,0.0,0.0],np.double)
+        return np.array([dD/V,0.0*dD,0.0*dD],np.double)
+
+    def getLinearSystem(self):
+        Cl=self.parameters[0]
+        V=self.parameters[1]
+        Clp=self.parameters[2]
+        Vp=self.parameters[3]
+        fe=self.parameters[4]
+        return np.array([[-(Cl+Clp)/V, 0.0, Clp/V],
+                         [fe*Cl,       0.0, 0.0],
+                         [Clp/Vp,      0.0, -Clp/Vp]]), np.array([1.0/V,0.0,0.0])
 
     def getResponseDimension(self):
         return 2
@@ -1298,11 +1343,11 @@ class PK_TwocompartmentsBothPD(PKPDODEModel):
         Cp=y[1]
 
         Q12 = Clp * (C-Cp)
-        return np.array([-(Cl*C + Q12)/V, Q12/Vp, 0.0],np.double)
+        return np.array([-(Cl*C + Q12)/V, Q12/Vp, 0.0*C],np.double)
 
     def G(self, t, dD):
         V=self.parameters[1]
-        return np.array([dD/V,0.0,0.0],np.double)
+        return np.array([dD/V,0.0*dD,0.0*dD],np.double)
 
     def H(self, y):
         Cp = y[1]
@@ -1311,12 +1356,11 @@ class PK_TwocompartmentsBothPD(PKPDODEModel):
         a=self.parameters[5]
         b=self.parameters[6]
         Cpm=self.parameters[7]
-        try:
-            Cpb=math.pow(Cp,b)
-            Cpmb=math.pow(Cpm,b)
-            y[2] = E0*(1+a*Cpb/(math.pow(Cpm,b)+Cpb))
-        except:
-            y[2] = E0
+        with np.errstate(all='ignore'):
+            Cpb=np.power(Cp,b)
+            Cpmb=np.power(Cpm,b)
+            E = E0*(1+a*Cpb/(Cpmb+Cpb))
+        y[2] = np.where(np.isfinite(E),E,E0)
 
     def getResponseDimension(self):
         return 3
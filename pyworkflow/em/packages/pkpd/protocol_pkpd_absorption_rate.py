@@ -25,6 +25,7 @@
 # **************************************************************************
 
 import pyworkflow.protocol.params as params
+from pyworkflow.em.protocol.protocol_pkpd import addDEToForm
 from protocol_pkpd_fit_base import ProtPKPDFitBase
 from pk_models import PKPDSimpleEVModel
 from pyworkflow.em.pkpd_units import strUnit
@@ -61,6 +62,7 @@ class ProtPKPDAbsorptionRate(ProtPKPDFitBase):
                       help='Confidence interval for the fitted parameters')
         form.addParam('includeTlag', params.BooleanParam, label="Include tlag", default=True, expertLevel=LEVEL_ADVANCED,
                       help='Calculate the delay between administration and absorption')
+        addDEToForm(form)
         self.fitType=Integer() # Logarithmic fit
         self.fitType.set(1)
 
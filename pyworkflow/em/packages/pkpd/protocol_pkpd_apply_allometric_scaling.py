@@ -86,8 +86,7 @@ class ProtPKPDApplyAllometricScaling(ProtPKPD):
                     a = scaleModel.models[varName][1]
                     targetValue = k*math.pow(targetWeight,a)
                     currentValue = k*math.pow(sampleWeight,a)
-                    for j in range(sampleFit.parameters.shape[0]):
-                        sampleFit.parameters[j][idx] *= targetValue/currentValue
+                    sampleFit.parameters[:,idx] *= targetValue/currentValue
 
         self.experiment.write(self._getPath("experiment.pkpd"))
         self.population.fnExperiment.set(self._getPath("experiment.pkpd"))
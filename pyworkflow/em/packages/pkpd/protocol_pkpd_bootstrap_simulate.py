@@ -26,7 +26,6 @@
 
 import numpy as np
 import math
-import random
 
 import pyworkflow.protocol.params as params
 from pyworkflow.em.data import PKPDExperiment, PKPDDose, PKPDSample, PKPDVariable
@@ -81,6 +80,11 @@ class ProtPKPDODESimulate(ProtPKPDODEBase):
                       help='Confidence interval for the fitted parameters', condition="addStats and paramsSource==0")
         form.addParam('addIndividuals', params.BooleanParam, label="Add individual simulations", default=False, condition="paramsSource==0", expertLevel=LEVEL_ADVANCED,
                       help="Individual simulations are added to the output")
+        form.addParam('batch', params.BooleanParam, label="Simulate in batch", default=False, expertLevel=LEVEL_ADVANCED,
+                      help="All parameter sets are simulated together and the NCA of all profiles is computed at once. "
+                           "This is much faster for large populations. Linear models are solved analytically and nonlinear models "
+                           "are integrated together with the Runge-Kutta scheme. With an adaptive integrator each parameter set "
+                           "is still integrated separately. The NCA of each simulation is not reported")
 
     #--------------------------- INSERT steps functions --------------------------------------------
     def _insertAllSteps(self):
@@ -96,31 +100,37 @@ class ProtPKPDODESimulate(ProtPKPDODEBase):
         newSample.doseDictPtr = self.outputExperiment.doses
         newSample.descriptors = {}
         newSample.doseList = [doseName]
+        # y may be a list with one profile per response or a matrix with one response per column
         if type(self.varNameY)!=list:
             newSample.addMeasurementPattern([self.varNameY])
             newSample.addMeasurementColumn("t", simulationsX)
-            newSample.addMeasurementColumn(self.varNameY,y)
+            newSample.addMeasurementColumn(self.varNameY,np.ravel(y))
         else:
             for j in range(len(self.varNameY)):
                 newSample.addMeasurementPattern([self.varNameY[j]])
             newSample.addMeasurementColumn("t", simulationsX)
             for j in range(len(self.varNameY)):
-                newSample.addMeasurementColumn(self.varNameY[j], y[j])
+                newSample.addMeasurementColumn(self.varNameY[j], y[j] if type(y)==list else y[:,j])
         newSample.descriptors["AUC0t"] = self.AUC0t
         newSample.descriptors["AUMC0t"] = self.AUMC0t
         newSample.descriptors["MRT"] = self.MRT
         self.outputExperiment.samples[sampleName] = newSample
 
-    def NCA(self,t,C):
-        AUClist = []
-        AUMClist = []
-        Cminlist = []
-        Cavglist = []
-        Cmaxlist = []
-        Tmaxlist = []
-        Tminlist = []
+    def NCAbatch(self,t,C):
+        """
+        NCA of N profiles at once, C is a N x len(t) matrix. Returns a dictionary with N x Nperiods matrices
+        (AUC, AUMC, Cmin, Tmin, Cmax, Tmax, Cavg) with the values at each dosing period.
+        """
+        t = np.asarray(t,np.double)
+        C = np.atleast_2d(np.asarray(C,np.double))
+        N = C.shape[0]
+        rows = np.arange(N)
         Ndoses=len(self.drugSource.parsedDoseList)
-        for ndose in range(0,max(Ndoses-1,1)):
+        Nperiods=max(Ndoses-1,1)
+        nca = {}
+        for key in ["AUC","AUMC","Cmin","Tmin","Cmax","Tmax","Cavg"]:
+            nca[key] = np.zeros((N,Nperiods))
+        for ndose in range(0,Nperiods):
             tperiod0 = self.drugSource.parsedDoseList[ndose].t0
             if ndose+1<Ndoses:
                 tperiodF = self.drugSource.parsedDoseList[ndose+1].t0-self.model.deltaT
@@ -128,44 +138,45 @@ class ProtPKPDODESimulate(ProtPKPDODEBase):
                 tperiodF =  np.max(t)-1
             idx0 = find_nearest(t,tperiod0)
             idxF = find_nearest(t,tperiodF)
-
-            AUC0t = 0
-            AUMC0t = 0
             t0 = t[idx0+1]
-            for idx in range(idx0,idxF+1):
-                dt = (t[idx+1]-t[idx])
-                if C[idx+1]>=C[idx]: # Trapezoidal in the raise
-                    AUC0t  += 0.5*dt*(C[idx]+C[idx+1])
-                    AUMC0t += 0.5*dt*(C[idx]*t[idx]+C[idx+1]*t[idx+1])
-                else: # Log-trapezoidal in the decay
-                    decrement = C[idx]/C[idx+1]
-                    K = math.log(decrement)
-                    B = K/dt
-                    AUC0t  += dt*(C[idx]-C[idx+1])/K
-                    AUMC0t += (C[idx]*(t[idx]-tperiod0)-C[idx+1]*(t[idx+1]-tperiod0))/B-(C[idx+1]-C[idx])/(B*B)
-
-                if idx==idx0:
-                    Cmax=C[idx]
-                    Tmax=t[idx]-t0
-                    Cmin=C[idx]
-                    Tmin=t[idx]-t0
-                else:
-                    if C[idx]<Cmin:
-                        Cmin=C[idx]
-                        Tmin=t[idx]-t0
-                    elif C[idx]>Cmax:
-                        Cmax=C[idx]
-                        Tmax=t[idx]-t0
-                        if ndose==0:
-                            Cmin=C[idx]
-                            Tmin=t[idx]-t0
-            AUClist.append(AUC0t)
-            AUMClist.append(AUMC0t)
-            Cminlist.append(Cmin)
-            Cmaxlist.append(Cmax)
-            Tmaxlist.append(Tmax)
-            Tminlist.append(Tmin)
-            Cavglist.append(AUC0t/(t[idxF]-t[idx0]))
+
+            # Trapezoidal in the raise, log-trapezoidal in the decay
+            ta = t[idx0:idxF+1]
+            tb = t[idx0+1:idxF+2]
+            dt = tb-ta
+            Ca = C[:,idx0:idxF+1]
+            Cb = C[:,idx0+1:idxF+2]
+            rise = Cb>=Ca
+            with np.errstate(divide='ignore',invalid='ignore'):
+                K = np.log(Ca/Cb)
+                B = K/dt
+                AUC = np.where(rise, 0.5*dt*(Ca+Cb), dt*(Ca-Cb)/K)
+                AUMC = np.where(rise, 0.5*dt*(Ca*ta+Cb*tb), (Ca*(ta-tperiod0)-Cb*(tb-tperiod0))/B-(Cb-Ca)/(B*B))
+            nca["AUC"][:,ndose] = np.sum(AUC,axis=1)
+            nca["AUMC"][:,ndose] = np.sum(AUMC,axis=1)
+
+            # In the first dose, the minimum is searched after the maximum
+            kmax = np.argmax(Ca,axis=1)
+            if ndose==0:
+                kmin = np.argmin(np.where(np.arange(Ca.shape[1])>=kmax[:,np.newaxis],Ca,np.inf),axis=1)
+            else:
+                kmin = np.argmin(Ca,axis=1)
+            nca["Cmax"][:,ndose] = Ca[rows,kmax]
+            nca["Tmax"][:,ndose] = ta[kmax]-t0
+            nca["Cmin"][:,ndose] = Ca[rows,kmin]
+            nca["Tmin"][:,ndose] = ta[kmin]-t0
+            nca["Cavg"][:,ndose] = nca["AUC"][:,ndose]/(t[idxF]-t[idx0])
+        return nca
+
+    def NCA(self,t,C):
+        nca = self.NCAbatch(t,np.ravel(C))
+        AUClist = nca["AUC"][0]
+        AUMClist = nca["AUMC"][0]
+        Cminlist = nca["Cmin"][0]
+        Cavglist = nca["Cavg"][0]
+        Cmaxlist = nca["Cmax"][0]
+        Tmaxlist = nca["Tmax"][0]
+        Tminlist = nca["Tmin"][0]
 
         print("Fluctuation = Cmax/Cmin")
         print("Accumulation(1) = Cavg(n)/Cavg(1) %")
@@ -243,6 +254,7 @@ class ProtPKPDODESimulate(ProtPKPDODEBase):
         self.model.setExperiment(self.outputExperiment)
         if hasattr(self.protODE,"deltaT"):
             self.model.deltaT = self.protODE.deltaT.get()
+        self.model.integrator = self.protODE.getIntegrator()
         self.model.setXVar(self.varNameX)
         self.model.setYVar(self.varNameY)
         Nsamples = int(60*math.ceil((self.tF.get()-self.t0.get())/self.model.deltaT))+1
@@ -271,9 +283,16 @@ class ProtPKPDODESimulate(ProtPKPDODEBase):
         # Dunits = self.outputExperiment.doses[dosename].dunits
         # Cunits = self.experiment.variables[self.varNameY].units
 
-        # Process user parameters
+        # Draw all the parameters to simulate
         if self.paramsSource==ProtPKPDODESimulate.PRM_POPULATION:
+            # Take parameters randomly from the population
             Nsimulations = self.Nsimulations.get()
+            sampleFits = self.fitting.sampleFits
+            Nrows = np.asarray([sampleFit.getNumberOfReplicas() for sampleFit in sampleFits])
+            nfit = np.random.randint(0,len(sampleFits),Nsimulations)
+            nprm = (np.random.uniform(0,1,Nsimulations)*Nrows[nfit]).astype(int)
+            allParameters = self.fitting.getAllParameters()
+            parametersBatch = allParameters[np.cumsum(Nrows)[nfit]-Nrows[nfit]+nprm,:]
         else:
             lines = self.prmUser.get().strip().replace('\n',';;').split(';;')
             Nsimulations = len(lines)
@@ -281,89 +300,112 @@ class ProtPKPDODESimulate(ProtPKPDODEBase):
             for line in lines:
                 tokens = line.strip().split(',')
                 prmUser.append([float(token) for token in tokens])
+            parametersBatch = np.asarray(prmUser,np.double)
+
+        # Create AUC, AUMC, MRT variables and units
+        if type(self.varNameY)!=list:
+            self.Cunits = self.experiment.variables[self.varNameY].units
+        else:
+            self.Cunits = self.experiment.variables[self.varNameY[0]].units
+        self.AUCunits = multiplyUnits(tvar.units.unit, self.Cunits.unit)
+        self.AUMCunits = multiplyUnits(tvar.units.unit, self.AUCunits)
+
+        if self.addStats or self.addIndividuals:
+            AUCvar = PKPDVariable()
+            AUCvar.varName = "AUC0t"
+            AUCvar.varType = PKPDVariable.TYPE_NUMERIC
+            AUCvar.role = PKPDVariable.ROLE_LABEL
+            AUCvar.units = createUnit(strUnit(self.AUCunits))
+
+            AUMCvar = PKPDVariable()
+            AUMCvar.varName = "AUMC0t"
+            AUMCvar.varType = PKPDVariable.TYPE_NUMERIC
+            AUMCvar.role = PKPDVariable.ROLE_LABEL
+            AUMCvar.units = createUnit(strUnit(self.AUMCunits))
+
+            MRTvar = PKPDVariable()
+            MRTvar.varName = "MRT"
+            MRTvar.varType = PKPDVariable.TYPE_NUMERIC
+            MRTvar.role = PKPDVariable.ROLE_LABEL
+            MRTvar.units = createUnit("min")
+
+            self.outputExperiment.variables["AUC0t"] = AUCvar
+            self.outputExperiment.variables["AUMC0t"] = AUMCvar
+            self.outputExperiment.variables["MRT"] = MRTvar
 
         # Simulate the different responses
         simulationsX = self.model.x
         simulationsY = np.zeros((Nsimulations,len(simulationsX),self.getResponseDimension()))
-        AUCarray = np.zeros(Nsimulations)
-        AUMCarray = np.zeros(Nsimulations)
-        MRTarray = np.zeros(Nsimulations)
-        CminArray = np.zeros(Nsimulations)
-        CmaxArray = np.zeros(Nsimulations)
-        CavgArray = np.zeros(Nsimulations)
-        fluctuationArray = np.zeros(Nsimulations)
-        percentageAccumulationArray = np.zeros(Nsimulations)
-        for i in range(0,Nsimulations):
+        addIndividuals = self.addIndividuals or self.paramsSource==ProtPKPDODESimulate.PRM_USER_DEFINED
+        if self.batch:
+            print("Simulating %d samples in batch"%Nsimulations)
             self.setTimeRange(None)
-
-            if self.paramsSource==ProtPKPDODESimulate.PRM_POPULATION:
-                # Take parameters randomly from the population
-                nfit = int(random.uniform(0,len(self.fitting.sampleFits)))
-                sampleFit = self.fitting.sampleFits[nfit]
-                nprm = int(random.uniform(0,sampleFit.parameters.shape[0]))
-                parameters = sampleFit.parameters[nprm,:]
-            else:
-                parameters = np.asarray(prmUser[i],np.double)
-            print("Simulated sample %d: %s"%(i,str(parameters)))
-
-            # Prepare source and this object
             self.drugSource.setDoses(auxSample.parsedDoseList, self.model.t0, self.model.tF)
             self.protODE.configureSource(self.drugSource)
             self.model.drugSource = self.drugSource
             parameterNames = self.getParameterNames() # Necessary to count the number of source and PK parameters
-
-            # Prepare the model
-            self.setParameters(parameters)
-            y = self.forwardModel(parameters, [simulationsX]*self.getResponseDimension())
-
-            # Create AUC, AUMC, MRT variables and units
-            if i == 0:
-                if type(self.varNameY)!=list:
-                    self.Cunits = self.experiment.variables[self.varNameY].units
-                else:
-                    self.Cunits = self.experiment.variables[self.varNameY[0]].units
-                self.AUCunits = multiplyUnits(tvar.units.unit, self.Cunits.unit)
-                self.AUMCunits = multiplyUnits(tvar.units.unit, self.AUCunits)
-
-                if self.addStats or self.addIndividuals:
-                    AUCvar = PKPDVariable()
-                    AUCvar.varName = "AUC0t"
-                    AUCvar.varType = PKPDVariable.TYPE_NUMERIC
-                    AUCvar.role = PKPDVariable.ROLE_LABEL
-                    AUCvar.units = createUnit(strUnit(self.AUCunits))
-
-                    AUMCvar = PKPDVariable()
-                    AUMCvar.varName = "AUMC0t"
-                    AUMCvar.varType = PKPDVariable.TYPE_NUMERIC
-                    AUMCvar.role = PKPDVariable.ROLE_LABEL
-                    AUMCvar.units = createUnit(strUnit(self.AUMCunits))
-
-                    MRTvar = PKPDVariable()
-                    MRTvar.varName = "MRT"
-                    MRTvar.varType = PKPDVariable.TYPE_NUMERIC
-                    MRTvar.role = PKPDVariable.ROLE_LABEL
-                    MRTvar.units = createUnit("min")
-
-                    self.outputExperiment.variables["AUC0t"] = AUCvar
-                    self.outputExperiment.variables["AUMC0t"] = AUMCvar
-                    self.outputExperiment.variables["MRT"] = MRTvar
+            yBatch = self.forwardModelBatch(parametersBatch, [simulationsX]*self.getResponseDimension())
+            for j in range(self.getResponseDimension()):
+                simulationsY[:,:,j] = yBatch[j]
 
             # Evaluate AUC, AUMC and MRT in the last full period
-            self.NCA(self.model.x,y[0])
-
-            # Keep results
-            for j in range(self.getResponseDimension()):
-                simulationsY[i,:,j] = y[j]
-            AUCarray[i] = self.AUC0t
-            AUMCarray[i] = self.AUMC0t
-            MRTarray[i] = self.MRT
-            CminArray[i] = self.Cmin
-            CmaxArray[i] = self.Cmax
-            CavgArray[i] = self.Cavg
-            fluctuationArray[i] = self.fluctuation
-            percentageAccumulationArray[i] = self.percentageAccumulation
-            if self.addIndividuals or self.paramsSource==ProtPKPDODESimulate.PRM_USER_DEFINED:
-                self.addSample("Simulation_%d"%i, dosename, simulationsX, y)
+            nca = self.NCAbatch(self.model.x,simulationsY[:,:,0])
+            AUCarray = nca["AUC"][:,-1]
+            AUMCarray = nca["AUMC"][:,-1]
+            MRTarray = AUMCarray/AUCarray
+            CminArray = nca["Cmin"][:,-1]
+            CmaxArray = nca["Cmax"][:,-1]
+            CavgArray = nca["Cavg"][:,-1]
+            fluctuationArray = CmaxArray/CminArray
+            percentageAccumulationArray = CavgArray/nca["Cavg"][:,0]
+            if addIndividuals:
+                for i in range(0,Nsimulations):
+                    self.AUC0t = AUCarray[i]
+                    self.AUMC0t = AUMCarray[i]
+                    self.MRT = MRTarray[i]
+                    self.addSample("Simulation_%d"%i, dosename, simulationsX,
+                                   [simulationsY[i,:,j] for j in range(self.getResponseDimension())])
+        else:
+            AUCarray = np.zeros(Nsimulations)
+            AUMCarray = np.zeros(Nsimulations)
+            MRTarray = np.zeros(Nsimulations)
+            CminArray = np.zeros(Nsimulations)
+            CmaxArray = np.zeros(Nsimulations)
+            CavgArray = np.zeros(Nsimulations)
+            fluctuationArray = np.zeros(Nsimulations)
+            percentageAccumulationArray = np.zeros(Nsimulations)
+            for i in range(0,Nsimulations):
+                self.setTimeRange(None)
+
+                parameters = parametersBatch[i,:]
+                print("Simulated sample %d: %s"%(i,str(parameters)))
+
+                # Prepare source and this object
+                self.drugSource.setDoses(auxSample.parsedDoseList, self.model.t0, self.model.tF)
+                self.protODE.configureSource(self.drugSource)
+                self.model.drugSource = self.drugSource
+                parameterNames = self.getParameterNames() # Necessary to count the number of source and PK parameters
+
+                # Prepare the model
+                self.setParameters(parameters)
+                y = self.forwardModel(parameters, [simulationsX]*self.getResponseDimension())
+
+                # Evaluate AUC, AUMC and MRT in the last full period
+                self.NCA(self.model.x,y[0])
+
+                # Keep results
+                for j in range(self.getResponseDimension()):
+                    simulationsY[i,:,j] = y[j]
+                AUCarray[i] = self.AUC0t
+                AUMCarray[i] = self.AUMC0t
+                MRTarray[i] = self.MRT
+                CminArray[i] = self.Cmin
+                CmaxArray[i] = self.Cmax
+                CavgArray[i] = self.Cavg
+                fluctuationArray[i] = self.fluctuation
+                percentageAccumulationArray[i] = self.percentageAccumulation
+                if addIndividuals:
+                    self.addSample("Simulation_%d"%i, dosename, simulationsX, y)
 
         # Report NCA statistics
         alpha_2 = (100-self.confidenceLevel.get())/2
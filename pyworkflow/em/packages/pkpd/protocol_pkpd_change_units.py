@@ -121,19 +121,9 @@ class ProtPKPDChangeUnits(ProtPKPD):
                 if variable.role == PKPDVariable.ROLE_LABEL:
                     varValue = float(sample.descriptors[variable.varName])
                     sample.descriptors[variable.varName] = K*varValue
-                elif variable.role == PKPDVariable.ROLE_MEASUREMENT:
-                    newValues = []
-                    for x in sample.getValues(variable.varName):
-                        if x=="NA" or x=="LLOQ" or x=="ULOQ":
-                            newValues.append(x)
-                        else:
-                            newValues.append(str(K*float(x)))
-                    sample.setValues(variable.varName,newValues)
-                elif variable.role == PKPDVariable.ROLE_TIME:
-                    newValues = []
-                    for x in sample.getValues(variable.varName):
-                        newValues.append(str(K*float(x)))
-                    sample.setValues(variable.varName,newValues)
+                elif variable.role == PKPDVariable.ROLE_MEASUREMENT or variable.role == PKPDVariable.ROLE_TIME:
+                    values, flags = sample.getMeasurementColumn(variable.varName)
+                    sample.setMeasurementColumn(variable.varName,convertUnits(values,currentUnit,newUnit),flags)
         variable.units = PKPDUnit()
         variable.units.unit = newUnit
 
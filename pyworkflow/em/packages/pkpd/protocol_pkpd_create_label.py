@@ -75,8 +75,9 @@ class ProtPKPDCreateLabel(ProtPKPD):
         for label, expression, unit, comment in izip_longest(labels,expressions,units,comments,fillvalue=""):
             labelToAdd = label.strip().replace(' ',"_")
             units = PKPDUnit(unit.strip())
+            varValues = self.experiment.evaluateExpression(expression.strip())
             for sampleName, sample in self.experiment.samples.iteritems():
-                varValue = sample.evaluateExpression(expression.strip())
+                varValue = varValues[sampleName]
                 self.experiment.addParameterToSample(sampleName, labelToAdd, units.unit, comment.strip(), varValue,
                                                      self.rewrite.get())
 
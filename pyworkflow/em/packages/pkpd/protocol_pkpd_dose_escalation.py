@@ -41,6 +41,88 @@ def ClopperPearson(k,n,alpha=0.05):
         hi = 1.0
     return [lo,hi]
 
+# Decisions of the cohort rules after n patients with k DLTs at the current dose
+STAY, ESCALATE, STOP = 0, 1, 2
+
+def cohortDecisionTable(rules, Nmax):
+    """Decision table[n,k]. rules is {n: (kEscalate, kStay)}: after n patients escalate with up to kEscalate DLTs,
+       stay with up to kStay DLTs and stop otherwise. Other cohort sizes stay at the current dose"""
+    table = np.full((Nmax+1,Nmax+1),STAY,dtype=int)
+    for n, (kEscalate, kStay) in rules.items():
+        table[n,:] = STOP
+        table[n,kEscalate+1:kStay+1] = STAY
+        table[n,:kEscalate+1] = ESCALATE
+    return table
+
+THREE_PLUS_THREE = cohortDecisionTable({3: (0,1), 6: (1,1)}, 6)
+BEST_OF_FIVE = cohortDecisionTable({3: (0,1), 4: (1,2), 5: (2,2)}, 5)
+
+def simulateCohortTrials(p, table, Ntrials):
+    """Simulate Ntrials trials of a cohort rule (3+3, best of 5) at the doses with DLT probabilities p.
+       Returns the index of the MTD of each trial (-1 if the lowest dose is not tolerated) and the number of
+       patients and DLTs per trial and dose"""
+    Ndoses = len(p)
+    dose = np.zeros(Ntrials,dtype=int)
+    n = np.zeros(Ntrials,dtype=int)
+    k = np.zeros(Ntrials,dtype=int)
+    mtd = np.zeros(Ntrials,dtype=int)
+    patients = np.zeros((Ntrials,Ndoses),dtype=int)
+    dlts = np.zeros((Ntrials,Ndoses),dtype=int)
+    active = np.arange(Ntrials)
+    while active.size>0:
+        d = dose[active]
+        dlt = np.random.uniform(size=active.size)<p[d]
+        n[active] += 1
+        k[active] += dlt
+        patients[active,d] += 1
+        dlts[active,d] += dlt
+        decision = table[n[active],k[active]]
+
+        stop = decision==STOP
+        mtd[active[stop]] = d[stop]-1
+        lastDose = np.logical_and(decision==ESCALATE, d==Ndoses-1)
+        mtd[active[lastDose]] = Ndoses-1
+        escalate = active[np.logical_and(decision==ESCALATE, d<Ndoses-1)]
+        dose[escalate] += 1
+        n[escalate] = 0
+        k[escalate] = 0
+        active = active[np.logical_not(np.logical_or(stop,lastDose))]
+    return mtd, patients, dlts
+
+UP_AND_DOWN, STORER_C, STORER_BC = range(3)
+
+def simulateSequentialTrials(p, rule, Ntrials, Npatients):
+    """Simulate Ntrials trials of Npatients under a patient by patient rule (up and down, Storer's C and BC)
+       at the doses with DLT probabilities p. The MTD is the dose of the next patient. Same outputs as
+       simulateCohortTrials"""
+    Ndoses = len(p)
+    trials = np.arange(Ntrials)
+    dose = np.zeros(Ntrials,dtype=int)
+    run = np.zeros(Ntrials,dtype=int) # Consecutive patients without DLT at the current dose
+    lastDLT = np.zeros(Ntrials,dtype=bool)
+    anyDLT = np.zeros(Ntrials,dtype=bool)
+    patients = np.zeros((Ntrials,Ndoses),dtype=int)
+    dlts = np.zeros((Ntrials,Ndoses),dtype=int)
+    for i in range(Npatients):
+        dlt = np.random.uniform(size=Ntrials)<p[dose]
+        patients[trials,dose] += 1
+        dlts[trials,dose] += dlt
+        run = np.where(dlt,0,run+1)
+        if rule==UP_AND_DOWN:
+            step = np.where(dlt,-1,1)
+        else:
+            step = np.where(dlt,-1,np.where(run>=2,1,0))
+            if rule==STORER_BC:
+                step = np.where(np.logical_and(dlt,lastDLT),-2,step)
+                # Stage 1 goes up until the first DLT
+                step = np.where(anyDLT,step,np.where(dlt,-1,1))
+        newDose = np.clip(dose+step,0,Ndoses-1)
+        run[newDose!=dose] = 0
+        dose = newDose
+        lastDLT = dlt
+        anyDLT = np.logical_or(anyDLT,dlt)
+    return dose, patients, dlts
+
 class ProtPKPDDoseEscalation(ProtPKPD):
     """ Given a set of binary responses (toxicity, response/not response, ...), estimate the next dose for a target response\n
         Protocol created by http://www.kinestatpharma.com\n"""
@@ -80,8 +80,8 @@ class ProtPKPDDropMeasurements(ProtPKPD):
             for varName in sample.measurementPattern:
                 if not varName in varsToDrop:
                     candidateSample.measurementPattern.append(varName)
-                    exec("candidateSample.measurement_%s = copy.copy(sample.measurement_%s)"%(varName,varName))
-            filteredExperiment.samples[candidateSample.varName] = candidateSample
+                    candidateSample.setMeasurementColumn(varName,*sample.getMeasurementColumn(varName))
+            filteredExperiment.samples[candidateSample.sampleName] = candidateSample
 
         self.writeExperiment(filteredExperiment,self._getPath("experiment.pkpd"))
         self.experiment = filteredExperiment
@@ -27,7 +27,7 @@
 import math
 
 import pyworkflow.protocol.params as params
-from pyworkflow.em.protocol.protocol_pkpd import ProtPKPD
+from pyworkflow.em.protocol.protocol_pkpd import ProtPKPD, addDEToForm
 from pyworkflow.em.data import PKPDExperiment, PKPDDEOptimizer, PKPDLSOptimizer, PKPDFitting, PKPDSampleFit
 from pyworkflow.protocol.constants import LEVEL_ADVANCED
 from pyworkflow.object import String, Integer
@@ -72,6 +72,7 @@ are independent, which are not. Use Bootstrap estimates instead.\n
         else:
             self.reportX=String()
             self.reportX.set("")
+        addDEToForm(form)
 
     def getListOfFormDependencies(self):
         return [self.predictor.get(), self.predicted.get(), self.fitType.get(), self.bounds.get()]
@@ -89,11 +89,11 @@ class ProtPKPDExportToCSV(ProtPKPD):
             sampleDict["SampleName"]=sampleName
             for descriptor,value in sample.descriptors.iteritems():
                 sampleDict[descriptor]=str(value)
+            values = dict((varName,sample.getValues(varName)) for varName in listOfVariables)
             for i in range(sample.getNumberOfMeasurements()):
                 lineDict=sampleDict.copy()
                 for varName in listOfVariables:
-                    aux = getattr(sample,"measurement_%s"%varName)
-                    lineDict[varName]=str(aux[i])
+                    lineDict[varName]=values[varName][i]
                 lineToPrint=linePattern%lineDict
                 fhOut.write(lineToPrint+"\n")
                 print(lineToPrint)
@@ -95,28 +95,28 @@ class ProtPKPDFilterMeasurements(ProtPKPD):
             candidateSample.sampleName         = copy.copy(sample.sampleName)
             candidateSample.doseList           = copy.copy(sample.doseList)
             candidateSample.descriptors        = copy.copy(sample.descriptors)
-            candidateSample.measurementPattern = copy.copy(sample.measurementPattern)
+            candidateSample.addMeasurementPattern([sample.sampleName]+sample.measurementPattern)
 
             N = 0 # Number of initial measurements
             if len(sample.measurementPattern)>0:
-                aux=getattr(sample,"measurement_%s"%sample.measurementPattern[0])
-                N = len(aux)
+                N = sample.getNumberOfMeasurements()
             if N==0:
                 continue
 
             # Create empty output variables
             Nvar = len(sample.measurementPattern)
             convertToFloat = []
+            values = []
             for i in range(0,Nvar):
-                exec("candidateSample.measurement_%s = []"%sample.measurementPattern[i])
                 convertToFloat.append(sample.variableDictPtr[sample.measurementPattern[i]].varType == PKPDVariable.TYPE_NUMERIC)
+                values.append(sample.getValues(sample.measurementPattern[i]))
 
             for n in range(0,N):
                 toAdd = []
                 okToAddTimePoint = True
                 conditionPython = copy.copy(condition)
                 for i in range(0,Nvar):
-                    exec("aux=sample.measurement_%s[%d]"%(sample.measurementPattern[i],n))
+                    aux=values[i][n]
                     if filterType=="rmNA":
                         if aux=="NA":
                             okToAddTimePoint = False
@@ -157,9 +157,9 @@ class ProtPKPDFilterMeasurements(ProtPKPD):
                         okToAddTimePoint = not okToAddTimePoint
                 if okToAddTimePoint:
                     for i in range(0,Nvar):
-                        exec("candidateSample.measurement_%s.append('%s')"%(sample.measurementPattern[i],toAdd[i]))
+                        candidateSample.addMeasurementToken(sample.measurementPattern[i],toAdd[i])
 
-            N = len(getattr(sample,"measurement_%s"%sample.measurementPattern[0])) # Number of final measurements
+            N = sample.getNumberOfMeasurements() # Number of final measurements
             if N!=0:
                 filteredExperiment.samples[candidateSample.sampleName] = candidateSample
                 for doseName in candidateSample.doseList:
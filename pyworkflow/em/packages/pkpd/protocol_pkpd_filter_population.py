@@ -26,9 +26,8 @@
 
 import pyworkflow.protocol.params as params
 from pyworkflow.em.protocol.protocol_pkpd import ProtPKPD
-from pyworkflow.em.data import PKPDFitting, PKPDSampleFitBootstrap
+from pyworkflow.em.data import PKPDFitting, PKPDSampleFitBootstrap, PKPDExpression
 import numpy as np
-import copy
 
 # TESTED in test_workflow_gabrielsson_pk02.py
 
@@ -72,19 +71,10 @@ class ProtPKPDFilterPopulation(ProtPKPD):
         self.fitting.modelDescription = self.population.modelDescription
 
         newSampleFit = PKPDSampleFitBootstrap()
-        newSampleFit.parameters = None
         filterType = self.filterType.get()
+        selectedFits = []
         for sampleFit in self.population.sampleFits:
             newSampleFit.sampleName = sampleFit.sampleName
-            if newSampleFit.parameters == None:
-                newSampleFit.parameters = np.empty((0,sampleFit.parameters.shape[1]))
-                newSampleFit.xB = []
-                newSampleFit.yB = []
-                newSampleFit.R2 = []
-                newSampleFit.R2adj = []
-                newSampleFit.AIC = []
-                newSampleFit.AICc = []
-                newSampleFit.BIC = []
 
             if filterType<=1:
                 conditionToEvaluate = self.condition.get()
@@ -105,27 +95,24 @@ class ProtPKPDFilterPopulation(ProtPKPD):
                 conditionToEvaluate = "%s>=%f and %s<=%f"%(tokens[0],limits[0],tokens[0],limits[1])
                 print("Condition to evaluate: %s"%conditionToEvaluate)
 
-            for n in range(0,len(sampleFit.R2)):
-                evaluatedCondition = copy.copy(conditionToEvaluate)
-                evaluatedCondition = evaluatedCondition.replace('$(R2)',"(%f)"%sampleFit.R2[n])
-                evaluatedCondition = evaluatedCondition.replace('$(R2adj)',"(%f)"%sampleFit.R2adj[n])
-                evaluatedCondition = evaluatedCondition.replace('$(AIC)',"(%f)"%sampleFit.AIC[n])
-                evaluatedCondition = evaluatedCondition.replace('$(AICc)',"(%f)"%sampleFit.AICc[n])
-                evaluatedCondition = evaluatedCondition.replace('$(BIC)',"(%f)"%sampleFit.BIC[n])
-
-                for j in range(len(self.population.modelParameters)):
-                    evaluatedCondition = evaluatedCondition.replace('$(%s)'%self.population.modelParameters[j],"(%f)"%sampleFit.parameters[n,j])
-                evaluatedCondition = eval(evaluatedCondition)
-                if (filterType==0 and not evaluatedCondition) or (filterType>=1 and evaluatedCondition):
-                    newSampleFit.parameters = np.vstack([newSampleFit.parameters, sampleFit.parameters[n,:]])
-                    newSampleFit.xB += sampleFit.xB
-                    newSampleFit.yB += sampleFit.yB
-                    newSampleFit.R2.append(sampleFit.R2[n])
-                    newSampleFit.R2adj.append(sampleFit.R2adj[n])
-                    newSampleFit.AIC.append(sampleFit.AIC[n])
-                    newSampleFit.AICc.append(sampleFit.AICc[n])
-                    newSampleFit.BIC.append(sampleFit.BIC[n])
+            # Evaluate the condition on all replicas at once
+            compiledCondition = PKPDExpression(conditionToEvaluate)
+            columns = []
+            for varName in compiledCondition.variables:
+                if varName in ['R2','R2adj','AIC','AICc','BIC']:
+                    columns.append(getattr(sampleFit,varName))
+                elif varName in self.population.modelParameters:
+                    columns.append(sampleFit.parameters[:,self.population.modelParameters.index(varName)])
+                else:
+                    raise Exception("Cannot find %s amongst the model variables"%varName)
+            evaluatedCondition = compiledCondition.evaluateColumns(columns,sampleFit.getNumberOfReplicas()).astype(np.bool)
+            if filterType==0:
+                keep = np.logical_not(evaluatedCondition)
+            else:
+                keep = evaluatedCondition
+            selectedFits.append(sampleFit.getReplicas(keep))
 
+        newSampleFit.concatenate(selectedFits)
         self.fitting.sampleFits.append(newSampleFit)
         self.fitting.write(self._getPath("bootstrapPopulation.pkpd"))
 
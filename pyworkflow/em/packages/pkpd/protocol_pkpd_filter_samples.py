@@ -28,7 +28,7 @@ import sys
 
 import pyworkflow.protocol.params as params
 from pyworkflow.em.protocol.protocol_pkpd import ProtPKPD
-from pyworkflow.em.data import PKPDExperiment, PKPDVariable
+from pyworkflow.em.data import PKPDExperiment, PKPDGroup
 
 
 class ProtPKPDFilterSamples(ProtPKPD):
@@ -75,42 +75,46 @@ class ProtPKPDFilterSamples(ProtPKPD):
         filteredExperiment.variables = copy.copy(experiment.variables)
         filteredExperiment.samples = {}
         filteredExperiment.doses = {}
+        filteredExperiment.vias = {}
+        filteredExperiment.groups = {}
 
-        # http://stackoverflow.com/questions/701802/how-do-i-execute-a-string-containing-python-code-in-python
-        safe_list = ['descriptors']
-        safe_dict = dict([ (k, locals().get(k, None)) for k in safe_list ])
-        usedDoses = []
-        for sampleKey, sample in experiment.samples.iteritems():
-            ok = filterType=="rmNA"
+        if filterType!="rmNA":
+            # The condition is evaluated for all samples at once, samples with NA values get None
             try:
-                if filterType == "rmNA":
-                    conditionPython = "True"
-                else:
-                    conditionPython = copy.copy(condition)
-                conditionPython = conditionPython.replace('$(sampleName)','"%s"'%sample.sampleName)
-                for key, variable in experiment.variables.iteritems():
-                    if key in sample.descriptors:
-                        value = sample.descriptors[key]
-                        if value=="NA":
-                            conditionPython="False"
-                        else:
-                            if filterType!="rmNA":
-                                if variable.varType == PKPDVariable.TYPE_NUMERIC:
-                                    conditionPython = conditionPython.replace("$(%s)"%key,"%f"%float(sample.descriptors[key]))
-                                else:
-                                    conditionPython = conditionPython.replace("$(%s)"%key,"'%s'"%sample.descriptors[key])
-                ok=eval(conditionPython, {"__builtins__" : {"True": True, "False": False} }, {})
+                conditionValues = experiment.evaluateExpression(condition)
             except:
-                print sys.exc_info()[0]
-                pass
+                # Evaluate it sample by sample so that only the samples with errors are affected
+                conditionValues = {}
+                for sampleKey, sample in experiment.samples.iteritems():
+                    try:
+                        conditionValues[sampleKey] = sample.evaluateExpression(condition)
+                    except:
+                        print sampleKey, sys.exc_info()[0]
+        usedDoses = []
+        for sampleKey, sample in experiment.samples.iteritems():
+            if filterType == "rmNA":
+                ok = True
+                for key in experiment.variables:
+                    if key in sample.descriptors and sample.descriptors[key]=="NA":
+                        ok = False
+                        break
+            else:
+                ok = conditionValues.get(sampleKey,False)
             if (ok and (filterType=="keep" or filterType=="rmNA")) or (not ok and filterType=="exclude"):
                 filteredExperiment.samples[sampleKey] = copy.copy(sample)
+                for groupName in sample.groupList:
+                    if not groupName in filteredExperiment.groups:
+                        filteredExperiment.groups[groupName] = PKPDGroup(groupName)
+                    filteredExperiment.groups[groupName].sampleList.append(sampleKey)
                 for doseName in sample.doseList:
                     usedDoses.append(doseName)
 
         if len(usedDoses)>0:
             for doseName in usedDoses:
                 filteredExperiment.doses[doseName] = copy.copy(experiment.doses[doseName])
+                viaName=experiment.doses[doseName].via.viaName
+                if not viaName in filteredExperiment.vias:
+                    filteredExperiment.vias[viaName] = copy.copy(experiment.vias[viaName])
 
         self.writeExperiment(filteredExperiment,self._getPath("experiment.pkpd"))
         self.experiment = filteredExperiment
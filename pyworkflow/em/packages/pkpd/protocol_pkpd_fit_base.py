@@ -199,6 +199,7 @@ class ProtPKPDFitBase(ProtPKPD):
             print(" ")
 
             optimizer1 = PKPDDEOptimizer(self.model,fitType)
+            self.setupDEOptimizer(optimizer1)
             optimizer1.optimize()
             optimizer2 = PKPDLSOptimizer(self.model,fitType)
             optimizer2.optimize()
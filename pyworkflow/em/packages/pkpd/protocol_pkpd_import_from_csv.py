@@ -212,10 +212,7 @@ class ProtPKPDImportFromCSV(ProtPKPDImportFromText):
                             if tokens[varNo]=="NA":
                                 ok = (varRole != PKPDVariable.ROLE_TIME)
                             if ok:
-                                if not hasattr(samplePtr,"measurement_%s"%varName):
-                                    setattr(samplePtr,"measurement_%s"%varName,[])
-                                    samplePtr.measurementPattern.append(varName)
-                                exec("samplePtr.measurement_%s.append('%s')"%(varName,tokens[varNo].strip()))
+                                samplePtr.addMeasurementToken(varName,tokens[varNo].strip())
                             else:
                                 raise Exception("Time measurements cannot be NA")
                     varNo+=1
@@ -27,8 +27,6 @@
 import pyworkflow.protocol.params as params
 from pyworkflow.em.protocol.protocol_pkpd import ProtPKPD
 from pyworkflow.em.data import PKPDFitting, PKPDSampleFitBootstrap
-import numpy as np
-import copy
 
 
 class ProtPKPDMergePopulations(ProtPKPD):
@@ -69,37 +67,7 @@ class ProtPKPDMergePopulations(ProtPKPD):
 
         newSampleFit = PKPDSampleFitBootstrap()
         newSampleFit.sampleName = "Merged population"
-        newSampleFit.parameters = None
-        for sampleFit in self.population1.sampleFits:
-            if newSampleFit.parameters == None:
-                newSampleFit.parameters = np.copy(sampleFit.parameters)
-                newSampleFit.xB = copy.copy(sampleFit.xB)
-                newSampleFit.yB = copy.copy(sampleFit.yB)
-                newSampleFit.R2 = copy.copy(sampleFit.R2)
-                newSampleFit.R2adj = copy.copy(sampleFit.R2adj)
-                newSampleFit.AIC = copy.copy(sampleFit.AIC)
-                newSampleFit.AICc = copy.copy(sampleFit.AICc)
-                newSampleFit.BIC = copy.copy(sampleFit.BIC)
-            else:
-                newSampleFit.parameters = np.vstack([newSampleFit.parameters, sampleFit.parameters])
-                newSampleFit.xB += sampleFit.xB
-                newSampleFit.yB += sampleFit.yB
-                newSampleFit.R2 += sampleFit.R2
-                newSampleFit.R2adj += sampleFit.R2adj
-                newSampleFit.AIC += sampleFit.AIC
-                newSampleFit.AICc += sampleFit.AICc
-                newSampleFit.BIC += sampleFit.BIC
-        for sampleFit in self.population2.sampleFits:
-            newSampleFit.parameters = np.vstack([newSampleFit.parameters, sampleFit.parameters])
-            print(type(newSampleFit.xB))
-            print(type(sampleFit.xB))
-            newSampleFit.xB += sampleFit.xB
-            newSampleFit.yB += sampleFit.yB
-            newSampleFit.R2 += sampleFit.R2
-            newSampleFit.R2adj += sampleFit.R2adj
-            newSampleFit.AIC += sampleFit.AIC
-            newSampleFit.AICc += sampleFit.AICc
-            newSampleFit.BIC += sampleFit.BIC
+        newSampleFit.concatenate(self.population1.sampleFits+self.population2.sampleFits)
         self.fitting.sampleFits.append(newSampleFit)
 
         self.fitting.write(self._getPath("bootstrapPopulation.pkpd"))
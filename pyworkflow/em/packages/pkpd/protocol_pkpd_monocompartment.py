@@ -58,6 +58,7 @@ are independent, which are not. Use Bootstrap estimates instead.\n
                       help="Bounds for the tlag (if it must be estimated), parameters for the source, clearance and volume. Example: (0.01,0.04);(0.2,0.4);(10,20). "\
                       'Make sure that the bounds are expressed in the expected units (estimated from the sample itself).'\
                       'Be careful that Cl bounds must be given here. If you have an estimate of the elimination rate, this is Ke=Cl/V. Consequently, Cl=Ke*V ')
+        form.addParallelSection(threads=1, mpi=0)
 
     def createModel(self):
         return PK_Monocompartment()
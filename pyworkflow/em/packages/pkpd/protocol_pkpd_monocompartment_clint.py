@@ -50,6 +50,7 @@ class ProtPKPDMonoCompartmentClint(ProtPKPDODEBase):
         form.addParam('bounds', params.StringParam, label="Parameter bounds ([tlag], sourceParameters, Vmax, Km, V)", default="",
                       help="Bounds for the tlag (if it must be estimated), parameters for the source, maximum processivity, Michaelis constant and volume. Example: (0.01,0.04);(0,10);(0.2,0.4);(10,20). "\
                       'Make sure that the bounds are expressed in the expected units (estimated from the sample itself).')
+        form.addParallelSection(threads=1, mpi=0)
 
     def createModel(self):
         return PK_MonocompartmentClint()
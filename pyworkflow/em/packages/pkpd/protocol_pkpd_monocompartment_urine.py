@@ -50,6 +50,7 @@ are independent, which are not. Use Bootstrap estimates instead.\n
                       help="Bounds for the tlag (if it must be estimated), clearance, volume and fraction excreted."\
                       'Make sure that the bounds are expressed in the expected units (estimated from the sample itself).'\
                       'If tlag must be estimated, its bounds must always be specified')
+        form.addParallelSection(threads=1, mpi=0)
 
     def getXYvars(self):
         self.varNameX=self.predictor.get()
@@ -31,9 +31,11 @@ from collections import OrderedDict
 import numpy as np
 
 import pyworkflow.protocol.params as params
-from pyworkflow.em.protocol.protocol_pkpd import ProtPKPD
-from pyworkflow.em.data import PKPDDEOptimizer, PKPDLSOptimizer, PKPDFitting, PKPDSampleFit, PKPDModelBase, PKPDModelBase2
+from pyworkflow.em.protocol.protocol_pkpd import ProtPKPD, addDEToForm
+from pyworkflow.em.data import PKPDDEOptimizer, PKPDLSOptimizer, PKPDFitting, PKPDSampleFit, PKPDModelBase, PKPDModelBase2, \
+    PKPDODEModel
 from pyworkflow.protocol.constants import LEVEL_ADVANCED
+from pyworkflow.utils.process import MethodPool
 from utils import parseRange
 from pyworkflow.em.biopharmaceutics import DrugSource
 
@@ -63,6 +65,12 @@ class ProtPKPDODEBase(ProtPKPD,PKPDModelBase2):
         fromTo.addParam('t0', params.StringParam, default="", label='Min (h)')
         fromTo.addParam('tF', params.StringParam, default="", label='Max (h)')
         fromTo.addParam('deltaT', params.FloatParam, default=0.5, label='Step (min)')
+        form.addParam('integrator', params.EnumParam, choices=["RK4 (fixed step)","RK45 (adaptive step)",
+                                                               "BDF (stiff)","LSODA (automatic stiffness detection)"],
+                      label="ODE integrator", default=0, expertLevel=LEVEL_ADVANCED,
+                      help='RK4 integrates with the fixed step given above. The adaptive integrators choose the step '
+                           'themselves and restart at every dose, BDF and LSODA are recommended for stiff models or '
+                           'long simulations. Linear models with simple vias are always solved analytically')
 
         form.addParam('fitType', params.EnumParam, choices=["Linear","Logarithmic","Relative"], label="Fit mode", default=1,
                       expertLevel=LEVEL_ADVANCED,
@@ -75,6 +83,7 @@ class ProtPKPDODEBase(ProtPKPD,PKPDModelBase2):
         form.addParam('globalSearch', params.BooleanParam, label="Global search", default=True, expertLevel=LEVEL_ADVANCED,
                       help='Global search looks for the best parameters within bounds. If it is not performed, the '
                            'middle of the bounding box is used as initial parameter for a local optimization')
+        addDEToForm(form, condition="globalSearch", batch=True)
 
     #--------------------------- INSERT steps functions --------------------------------------------
     def getListOfFormDependencies(self):
@@ -165,6 +174,13 @@ class ProtPKPDODEBase(ProtPKPD,PKPDModelBase2):
 
         if hasattr(self,"deltaT"):
             self.model.deltaT = self.deltaT.get()
+        self.model.integrator = self.getIntegrator()
+
+    def getIntegrator(self):
+        if hasattr(self,"integrator"):
+            return PKPDODEModel.INTEGRATORS[self.integrator.get()]
+        else:
+            return "RK4"
 
     # As model --------------------------------------------
     def clearGroupParameters(self):
@@ -284,6 +300,61 @@ class ProtPKPDODEBase(ProtPKPD,PKPDModelBase2):
         self.yPredicted = self.mergeLists(yPredictedList)
         return copy.copy(self.yPredicted)
 
+    def forwardModelBatch(self, parameters, x=None):
+        """
+        Evaluate N parameter vectors (rows of parameters) at once. Returns a list (one per response) of N x Nx
+        matrices, with the samples merged as in forwardModel.
+        """
+        parameters = np.atleast_2d(np.asarray(parameters,np.double))
+        parametersPK = parameters[:,-self.NparametersModel:]
+        yPredictedList = []
+        for n in range(len(self.modelList)):
+            if self.NparametersSource>0:
+                yPredictedList.append(self.forwardModelBatchSources(n, parameters[:,0:self.NparametersSource],
+                                                                    parametersPK, x))
+            else:
+                yPredictedList.append(self.modelList[n].forwardModelBatch(parametersPK,x))
+
+        if len(yPredictedList)>1:
+            return [np.hstack([yn[j] for yn in yPredictedList]) for j in range(len(yPredictedList[0]))]
+        else:
+            return yPredictedList[0]
+
+    def forwardModelBatchSources(self, n, parametersSource, parametersPK, x=None):
+        """
+        Batch simulation of the n-th sample when each row has its own drug source parameters. With RK4 the
+        release schedule of each row is passed to the model and all rows are integrated together. The rows
+        that forwardModel solves analytically, and those of the adaptive integrators, are simulated one by one.
+        """
+        model = self.modelList[n]
+        drugSource = self.drugSourceList[n]
+        N = parametersPK.shape[0]
+        previousParameters = model.parameters
+        model.parameters = parametersPK[0]
+        linear = model.getLinearSystem() is not None
+        model.parameters = previousParameters
+
+        Nsamples = int(math.ceil((model.tF-model.t0)/model.deltaT))+1
+        releasedHalfStep = np.zeros((Nsamples,N))
+        releasedStep = np.zeros((Nsamples,N))
+        yPredicted = [np.zeros((N,len(xj))) for xj in (model.x if x is None else x)]
+        batchRows = []
+        for i in range(N):
+            drugSource.setParameters(list(parametersSource[i]))
+            if model.integrator!="RK4" or (linear and drugSource.getReleaseEvents() is not None):
+                y = model.forwardModel(parametersPK[i],x)
+                for j in range(len(yPredicted)):
+                    yPredicted[j][i,:] = y[j]
+            else:
+                releasedHalfStep[:,i], releasedStep[:,i] = drugSource.getReleaseSchedule(model.t0, model.deltaT, Nsamples)
+                batchRows.append(i)
+        if len(batchRows)>0:
+            y = model.forwardModelBatch(parametersPK[batchRows,:], x,
+                                        (releasedHalfStep[:,batchRows], releasedStep[:,batchRows]))
+            for j in range(len(yPredicted)):
+                yPredicted[j][batchRows,:] = y[j]
+        return yPredicted
+
     def imposeConstraints(self,yt):
         self.model.imposeConstraints(yt)
 
@@ -360,113 +431,159 @@ class ProtPKPDODEBase(ProtPKPD,PKPDModelBase2):
         elif self.fitType.get()==2:
             fitType = "relative"
 
-        for groupName, group in self.experiment.groups.iteritems():
-            self.printSection("Fitting "+groupName)
-            self.clearGroupParameters()
-
-            for sampleName in group.sampleList:
-                print("   Sample "+sampleName)
-                sample = self.experiment.samples[sampleName]
-
-                self.createDrugSource()
-                self.setupModel()
-
-                # Get the values to fit
-                x, y = sample.getXYValues(self.varNameX,self.varNameY)
-                print("X= "+str(x))
-                print("Y= "+str(y))
-                print(" ")
-
-                # Interpret the dose
-                self.setTimeRange(sample)
-                sample.interpretDose()
-
-                self.drugSource.setDoses(sample.parsedDoseList, self.model.t0, self.model.tF)
-                self.configureSource(self.drugSource)
-                self.model.drugSource = self.drugSource
-
-                # Prepare the model
-                self.setBounds(sample)
-                self.setXYValues(x, y)
-                self.addSample(sample)
-                self.prepareForSampleAnalysis(sampleName)
-                self.calculateParameterUnits(sample)
-                if self.fitting.modelParameterUnits==None:
-                    self.fitting.modelParameterUnits = self.parameterUnits
-
-            self.printSetup()
-            self.x = self.mergeLists(self.XList)
-            self.y = self.mergeLists(self.YList)
+        groupNames = self.experiment.groups.keys()
+        Nprocesses = min(self.numberOfThreads.get(),len(groupNames))
+        if Nprocesses>1:
+            parameterNames, description = self.fitGroupsInParallel(groupNames, fitType, reportX, Nprocesses)
+        else:
+            for groupName in groupNames:
+                self.fitGroup(groupName, fitType, reportX)
+            parameterNames = self.getParameterNames()
+            description = self.getDescription()
 
-            if self.globalSearch:
-                optimizer1 = PKPDDEOptimizer(self,fitType)
-                optimizer1.optimize()
-            else:
-                self.parameters = np.zeros(len(self.boundsList),np.double)
-                n = 0
-                for bound in self.boundsList:
-                    self.parameters[n] = 0.5*(bound[0]+bound[1])
-                    n += 1
-            try:
-                optimizer2 = PKPDLSOptimizer(self,fitType)
-                optimizer2.optimize()
-            except Exception as e:
-                msg=str(e)
-                msg+="Errors in the local optimizer may be caused by starting from a bad initial guess\n"
-                msg+="Try performing a global search first or changing the bounding box"
-                raise Exception("Error in the local optimizer\n"+msg)
-            optimizer2.setConfidenceInterval(self.confidenceInterval.get())
-            self.setParameters(optimizer2.optimum)
-            optimizer2.evaluateQuality()
-
-            self.yPredictedList=self.separateLists(self.yPredicted)
-            self.yPredictedLowerList=self.separateLists(self.yPredictedLower)
-            self.yPredictedUpperList=self.separateLists(self.yPredictedUpper)
-
-            n=0
-            for sampleName in group.sampleList:
-                sample = self.experiment.samples[sampleName]
-
-                # Keep this result
-                sampleFit = PKPDSampleFit()
-                sampleFit.sampleName = sample.sampleName
-                sampleFit.x = self.XList[n]
-                sampleFit.y = self.YList[n]
-                sampleFit.yp = self.yPredictedList[n]
-                sampleFit.yl = self.yPredictedLowerList[n]
-                sampleFit.yu = self.yPredictedUpperList[n]
-                sampleFit.parameters = self.parameters
-                sampleFit.modelEquation = self.getEquation()
-                sampleFit.copyFromOptimizer(optimizer2)
-                self.fitting.sampleFits.append(sampleFit)
-
-                # Add the parameters to the sample and experiment
-                for varName, varUnits, description, varValue in izip(self.getParameterNames(), self.parameterUnits, self.getParameterDescriptions(), self.parameters):
-                    self.experiment.addParameterToSample(sampleName, varName, varUnits, description, varValue)
-
-                self.postSampleAnalysis(sampleName)
-
-                if reportX!=None:
-                    print("Evaluation of the model at specified time points")
-                    self.model.tF = np.max(reportX)
-                    yreportX = self.model.forwardModel(self.model.parameters, reportX)
-                    print("==========================================")
-                    print("X     Ypredicted     log10(Ypredicted)")
-                    print("==========================================")
-                    for n in range(0,reportX.shape[0]):
-                        aux = 0
-                        if yreportX[n]>0:
-                            aux = math.log10(yreportX[n])
-                        print("%f %f %f"%(reportX[n],yreportX[n],aux))
-                    print(' ')
-
-                n+=1
-
-        self.fitting.modelParameters = self.getParameterNames()
-        self.fitting.modelDescription=self.getDescription()
+        self.fitting.modelParameters = parameterNames
+        self.fitting.modelDescription = description
         self.fitting.write(self._getPath("fitting.pkpd"))
         self.experiment.write(self._getPath("experiment.pkpd"))
 
+    def fitGroup(self, groupName, fitType, reportX):
+        group = self.experiment.groups[groupName]
+        self.printSection("Fitting "+groupName)
+        self.clearGroupParameters()
+
+        for sampleName in group.sampleList:
+            print("   Sample "+sampleName)
+            sample = self.experiment.samples[sampleName]
+
+            self.createDrugSource()
+            self.setupModel()
+
+            # Get the values to fit
+            x, y = sample.getXYValues(self.varNameX,self.varNameY)
+            print("X= "+str(x))
+            print("Y= "+str(y))
+            print(" ")
+
+            # Interpret the dose
+            self.setTimeRange(sample)
+            sample.interpretDose()
+
+            self.drugSource.setDoses(sample.parsedDoseList, self.model.t0, self.model.tF)
+            self.configureSource(self.drugSource)
+            self.model.drugSource = self.drugSource
+
+            # Prepare the model
+            self.setBounds(sample)
+            self.setXYValues(x, y)
+            self.addSample(sample)
+            self.prepareForSampleAnalysis(sampleName)
+            self.calculateParameterUnits(sample)
+            if self.fitting.modelParameterUnits==None:
+                self.fitting.modelParameterUnits = self.parameterUnits
+
+        self.printSetup()
+        self.x = self.mergeLists(self.XList)
+        self.y = self.mergeLists(self.YList)
+
+        if self.globalSearch:
+            optimizer1 = PKPDDEOptimizer(self,fitType)
+            self.setupDEOptimizer(optimizer1)
+            optimizer1.optimize()
+        else:
+            self.parameters = np.zeros(len(self.boundsList),np.double)
+            n = 0
+            for bound in self.boundsList:
+                self.parameters[n] = 0.5*(bound[0]+bound[1])
+                n += 1
+        try:
+            optimizer2 = PKPDLSOptimizer(self,fitType)
+            optimizer2.optimize()
+        except Exception as e:
+            msg=str(e)
+            msg+="Errors in the local optimizer may be caused by starting from a bad initial guess\n"
+            msg+="Try performing a global search first or changing the bounding box"
+            raise Exception("Error in the local optimizer\n"+msg)
+        optimizer2.setConfidenceInterval(self.confidenceInterval.get())
+        self.setParameters(optimizer2.optimum)
+        optimizer2.evaluateQuality()
+        print("Integrator %s: %d evaluations of the model equations in the last simulation"%\
+              (self.model.integrator,self.model.NFevaluations))
+
+        self.yPredictedList=self.separateLists(self.yPredicted)
+        self.yPredictedLowerList=self.separateLists(self.yPredictedLower)
+        self.yPredictedUpperList=self.separateLists(self.yPredictedUpper)
+
+        n=0
+        for sampleName in group.sampleList:
+            sample = self.experiment.samples[sampleName]
+
+            # Keep this result
+            sampleFit = PKPDSampleFit()
+            sampleFit.sampleName = sample.sampleName
+            sampleFit.x = self.XList[n]
+            sampleFit.y = self.YList[n]
+            sampleFit.yp = self.yPredictedList[n]
+            sampleFit.yl = self.yPredictedLowerList[n]
+            sampleFit.yu = self.yPredictedUpperList[n]
+            sampleFit.parameters = self.parameters
+            sampleFit.modelEquation = self.getEquation()
+            sampleFit.copyFromOptimizer(optimizer2)
+            self.fitting.sampleFits.append(sampleFit)
+
+            # Add the parameters to the sample and experiment
+            for varName, varUnits, description, varValue in izip(self.getParameterNames(), self.parameterUnits, self.getParameterDescriptions(), self.parameters):
+                self.experiment.addParameterToSample(sampleName, varName, varUnits, description, varValue)
+
+            self.postSampleAnalysis(sampleName)
+
+            if reportX!=None:
+                print("Evaluation of the model at specified time points")
+                self.model.tF = np.max(reportX)
+                yreportX = self.model.forwardModel(self.model.parameters, reportX)
+                print("==========================================")
+                print("X     Ypredicted     log10(Ypredicted)")
+                print("==========================================")
+                for n in range(0,reportX.shape[0]):
+                    aux = 0
+                    if yreportX[n]>0:
+                        aux = math.log10(yreportX[n])
+                    print("%f %f %f"%(reportX[n],yreportX[n],aux))
+                print(' ')
+
+            n+=1
+
+    def fitGroupIsolated(self, groupName, seed, fitType, reportX):
+        """Fit a group in a worker process. Everything that has to be merged in the parent process
+           (sample fits, sample descriptors and experiment variables) is returned"""
+        np.random.seed(seed)
+        self.fitting.sampleFits = []
+        self.fitGroup(groupName, fitType, reportX)
+        descriptors = [(sampleName, self.experiment.samples[sampleName].descriptors)
+                       for sampleName in self.experiment.groups[groupName].sampleList]
+        return self.fitting.sampleFits, descriptors, self.experiment.variables, self.parameterUnits, \
+               self.getParameterNames(), self.getDescription()
+
+    def fitGroupsInParallel(self, groupNames, fitType, reportX, Nprocesses):
+        # The seeds are drawn in advance so that the result does not depend on the order in which groups are processed
+        seeds = np.random.randint(0,2**31-1,len(groupNames))
+        pool = MethodPool(self.fitGroupIsolated, Nprocesses)
+        try:
+            results = pool.imap([(groupName, seed, fitType, reportX) for groupName, seed in izip(groupNames, seeds)])
+            for sampleFits, descriptors, variables, parameterUnits, parameterNames, description in results:
+                self.fitting.sampleFits += sampleFits
+                if self.fitting.modelParameterUnits==None:
+                    self.fitting.modelParameterUnits = parameterUnits
+                for varName, variable in variables.iteritems():
+                    if not varName in self.experiment.variables:
+                        self.experiment.variables[varName] = variable
+                for sampleName, sampleDescriptors in descriptors:
+                    self.experiment.samples[sampleName].descriptors = sampleDescriptors
+        finally:
+            pool.close()
+
+        # As in the serial fitting, the fitting is described by the drug source and model of the last group
+        return parameterNames, description
+
     def createOutputStep(self):
         self._defineOutputs(outputFitting=self.fitting)
         self._defineOutputs(outputExperiment=self.experiment)
@@ -24,11 +24,13 @@
 # *
 # **************************************************************************
 
+from itertools import izip
 import numpy as np
 
 import pyworkflow.protocol.params as params
 from pyworkflow.em.data import PKPDFitting, PKPDSampleFitBootstrap, PKPDLSOptimizer
 from pyworkflow.protocol.constants import LEVEL_ADVANCED
+from pyworkflow.utils.process import MethodPool
 from pyworkflow.em.biopharmaceutics import DrugSource
 from protocol_pkpd_ode_base import ProtPKPDODEBase
 
@@ -59,6 +61,11 @@ class ProtPKPDODEBootstrap(ProtPKPDODEBase):
         form.addParam('confidenceInterval', params.FloatParam, label="Confidence interval", default=95, expertLevel=LEVEL_ADVANCED,
                       help='Confidence interval for the fitted parameters')
         form.addParam('deltaT', params.FloatParam, default=2, label='Step (min)', expertLevel=LEVEL_ADVANCED)
+        form.addParam('seed', params.IntParam, label="Random seed", default=-1, expertLevel=LEVEL_ADVANCED,
+                      help='Seed of the random number generator used to draw the bootstrap samples. Each bootstrap '\
+                           'realization has its own seed derived from this one, so that the result does not depend on '\
+                           'the number of threads. If -1, the seed is taken from the system and results are not reproducible')
+        form.addParallelSection(threads=1, mpi=0)
 
     #--------------------------- INSERT steps functions --------------------------------------------
     def _insertAllSteps(self):
@@ -126,6 +133,8 @@ class ProtPKPDODEBootstrap(ProtPKPDODEBase):
         elif self.protODE.fitType.get()==2:
             fitType = "relative"
 
+        randomState = np.random.RandomState(None if self.seed.get()<0 else self.seed.get())
+        Nprocesses = min(self.numberOfThreads.get(),self.Nbootstrap.get())
         parameterNames = None
         for groupName, group in self.experiment.groups.iteritems():
             self.printSection("Fitting "+groupName)
@@ -145,6 +154,7 @@ class ProtPKPDODEBootstrap(ProtPKPDODEBase):
                 self.model = self.protODE.model
                 self.modelList = self.protODE.modelList
                 self.model.deltaT = self.deltaT.get()
+                self.model.integrator = self.protODE.getIntegrator()
                 self.model.setXVar(self.varNameX)
                 self.model.setYVar(self.varNameY)
 
@@ -152,8 +162,6 @@ class ProtPKPDODEBootstrap(ProtPKPDODEBase):
                 x, y = sample.getXYValues(self.varNameX,self.varNameY)
                 print("X= "+str(x))
                 print("Y= "+str(y))
-                firstX=x[0] # From [array(...)] to array(...)
-                firstY=y[0] # From [array(...)] to array(...)
 
                 # Interpret the dose
                 self.protODE.varNameX = self.varNameX
@@ -187,53 +195,20 @@ class ProtPKPDODEBootstrap(ProtPKPDODEBase):
                 # Output object
                 sampleFit = PKPDSampleFitBootstrap()
                 sampleFit.sampleName = sample.sampleName
-                sampleFit.parameters = np.zeros((self.Nbootstrap.get(),len(parameters0)),np.double)
-                sampleFit.xB = []
-                sampleFit.yB = []
+                sampleFit.allocate(self.Nbootstrap.get(),len(parameters0))
 
                 # Bootstrap samples
-                idx = [k for k in range(0,len(firstX))]
-                for n in range(0,self.Nbootstrap.get()):
-                    ok = False
-                    while not ok:
-                        if self.sampleLength.get()>0:
-                            lenToUse = self.sampleLength.get()
-                        else:
-                            lenToUse = len(idx)
-                        idxB = sorted(np.random.choice(idx,lenToUse))
-                        xB = [np.asarray([firstX[i] for i in idxB])]
-                        yB = [np.asarray([firstY[i] for i in idxB])]
-
-                        print("Bootstrap sample %d"%n)
-                        print("X= "+str(xB))
-                        print("Y= "+str(yB))
-                        self.clearXYLists()
-                        self.setXYValues(xB, yB)
-                        self.parameters = parameters0
-
-                        optimizer2 = PKPDLSOptimizer(self,fitType)
-                        optimizer2.verbose = 0
-                        try:
-                            optimizer2.optimize()
-                            ok=True
-                        except Exception as e:
-                            print(e)
-                            raise(e)
-                            ok=False
-
-                    # Evaluate the quality on the whole data set
-                    self.clearXYLists()
-                    self.setXYValues(x, y)
-                    optimizer2.evaluateQuality()
-                    print(optimizer2.optimum)
-                    print("   R2 = %f R2Adj=%f AIC=%f AICc=%f BIC=%f"%(optimizer2.R2,optimizer2.R2adj,optimizer2.AIC,\
-                                                                       optimizer2.AICc,optimizer2.BIC))
-
-                    # Keep this result
-                    sampleFit.parameters[n,:] = optimizer2.optimum
-                    sampleFit.xB.append(str(xB[0]))
-                    sampleFit.yB.append(str(yB[0]))
-                    sampleFit.copyFromOptimizer(optimizer2)
+                self.fitType = fitType
+                self.parameters0 = parameters0
+                self.sampleX = x
+                self.sampleY = y
+                seeds = randomState.randint(0,2**31-1,self.Nbootstrap.get())
+                if Nprocesses>1:
+                    replicas = self.fitReplicasInParallel(seeds, Nprocesses)
+                else:
+                    replicas = (self.fitReplica(n, seed) for n, seed in enumerate(seeds))
+                for n, (optimum, quality, xB, yB) in enumerate(replicas):
+                    sampleFit.setReplica(n, optimum, quality, xB, yB)
 
                 self.fitting.sampleFits.append(sampleFit)
 
@@ -241,6 +216,48 @@ class ProtPKPDODEBootstrap(ProtPKPDODEBase):
         self.fitting.modelDescription = self.getDescription()
         self.fitting.write(self._getPath("bootstrapPopulation.pkpd"))
 
+    def fitReplica(self, n, seed):
+        # Resample the observations with the random stream of this realization
+        firstX=self.sampleX[0] # From [array(...)] to array(...)
+        firstY=self.sampleY[0] # From [array(...)] to array(...)
+        if self.sampleLength.get()>0:
+            lenToUse = self.sampleLength.get()
+        else:
+            lenToUse = len(firstX)
+        idxB = np.sort(np.random.RandomState(seed).randint(0,len(firstX),lenToUse))
+        xB = [firstX[idxB]]
+        yB = [firstY[idxB]]
+
+        print("Bootstrap sample %d"%n)
+        self.clearXYLists()
+        self.setXYValues(xB, yB)
+        self.parameters = self.parameters0
+
+        optimizer2 = PKPDLSOptimizer(self,self.fitType)
+        optimizer2.verbose = 0
+        optimizer2.optimize()
+
+        # Evaluate the quality on the whole data set
+        self.clearXYLists()
+        self.setXYValues(self.sampleX, self.sampleY)
+        optimizer2.evaluateQuality()
+        print(optimizer2.optimum)
+        print("   R2 = %f R2Adj=%f AIC=%f AICc=%f BIC=%f"%(optimizer2.R2,optimizer2.R2adj,optimizer2.AIC,\
+                                                           optimizer2.AICc,optimizer2.BIC))
+        return np.copy(optimizer2.optimum), \
+               (optimizer2.R2, optimizer2.R2adj, optimizer2.AIC, optimizer2.AICc, optimizer2.BIC), \
+               str(xB[0]), str(yB[0])
+
+    def fitReplicasInParallel(self, seeds, Nprocesses):
+        # The realizations are returned in order as they are available, so they can be stored while others are fitted
+        pool = MethodPool(self.fitReplica, Nprocesses)
+        try:
+            chunksize = max(1,len(seeds)/(4*Nprocesses))
+            for result in pool.imap(izip(range(len(seeds)), seeds), chunksize):
+                yield result
+        finally:
+            pool.close()
+
     def createOutputStep(self):
         self._defineOutputs(outputPopulation=self.fitting)
         self._defineSourceRelation(self.inputODE.get(), self.fitting)
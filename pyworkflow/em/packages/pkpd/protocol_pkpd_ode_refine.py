@@ -128,6 +128,7 @@ class ProtPKPDODERefine(ProtPKPDODEBase):
                 self.model = self.protODE.model
                 self.modelList = self.protODE.modelList
                 self.model.deltaT = self.deltaT.get()
+                self.model.integrator = self.protODE.getIntegrator()
                 self.model.setXVar(self.varNameX)
                 self.model.setYVar(self.varNameY)
 
@@ -27,7 +27,7 @@
 import numpy as np
 
 import pyworkflow.protocol.params as params
-from pyworkflow.em.protocol.protocol_pkpd import ProtPKPD
+from pyworkflow.em.protocol.protocol_pkpd import ProtPKPD, addDEToForm
 from pyworkflow.em.data import PKPDModelBase2, PKPDExperiment, PKPDFitting, PKPDDEOptimizer, PKPDLSOptimizer, \
     flattenArray, PKPDSampleFit
 from pyworkflow.protocol.constants import LEVEL_ADVANCED
@@ -62,6 +62,9 @@ class ProtPKPDODETwoVias(ProtPKPD,PKPDModelBase2):
         form.addParam('globalSearch', params.BooleanParam, label="Global search", default=False, expertLevel=LEVEL_ADVANCED,
                       help='Global search looks for the best parameters within bounds. If it is not performed, the '
                            'middle of the bounding box is used as initial parameter for a local optimization')
+        addDEToForm(form, condition="globalSearch")
+
+        form.addParallelSection(threads=1, mpi=0)
 
     #--------------------------- INSERT steps functions --------------------------------------------
     def _insertAllSteps(self):
@@ -375,10 +378,12 @@ class ProtPKPDODETwoVias(ProtPKPD,PKPDModelBase2):
                 # Optimize
                 if self.globalSearch:
                     optimizer1 = PKPDDEOptimizer(self,fitType)
+                    self.setupDEOptimizer(optimizer1)
                     optimizer1.optimize()
                 else:
                     self.setInitialSolution(sample2name)
                 optimizer2 = PKPDLSOptimizer(self,fitType)
+                optimizer2.Nprocesses = self.numberOfThreads.get() # Finite differences of the Jacobian
                 optimizer2.optimize()
                 optimizer2.setConfidenceInterval(self.prot1.confidenceInterval.get())
                 self.setParameters(optimizer2.optimum)
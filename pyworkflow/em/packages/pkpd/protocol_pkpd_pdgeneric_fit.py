@@ -28,6 +28,7 @@ import math
 
 import pyworkflow.protocol.params as params
 from pyworkflow.protocol.constants import LEVEL_ADVANCED
+from pyworkflow.em.protocol.protocol_pkpd import addDEToForm
 from protocol_pkpd_fit_base import ProtPKPDFitBase
 from pd_models import *
 
@@ -79,6 +80,7 @@ are independent, which are not. Use Bootstrap estimates instead.\n
                       help='Confidence interval for the fitted parameters')
         form.addParam('reportX', params.StringParam, label="Evaluate at X=", default="", expertLevel=LEVEL_ADVANCED,
                       help='Evaluate the model at these X values\nExample 1: [0,5,10,20,40,100]\nExample 2: 0:2:10, from 0 to 10 in steps of 2')
+        addDEToForm(form)
 
     def getListOfFormDependencies(self):
         return [self.modelType.get(), self.fitType.get(), self.bounds.get(), self.confidenceInterval.get(),
@@ -73,15 +73,9 @@ class ProtPKPDScaleToCommonDose(ProtPKPD):
             K = self.newDose.get()/oldDose
 
             for varName in varNames:
-                values = sample.getValues(varName)
-                for i in range(0,len(values)):
-                    try:
-                        value = values[i]
-                        floatval = float(value)
-                        values[i] = str(K*floatval)
-                    except:
-                        pass
-                sample.setValues(varName,values)
+                if sample.isNumericMeasurement(varName):
+                    values, flags = sample.getMeasurementColumn(varName)
+                    sample.setMeasurementColumn(varName,K*values,flags)
         self.experiment.write(self._getPath("experiment.pkpd"))
 
     #--------------------------- INFO functions --------------------------------------------
@@ -33,6 +33,57 @@ from pd_models import *
 from numpy.random import uniform
 
 
+def definePDModelParams(form):
+    form.addParam('modelType', params.EnumParam, choices=["OQuigley0","OQuigley1", "OQuigley2", "Sigmoid", "Gompertz", "Logistic", "Richards"],
+                  label="Response model", default=0,
+                  help='OQuigley0: Y=((tanh(X)+1)/2)^a. Order: a\n'\
+                       'OQuigley1: Y=((tanh(X-X0)+1)/2)^a. Order: X0;a\n'\
+                       'OQuigley2: Y=exp(g*(X-X0))/(1+exp(g*(X-X0)). Order: X0;g\n'\
+                       'Sigmoid: Y=((X**h)/((X50**h)+(X**h))). Order X50;h\n'\
+                       'Gompertz: Y=exp(-exp(g*(X-X0))). Order: X0;g\n'\
+                       'Logistic: Y=1/(1+exp(g*(X-X0))). Order: X0;g\n'\
+                       'Richards: Y=1/((1+exp(g*(X-X0)))^(1/d)). Order: X0;g;d\n')
+
+    form.addParam('paramValues', params.StringParam, label="Parameter values", default="",
+                  help='Parameter values for the simulation.\nExample: 3.5;-1 is 3.5 for the first parameter, -1 for the second parameter\n'
+                       'OQuigley0: a\n'\
+                       'OQuigley1: X0;a\n'\
+                       'OQuigley2: X0;g\n'\
+                       'Sigmoid: X50;h\n'\
+                       'Gompertz: X0;g\n'\
+                       'Logistic: X0;g\n'\
+                       'Richards: X0;g;d\n')
+
+def createPDModel(modelType, paramValues):
+    """Create the dose response model of type modelType with the parameters given as a string separated by ;"""
+    if modelType==0:
+        model = PDOQuigley0()
+    elif modelType==1:
+        model = PDOQuigley1()
+    elif modelType==2:
+        model = PDOQuigley2()
+    elif modelType==3:
+        model = PDSigmoid()
+    elif modelType==4:
+        model = PDGompertz()
+    elif modelType==5:
+        model = PDLogistic1()
+    elif modelType==6:
+        model = PDRichards()
+
+    # Create list of parameters
+    tokens=paramValues.split(';')
+    if len(tokens)!=model.getNumberOfParameters():
+        raise Exception("The list of parameter values has not the same number of parameters as the model")
+    model.parameters=[]
+    for token in tokens:
+        try:
+            model.parameters.append(float(token.strip()))
+        except:
+            raise Exception("Cannot convert %s to float"%token)
+    return model
+
+
 class ProtPKPDSimulateDoseEscalation(ProtPKPD):
     """ Simulate a dose escalation\n
         Protocol created by http://www.kinestatpharma.com\n"""
@@ -42,25 +93,7 @@ class ProtPKPDSimulateDoseEscalation(ProtPKPD):
 
     def _defineParams(self, form, fullForm=True):
         form.addSection('Input')
-        form.addParam('modelType', params.EnumParam, choices=["OQuigley0","OQuigley1", "OQuigley2", "Sigmoid", "Gompertz", "Logistic", "Richards"],
-                      label="Response model", default=0,
-                      help='OQuigley0: Y=((tanh(X)+1)/2)^a. Order: a\n'\
-                           'OQuigley1: Y=((tanh(X-X0)+1)/2)^a. Order: X0;a\n'\
-                           'OQuigley2: Y=exp(g*(X-X0))/(1+exp(g*(X-X0)). Order: X0;g\n'\
-                           'Sigmoid: Y=((X**h)/((X50**h)+(X**h))). Order X50;h\n'\
-                           'Gompertz: Y=exp(-exp(g*(X-X0))). Order: X0;g\n'\
-                           'Logistic: Y=1/(1+exp(g*(X-X0))). Order: X0;g\n'\
-                           'Richards: Y=1/((1+exp(g*(X-X0)))^(1/d)). Order: X0;g;d\n')
-
-        form.addParam('paramValues', params.StringParam, label="Parameter values", default="",
-                      help='Parameter values for the simulation.\nExample: 3.5;-1 is 3.5 for the first parameter, -1 for the second parameter\n'
-                           'OQuigley0: a\n'\
-                           'OQuigley1: X0;a\n'\
-                           'OQuigley2: X0;g\n'\
-                           'Sigmoid: X50;h\n'\
-                           'Gompertz: X0;g\n'\
-                           'Logistic: X0;g\n'\
-                           'Richards: X0;g;d\n')
+        definePDModelParams(form)
 
         form.addParam('reportX', params.StringParam, label="Evaluate at X=", default="",
                       help='Evaluate the model at these X values\nExample 1: [0,5,10,20,40,100]\nExample 2: 0:2:10, from 0 to 10 in steps of 2')
@@ -84,31 +117,7 @@ class ProtPKPDSimulateDoseEscalation(ProtPKPD):
 
         # Setup model
         self.printSection("Model setup")
-        if self.modelType.get()==0:
-            model = PDOQuigley0()
-        elif self.modelType.get()==1:
-            model = PDOQuigley1()
-        elif self.modelType.get()==2:
-            model = PDOQuigley2()
-        elif self.modelType.get()==3:
-            model = PDSigmoid()
-        elif self.modelType.get()==4:
-            model = PDGompertz()
-        elif self.modelType.get()==5:
-            model = PDLogistic1()
-        elif self.modelType.get()==6:
-            model = PDRichards()
-
-        # Create list of parameters
-        tokens=self.paramValues.get().split(';')
-        if len(tokens)!=model.getNumberOfParameters():
-                raise Exception("The list of parameter values has not the same number of parameters as the model")
-        model.parameters=[]
-        for token in tokens:
-            try:
-                model.parameters.append(float(token.strip()))
-            except:
-                raise Exception("Cannot convert %s to float"%token)
+        model = createPDModel(self.modelType.get(), self.paramValues.get())
         print("Simulated model: %s"%model.getEquation())
 
         if reportX!=None:
@@ -0,0 +1,144 @@
+# **************************************************************************
+# *
+# * Authors:     Carlos Oscar Sorzano (info@kinestat.com)
+# *
+# * Kinestat Pharma
+# *
+# * This program is free software; you can redistribute it and/or modify
+# * it under the terms of the GNU General Public License as published by
+# * the Free Software Foundation; either version 2 of the License, or
+# * (at your option) any later version.
+# *
+# * This program is distributed in the hope that it will be useful,
+# * but WITHOUT ANY WARRANTY; without even the implied warranty of
+# * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# * GNU General Public License for more details.
+# *
+# * You should have received a copy of the GNU General Public License
+# * along with this program; if not, write to the Free Software
+# * Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA
+# * 02111-1307  USA
+# *
+# *  All comments concerning this program package may be sent to the
+# *  e-mail address 'info@kinestat.com'
+# *
+# **************************************************************************
+
+import os
+import numpy as np
+import pyworkflow.protocol.params as params
+from pyworkflow.protocol.constants import LEVEL_ADVANCED
+from pyworkflow.em.protocol.protocol_pkpd import ProtPKPD
+from utils import parseRange
+from protocol_pkpd_simulate_dose_escalation import definePDModelParams, createPDModel
+from protocol_pkpd_dose_escalation import ClopperPearson, simulateCohortTrials, simulateSequentialTrials, \
+    THREE_PLUS_THREE, BEST_OF_FIVE, UP_AND_DOWN, STORER_C, STORER_BC
+
+
+class ProtPKPDSimulateDoseEscalationTrials(ProtPKPD):
+    """ Simulate many virtual dose escalation trials with each of the escalation rules (3+3, best of 5,
+        up and down, Storer's C and BC) and report the MTD selection distribution, patients per dose and overdose rates\n
+        Protocol created by http://www.kinestatpharma.com\n"""
+    _label = 'simulate dose escalation trials'
+
+    #--------------------------- DEFINE param functions --------------------------------------------
+
+    def _defineParams(self, form, fullForm=True):
+        form.addSection('Input')
+        definePDModelParams(form)
+
+        form.addParam('doses', params.StringParam, label="Dose levels", default="",
+                      help='Dose levels of the escalation in increasing order\nExample 1: [0.05,0.1,0.167,0.233,0.31]\nExample 2: 1:1:10, from 1 to 10 in steps of 1')
+        form.addParam('doLog', params.BooleanParam, label="Take log10 in the dose", default=False,
+                      help='In the formulas, X is substituted by log10(X)')
+        form.addParam('Ntrials', params.IntParam, label="Number of trials", default=1000,
+                      help='Number of virtual trials simulated for each escalation rule')
+        form.addParam('Npatients', params.IntParam, label="Patients per trial", default=20,
+                      help='Up and down, Storer\'s C and Storer\'s BC are run up to this number of patients. '
+                           '3+3 and best of 5 stop by themselves')
+        form.addParam('targetToxicity', params.FloatParam, label="Target DLT probability", default=0.33,
+                      help='The true MTD is the highest dose whose DLT probability is not larger than this target. '
+                           'Doses above it are overdoses')
+        form.addParam('seed', params.IntParam, default=-1, label="Random seed", expertLevel=LEVEL_ADVANCED,
+                      help="-1 for a random seed")
+
+    #--------------------------- INSERT steps functions --------------------------------------------
+    def _insertAllSteps(self):
+        self._insertFunctionStep('runSimulate', self.modelType.get(), self.paramValues.get(), self.doses.get())
+
+    #--------------------------- STEPS functions --------------------------------------------
+    def runSimulate(self, modelType, paramValues, doses):
+        doses = parseRange(doses)
+        if doses is None:
+            raise Exception("The dose levels cannot be empty")
+        X = np.log10(np.clip(doses,0.0,None)) if self.doLog else doses
+
+        self.printSection("Model setup")
+        model = createPDModel(modelType, paramValues)
+        print("Simulated model: %s"%model.getEquation())
+        p = np.clip(model.forwardModel(model.parameters, [X])[0],0.0,1.0)
+
+        target = self.targetToxicity.get()
+        safe = np.where(p<=target)[0]
+        trueMTD = safe[-1] if safe.size>0 else -1
+        overdose = p>target
+        print("Dose     P(DLT)")
+        for dose, pDose in zip(doses,p):
+            print("%f %f"%(dose,pDose))
+        print("True MTD: %s\n"%("none" if trueMTD<0 else "%f"%doses[trueMTD]))
+
+        if self.seed.get()>=0:
+            np.random.seed(self.seed.get())
+        Ntrials = self.Ntrials.get()
+        rules = [("3+3", lambda: simulateCohortTrials(p, THREE_PLUS_THREE, Ntrials)),
+                 ("Best of 5", lambda: simulateCohortTrials(p, BEST_OF_FIVE, Ntrials)),
+                 ("Up and down", lambda: simulateSequentialTrials(p, UP_AND_DOWN, Ntrials, self.Npatients.get())),
+                 ("Storer's C", lambda: simulateSequentialTrials(p, STORER_C, Ntrials, self.Npatients.get())),
+                 ("Storer's BC", lambda: simulateSequentialTrials(p, STORER_BC, Ntrials, self.Npatients.get()))]
+
+        fhTrials = open(self._getPath("trials.txt"),"w")
+        fhSummary = open(self._getPath("summary.txt"),"w")
+        for ruleName, simulate in rules:
+            self.printSection("%s: %d trials"%(ruleName,Ntrials))
+            mtd, patients, dlts = simulate()
+
+            # MTD -1 (no dose tolerated) goes to the first bin
+            selection = np.bincount(mtd+1, minlength=len(doses)+1)/float(Ntrials)
+            totalPatients = np.sum(patients,axis=1)
+            Ncorrect = np.sum(mtd==trueMTD)
+            NoverdoseTrials = np.sum(np.logical_and(mtd>=0, overdose[np.clip(mtd,0,None)]))
+            overdosePatients = np.sum(patients[:,overdose])/float(np.sum(totalPatients))
+
+            lines = ["Dose     P(DLT)    P(MTD)    Patients  DLTs",
+                     "None     -         %f"%selection[0]]
+            patientsPerDose = np.mean(patients,axis=0)
+            dltsPerDose = np.mean(dlts,axis=0)
+            for n in range(len(doses)):
+                lines.append("%f %f %f %f %f"%(doses[n],p[n],selection[n+1],patientsPerDose[n],dltsPerDose[n]))
+            lo, hi = ClopperPearson(Ncorrect,Ntrials)
+            lines.append("Correct MTD selection: %f. 95%% Confidence interval: [%f,%f]"%(float(Ncorrect)/Ntrials,lo,hi))
+            lo, hi = ClopperPearson(NoverdoseTrials,Ntrials)
+            lines.append("MTD above the true MTD: %f. 95%% Confidence interval: [%f,%f]"%(float(NoverdoseTrials)/Ntrials,lo,hi))
+            lines.append("Patients treated above the true MTD: %f"%overdosePatients)
+            lines.append("Patients per trial: mean=%f min=%d max=%d"%(np.mean(totalPatients),np.min(totalPatients),np.max(totalPatients)))
+            lines.append("DLTs per trial: mean=%f"%np.mean(np.sum(dlts,axis=1)))
+
+            fhTrials.write("%s ================================================\n"%ruleName)
+            for line in lines:
+                print(line)
+                fhTrials.write(line+"\n")
+            fhTrials.write("\n")
+            fhSummary.write("%s: correct MTD %4.1f%%, MTD above true MTD %4.1f%%, patients above true MTD %4.1f%%, %4.1f patients per trial\n"%\
+                            (ruleName,100.0*Ncorrect/Ntrials,100.0*NoverdoseTrials/Ntrials,100*overdosePatients,np.mean(totalPatients)))
+        fhTrials.close()
+        fhSummary.close()
+
+    #--------------------------- INFO functions --------------------------------------------
+    def _summary(self):
+        msg=[]
+        if os.path.exists(self._getPath("summary.txt")):
+            fh=open(self._getPath("summary.txt"))
+            for line in fh:
+                msg.append(line.strip())
+            fh.close()
+        return msg
@@ -24,7 +24,7 @@
 # *
 # **************************************************************************
 
-from itertools import izip
+from functools import partial
 import numpy as np
 import os
 
@@ -32,6 +32,32 @@ import pyworkflow.protocol.params as params
 from pyworkflow.em.protocol.protocol_pkpd import ProtPKPD
 from pyworkflow.protocol.constants import LEVEL_ADVANCED
 
+def reversibleInhibition(I, Ki):
+    return 1+I/Ki
+
+def timeDependentInhibition(I, Ki, kdeg, kinact):
+    return 1+kinact/kdeg*I/(Ki+I)
+
+def induction(I, EC50, Emax, d):
+    return 1/(1+d*Emax*I/(EC50+I))
+
+def staticInteraction(f, I, Ki, Emax, EC50, kinact, d, kdeg):
+    """Mechanistic static model (Fahmi2009), f is the fraction of the substrate affected"""
+    A = kdeg/(kdeg+I*kinact/(I+Ki))
+    B = 1+d*Emax*I/(I+EC50)
+    C = 1/(1+I/Ki)
+    return 1/(A*B*C*f+(1-f))
+
+def evaluateInteractionGrid(Rfunction, I, valueLists):
+    """Evaluate R for all the combinations of the parameter values (the last list varies fastest) and all
+       the concentrations in I. Returns the matrix of parameter combinations (one row per combination) and
+       the matrix of R (one row per combination, one column per concentration)"""
+    grid = np.meshgrid(*valueLists, indexing='ij')
+    parameters = np.column_stack([values.ravel() for values in grid])
+    columns = [parameters[:,k:k+1] for k in range(parameters.shape[1])]
+    R = Rfunction(np.asarray(I,np.double)[np.newaxis,:], *columns)*np.ones((parameters.shape[0],len(I)))
+    return parameters, R
+
 class ProtPKPDSimulateDrugInteractions(ProtPKPD):
     """ Simulate drug interactions as recommended in EMA CHMP/EWP/560/95 \n
         Protocol created by http://www.kinestatpharma.com\n"""
@@ -182,200 +208,100 @@ class ProtPKPDSimulateDrugInteractions(ProtPKPD):
 
     #--------------------------- STEPS functions --------------------------------------------
     def parseList(self, strList):
-        return [float(v) for v in strList.split(' ')]
+        return [float(v) for v in strList.split()]
 
     def runSimulate(self):
-        R = []
-        Rlegends = []
-        Type = []
-        if self.doReversibleLiver:
+        # Each simulation is (type, I, R function, parameter names, parameter lists, legend of each combination
+        # formatted with the parameter values by name)
+        simulations = []
+        if self.doReversibleLiver or self.doTimeDependentLiver or self.doInductionLiver:
             I = np.arange(self.I0Liver.get(), self.IFLiver.get(), (self.IFLiver.get()-self.I0Liver.get())/100) # I [ng/mL]
             I /= self.MWLiver.get() # I [uM]
-            KiList = self.parseList(self.KiReversibleLiver.get())
-            for Ki in KiList:
-                legend="Liver Rev. Inh. Ki=%f [uM]"%Ki
-                print("Simulating %s"%legend)
-                R.append((I,1+I/Ki))
-                Rlegends.append(legend)
-                Type.append('ReversibleLiver')
-
-        if self.doReversibleGut:
+        if self.doReversibleLiver:
+            simulations.append(('ReversibleLiver', I, reversibleInhibition, ['Ki'],
+                                [self.KiReversibleLiver.get()], "Liver Rev. Inh. Ki=%(Ki)f [uM]"))
+        if self.doReversibleGut or self.doTimeDependentGut or self.doInductionGut:
             D = np.arange(self.D0Gut.get(), self.DFGut.get(), (self.DFGut.get()-self.D0Gut.get())/100)
-            I = D/(250*self.MWGut.get())*1e6 # I [uM]
-            KiList = self.parseList(self.KiReversibleGut.get())
-            for Ki in KiList:
-                legend="Gut Rev. Inh. Ki=%f [uM]"%Ki
-                print("Simulating %s"%legend)
-                R.append((I,1+I/Ki))
-                Rlegends.append(legend)
-                Type.append('ReversibleGut')
-
+            IGut = D/(250*self.MWGut.get())*1e6 # I [uM]
+        if self.doReversibleGut:
+            simulations.append(('ReversibleGut', IGut, reversibleInhibition, ['Ki'],
+                                [self.KiReversibleGut.get()], "Gut Rev. Inh. Ki=%(Ki)f [uM]"))
         if self.doTimeDependentLiver:
-            I = np.arange(self.I0Liver.get(), self.IFLiver.get(), (self.IFLiver.get()-self.I0Liver.get())/100) # I [ng/mL]
-            I /= self.MWLiver.get() # I [uM]
-            KiList = self.parseList(self.KiReversibleLiver.get())
-            kdegList = self.parseList(self.kdegLiver.get())
-            kinactList = self.parseList(self.kinactLiver.get())
-            for Ki in KiList:
-                for kdeg in kdegList:
-                    for kinact in kinactList:
-                        legend="Liver Time Dep. Inh. Ki=%f [uM], kdeg=%f [min^-1], kinact=%f [min^-1]"%(Ki,kdeg,kinact)
-                        print("Simulating %s"%legend)
-                        R.append((I,1+kinact/kdeg*I/(Ki+I)))
-                        Rlegends.append(legend)
-                        Type.append('TimeDependentLiver')
-
+            simulations.append(('TimeDependentLiver', I, timeDependentInhibition, ['Ki','kdeg','kinact'],
+                                [self.KiTimeLiver.get(), self.kdegLiver.get(), self.kinactLiver.get()],
+                                "Liver Time Dep. Inh. Ki=%(Ki)f [uM], kdeg=%(kdeg)f [min^-1], kinact=%(kinact)f [min^-1]"))
         if self.doTimeDependentGut:
-            D = np.arange(self.D0Gut.get(), self.DFGut.get(), (self.DFGut.get()-self.D0Gut.get())/100)
-            I = D/(250*self.MWGut.get())*1e6 # I [uM]
-            KiList = self.parseList(self.KiReversibleGut.get())
-            kdegList = self.parseList(self.kdegGut.get())
-            kinactList = self.parseList(self.kinactGut.get())
-            for Ki in KiList:
-                for kdeg in kdegList:
-                    for kinact in kinactList:
-                        legend="Gut Time Dep. Inh. Ki=%f [uM], kdeg=%f [min^-1], kinact=%f [min^-1]"%(Ki,kdeg,kinact)
-                        print("Simulating %s"%legend)
-                        R.append((I,1+kinact/kdeg*I/(Ki+I)))
-                        Rlegends.append(legend)
-                        Type.append('TimeDependentGut')
-
+            simulations.append(('TimeDependentGut', IGut, timeDependentInhibition, ['Ki','kdeg','kinact'],
+                                [self.KiTimeGut.get(), self.kdegGut.get(), self.kinactGut.get()],
+                                "Gut Time Dep. Inh. Ki=%(Ki)f [uM], kdeg=%(kdeg)f [min^-1], kinact=%(kinact)f [min^-1]"))
         if self.doInductionLiver:
-            I = np.arange(self.I0Liver.get(), self.IFLiver.get(), (self.IFLiver.get()-self.I0Liver.get())/100) # I [ng/mL]
-            I /= self.MWLiver.get() # I [uM]
-            EC50List = self.parseList(self.EC50Liver.get())
-            EmaxList = self.parseList(self.EmaxLiver.get())
-            dList = self.parseList(self.dLiver.get())
-            for EC50 in EC50List:
-                for Emax in EmaxList:
-                    for d in dList:
-                        legend="Liver Induction EC50=%f [uM], Emax=%f, d=%f"%(EC50,Emax,d)
-                        print("Simulating %s"%legend)
-                        R.append((I,1/(1+d*Emax*I/(EC50+I))))
-                        Rlegends.append(legend)
-                        Type.append('InductionLiver')
-
+            simulations.append(('InductionLiver', I, induction, ['EC50','Emax','d'],
+                                [self.EC50Liver.get(), self.EmaxLiver.get(), self.dLiver.get()],
+                                "Liver Induction EC50=%(EC50)f [uM], Emax=%(Emax)f, d=%(d)f"))
         if self.doInductionGut:
-            D = np.arange(self.D0Gut.get(), self.DFGut.get(), (self.DFGut.get()-self.D0Gut.get())/100)
-            I = D/(250*self.MWGut.get())*1e6 # I [uM]
-            EC50List = self.parseList(self.EC50Gut.get())
-            EmaxList = self.parseList(self.EmaxGut.get())
-            dList = self.parseList(self.dGut.get())
-            for EC50 in EC50List:
-                for Emax in EmaxList:
-                    for d in dList:
-                        legend="Induction EC50=%f [uM], Emax=%f, d=%f"%(EC50,Emax,d)
-                        print("Simulating %s"%legend)
-                        R.append((I,1/(1+d*Emax*I/(EC50+I))))
-                        Rlegends.append(legend)
-                        Type.append('InductionGut')
+            simulations.append(('InductionGut', IGut, induction, ['EC50','Emax','d'],
+                                [self.EC50Gut.get(), self.EmaxGut.get(), self.dGut.get()],
+                                "Induction EC50=%(EC50)f [uM], Emax=%(Emax)f, d=%(d)f"))
 
         if self.doStatic:
-            KiList = self.parseList(self.KiStatic.get())
-            EmaxList = self.parseList(self.EmaxStatic.get())
-            EC50List = self.parseList(self.EC50Static.get())
-            kinactList = self.parseList(self.kinactStatic.get())
-            dList = self.parseList(self.dStatic.get())
+            staticLists = [self.KiStatic.get(), self.EmaxStatic.get(), self.EC50Static.get(), self.kinactStatic.get(),
+                           self.dStatic.get()]
             if self.doStaticLiver:
-                kdeghList = self.parseList(self.kdeghStatic.get())
-                fm=self.fm.get()
                 if self.doPhysiological:
                     D = np.arange(self.D0Phys.get(), self.DFPhys.get(), (self.DFPhys.get()-self.D0Phys.get())/100)
                     Ih = self.fub.get()*(self.Imaxb.get()+self.Fa.get()*self.ka.get()*D/self.Qh.get())
                 else:
                     Ih = np.arange(self.Ih0.get(), self.IhF.get(), (self.IhF.get()-self.Ih0.get())/100)
                 Ih/= self.MWStatic.get()
-                for Ki in KiList:
-                    for Emax in EmaxList:
-                        for EC50 in EC50List:
-                            for kinact in kinactList:
-                                for d in dList:
-                                    for kdegh in kdeghList:
-                                        Ah = kdegh/(kdegh+Ih*kinact/(Ih+Ki))
-                                        Bh = 1+d*Emax*Ih/(Ih+EC50)
-                                        Ch = 1/(1+Ih/Ki)
-
-                                        legend="Static Liver Ki=%f [uM], EC50=%f [uM], Emax=%f, kinact=%f [min^-1], d=%f, kdegh=%f [min^-1]"%\
-                                               (Ki,EC50,Emax,kinact,d,kdegh)
-                                        print("Simulating %s"%legend)
-                                        R.append((Ih,1/(Ah*Bh*Ch*fm+(1-fm))))
-                                        Rlegends.append(legend)
-                                        Type.append('StaticLiver')
+                simulations.append(('StaticLiver', Ih, partial(staticInteraction, self.fm.get()),
+                                    ['Ki','Emax','EC50','kinact','d','kdegh'], staticLists+[self.kdeghStatic.get()],
+                                    "Static Liver Ki=%(Ki)f [uM], EC50=%(EC50)f [uM], Emax=%(Emax)f, kinact=%(kinact)f [min^-1], d=%(d)f, kdegh=%(kdegh)f [min^-1]"))
 
             if self.doStaticGut:
-                kdeggList = self.parseList(self.kdeggStatic.get())
                 if self.doPhysiological:
                     D = np.arange(self.D0Phys.get(), self.DFPhys.get(), (self.DFPhys.get()-self.D0Phys.get())/100)
                     Ig = self.Fa.get()*self.ka.get()*D/self.Qen.get()
                 else:
                     Ig = np.arange(self.Ig0.get(), self.IgF.get(), (self.IgF.get()-self.Ig0.get())/100)
                 Ig/= self.MWStatic.get()
-                fg=self.fg.get()
-                for Ki in KiList:
-                    for Emax in EmaxList:
-                        for EC50 in EC50List:
-                            for kinact in kinactList:
-                                for d in dList:
-                                    for kdegg in kdeggList:
-                                        Ag = kdegg/(kdegg+Ig*kinact/(Ig+Ki))
-                                        Bg = 1+d*Emax*Ig/(Ig+EC50)
-                                        Cg = 1/(1+Ig/Ki)
-
-                                        legend="Static Gut Ki=%f [uM], EC50=%f [uM], Emax=%f, kinact=%f [min^-1], d=%f, kdegg=%f [min^-1]"%\
-                                               (Ki,EC50,Emax,kinact,d,kdegg)
-                                        print("Simulating %s"%legend)
-                                        R.append((Ig,1/(Ag*Bg*Cg*fg+(1-fg))))
-                                        Rlegends.append(legend)
-                                        Type.append('StaticGut')
+                simulations.append(('StaticGut', Ig, partial(staticInteraction, self.fg.get()),
+                                    ['Ki','Emax','EC50','kinact','d','kdegg'], staticLists+[self.kdeggStatic.get()],
+                                    "Static Gut Ki=%(Ki)f [uM], EC50=%(EC50)f [uM], Emax=%(Emax)f, kinact=%(kinact)f [min^-1], d=%(d)f, kdegg=%(kdegg)f [min^-1]"))
 
         if self.doTransporterGut:
             D = np.arange(self.D0TransporterGut.get(), self.DFTransporterGut.get(), (self.DFTransporterGut.get()-self.D0TransporterGut.get())/100)
-            I = D/(250*self.MWTransporterGut.get())*1e6 # I [uM]
-            KiList = self.parseList(self.KiTransporterGut.get())
-            for Ki in KiList:
-                legend="Gut Transporter Ki=%f [uM]"%Ki
-                print("Simulating %s"%legend)
-                R.append((I,1+I/Ki))
-                Rlegends.append(legend)
-                Type.append('TransporterGut')
-
+            simulations.append(('TransporterGut', D/(250*self.MWTransporterGut.get())*1e6, reversibleInhibition, ['Ki'],
+                                [self.KiTransporterGut.get()], "Gut Transporter Ki=%(Ki)f [uM]"))
         if self.doTransporterLiver:
             I = np.arange(self.I0TransporterLiver.get(), self.IFTransporterLiver.get(), (self.IFTransporterLiver.get()-self.I0TransporterLiver.get())/100)
-            KiList = self.parseList(self.KiTransporterLiver.get())
-            for Ki in KiList:
-                legend="Liver Transporter Ki=%f [uM]"%Ki
-                print("Simulating %s"%legend)
-                R.append((I,1+I/Ki))
-                Rlegends.append(legend)
-                Type.append('TransporterLiver')
-
+            simulations.append(('TransporterLiver', I, reversibleInhibition, ['Ki'],
+                                [self.KiTransporterLiver.get()], "Liver Transporter Ki=%(Ki)f [uM]"))
         if self.doTransporterRenal:
             I = np.arange(self.I0TransporterRenal.get(), self.IFTransporterRenal.get(), (self.IFTransporterRenal.get()-self.I0TransporterRenal.get())/100)
-            KiList = self.parseList(self.KiTransporterRenal.get())
-            for Ki in KiList:
-                legend="Renal Transporter Ki=%f [uM]"%Ki
-                print("Simulating %s"%legend)
-                R.append((I,1+I/Ki))
-                Rlegends.append(legend)
-                Type.append('TransporterRenal')
-
-        if len(R)>0:
-            fh=open(self._getPath("profiles.txt"),'w')
+            simulations.append(('TransporterRenal', I, reversibleInhibition, ['Ki'],
+                                [self.KiTransporterRenal.get()], "Renal Transporter Ki=%(Ki)f [uM]"))
+
+        if len(simulations)>0:
+            # All the curves of each type are kept as a table with the parameters and R of each combination
+            arrays = {}
+            Rtypes = []
             fhSummary=open(self._getPath("summary.txt"),"w")
-            for toPlot, legend, plotType in izip(R,Rlegends,Type):
-                fh.write(plotType+"::"+legend+"\n")
-                fhSummary.write("Simulated %s:: %s\n"%(plotType,legend))
-                if len(toPlot)==2:
-                    I, Ri = toPlot
-                    for n in range(I.size):
-                        fh.write("%f %f\n"%(I[n],Ri[n]))
-                else:
-                    Ig, Ih, Ri = toPlot
-                    for n in range(Ig.size):
-                        fh.write("%f %f %f\n"%(Ig[n],Ih[n],Ri[n]))
-                fh.write("\n")
-            fh.close()
+            for Rtype, I, Rfunction, parameterNames, strLists, legend in simulations:
+                valueLists = [self.parseList(strList) for strList in strLists]
+                parameters, R = evaluateInteractionGrid(Rfunction, I, valueLists)
+                msg = "%s:: %d combinations of %s"%(Rtype, parameters.shape[0],
+                                                    ", ".join(["%s=%s"%(name, strList.strip())
+                                                               for name, strList in zip(parameterNames, strLists)]))
+                print("Simulated %s"%msg)
+                fhSummary.write("Simulated %s\n"%msg)
+                Rtypes.append(Rtype)
+                arrays[Rtype+"_I"] = I
+                arrays[Rtype+"_parameters"] = parameters
+                arrays[Rtype+"_names"] = np.array(parameterNames)
+                arrays[Rtype+"_R"] = R
+                arrays[Rtype+"_legend"] = np.array(legend)
             fhSummary.close()
+            np.savez(self._getPath("interactions.npz"), types=np.array(Rtypes), **arrays)
 
     #--------------------------- INFO functions --------------------------------------------
     def _summary(self):
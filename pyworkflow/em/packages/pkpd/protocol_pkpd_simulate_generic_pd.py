@@ -169,8 +169,8 @@ class ProtPKPDSimulateGenericPD(ProtPKPD):
         self.experiment.variables[newVariable.varName] = newVariable
 
         for sampleName, sample in self.experiment.samples.iteritems():
-            model.x = np.array(sample.getValues(self.predictor.get()),dtype=np.float)
-            y = model.forwardModel(model.parameters,model.x)
+            model.x = np.array(sample.getMeasurementColumn(self.predictor.get())[0])
+            y = np.asarray(model.forwardModel(model.parameters,model.x)[0])
             y = self.addNoise(y)
             sample.addMeasurementColumn(newVariable.varName,y)
             print("==========================================")
@@ -24,13 +24,14 @@
 # *
 # **************************************************************************
 
-from itertools import izip
+import math
 import numpy as np
 import os
 
 import pyworkflow.protocol.params as params
+from pyworkflow.protocol.constants import LEVEL_ADVANCED
 from pyworkflow.em.protocol.protocol_pkpd import ProtPKPD
-from pyworkflow.em.data import PKPDODEModel
+from pyworkflow.em.data import PKPDODEModel, latinHypercube, sobolSequence
 from pyworkflow.em.biopharmaceutics import DrugSource, createDeltaDose, createVia
 
 class PKPDLiver(PKPDODEModel):
@@ -54,15 +55,10 @@ class PKPDLiver(PKPDODEModel):
 
     def G(self, t, dD):
         Vinlet=self.parameters[4]
-        return np.array([0.0,dD/Vinlet,0.0],np.double)
+        return np.array([0.0*dD,dD/Vinlet,0.0*dD],np.double)
 
     def imposeConstraints(self, yt):
-        if yt[0]<0:
-            yt[0]=0
-        if yt[1]<0:
-            yt[1]=0
-        if yt[2]<0:
-            yt[2]=0
+        yt[yt<0]=0
 
     def getResponseDimension(self):
         return 3
@@ -87,7 +83,38 @@ class PKPDLiverEV1():
 
     def simulate(self,params,t):
         self.drugSource.setParameters(params[0:self.NparametersSource])
-        return self.model.forwardModel(params[self.NparametersSource:],t)
+        return self.model.forwardModel(params[self.NparametersSource:],[t]*self.model.getResponseDimension())
+
+    def simulateBatch(self,doseAmounts,paramsSource,paramsModel,t):
+        """Simulate a dose of each amount with the source and model parameters of the same row.
+           With RK4 all rows are integrated together with the release schedule of its dose.
+           Returns a list (Iliver, Iinlet, Isys) of N x len(t) matrices"""
+        N = len(doseAmounts)
+        if self.model.integrator!="RK4":
+            I = [np.zeros((N,t.size)) for j in range(self.model.getResponseDimension())]
+            for i in range(N):
+                self.setDose(doseAmounts[i])
+                Ii = self.simulate(list(paramsSource[i])+list(paramsModel[i]),t)
+                for j in range(len(I)):
+                    I[j][i,:] = Ii[j]
+            return I
+
+        # The release schedule is proportional to the dose amount, so it is computed for a unit dose
+        # once for each set of source parameters
+        Nsamples = int(math.ceil((self.model.tF-self.model.t0)/self.model.deltaT))+1
+        releasedHalfStep = np.zeros((Nsamples,N))
+        releasedStep = np.zeros((Nsamples,N))
+        self.setDose(1.0)
+        schedules = {}
+        for i in range(N):
+            key = tuple(paramsSource[i])
+            if key not in schedules:
+                self.drugSource.setParameters(list(key))
+                schedules[key] = self.drugSource.getReleaseSchedule(self.model.t0, self.model.deltaT, Nsamples)
+            releasedHalfStep[:,i] = doseAmounts[i]*schedules[key][0]
+            releasedStep[:,i] = doseAmounts[i]*schedules[key][1]
+        return self.model.forwardModelBatch(paramsModel,[t]*self.model.getResponseDimension(),
+                                            (releasedHalfStep,releasedStep))
 
 
 class ProtPKPDSimulateLiverFlow(ProtPKPD):
@@ -95,11 +122,29 @@ class ProtPKPDSimulateLiverFlow(ProtPKPD):
         Protocol created by http://www.kinestatpharma.com\n"""
     _label = 'simulate liver flow'
 
+    DESIGN_FACTORIAL = 0
+    DESIGN_LHS = 1
+    DESIGN_SOBOL = 2
+    PARAMETER_NAMES = ['weight', 'dose', 'Fa', 'ka', 'Vsys', 'ClNH', 'fb', 'Kp', 'Vinlet', 'Vliver', 'Qh', 'Clint']
+
     #--------------------------- DEFINE param functions --------------------------------------------
 
     def _defineParams(self, form, fullForm=True):
         form.addSection('Input')
         form.addParam('tF', params.FloatParam, default=8, label='Max. simulation time [h]')
+        form.addParam('integrator', params.EnumParam, choices=["RK4 (fixed step)","RK45 (adaptive step)",
+                                                               "BDF (stiff)","LSODA (automatic stiffness detection)"],
+                      label="ODE integrator", default=0, expertLevel=LEVEL_ADVANCED,
+                      help='BDF and LSODA are recommended for long simulations')
+        form.addParam('design', params.EnumParam, choices=["Full factorial","Latin hypercube","Sobol sequence"],
+                      label="Parameter sampling", default=self.DESIGN_FACTORIAL,
+                      help='Each parameter may be given as a list of values separated by spaces. The full factorial design '
+                           'simulates all their combinations. Latin hypercube and Sobol designs take a given number of '
+                           'simulations with the parameters spread between the minimum and maximum of each list')
+        form.addParam('Nsimulations', params.IntParam, default=100, condition="design!=%d"%self.DESIGN_FACTORIAL,
+                      label="Number of simulations")
+        form.addParam('seed', params.IntParam, default=-1, condition="design==%d"%self.DESIGN_LHS,
+                      label="Random seed", expertLevel=LEVEL_ADVANCED, help="-1 for a random seed")
 
         group = form.addGroup("Absorption")
         group.addParam("weight", params.StringParam, default=70, label="Weight [kg]")
@@ -126,61 +171,64 @@ class ProtPKPDSimulateLiverFlow(ProtPKPD):
 
     #--------------------------- STEPS functions --------------------------------------------
     def parseList(self, strList):
-        return [float(v) for v in strList.split(' ')]
+        return [float(v) for v in strList.split()]
+
+    def getDesign(self):
+        """Matrix with the parameters of each simulation (one row per simulation, columns as in PARAMETER_NAMES)"""
+        valueLists = [self.parseList(self.getAttributeValue(name)) for name in self.PARAMETER_NAMES]
+        if self.design.get()==self.DESIGN_FACTORIAL:
+            grid = np.meshgrid(*valueLists, indexing='ij')
+            return np.column_stack([values.ravel() for values in grid])
+
+        varying = [n for n in range(len(valueLists)) if len(valueLists[n])>1]
+        Nsimulations = self.Nsimulations.get()
+        if self.design.get()==self.DESIGN_LHS:
+            u = latinHypercube(Nsimulations, len(varying), None if self.seed.get()<0 else self.seed.get())
+        else:
+            u = sobolSequence(Nsimulations, len(varying))
+        design = np.zeros((Nsimulations,len(valueLists)))
+        for n in range(len(valueLists)):
+            design[:,n] = valueLists[n][0]
+        for d, n in enumerate(varying):
+            minValue = min(valueLists[n])
+            maxValue = max(valueLists[n])
+            design[:,n] = minValue+u[:,d]*(maxValue-minValue)
+        return design
 
     def runSimulate(self):
         model = PKPDLiverEV1()
         model.setTimeRange(self.tF.get())
+        model.model.integrator = PKPDODEModel.INTEGRATORS[self.integrator.get()]
         t = np.arange(0.0, self.tF.get()*60, 1)
 
-        I = []
-        legends = []
-        weightList = self.parseList(self.weight.get())
-        doseList = self.parseList(self.dose.get())
-        FaList = self.parseList(self.Fa.get())
-        kaList = self.parseList(self.ka.get())
-        VsysList = self.parseList(self.Vsys.get())
-        ClNHList = self.parseList(self.ClNH.get())
-        fbList = self.parseList(self.fb.get())
-        KpList = self.parseList(self.Kp.get())
-        VinletList = self.parseList(self.Vinlet.get())
-        VliverList = self.parseList(self.Vliver.get())
-        QhList = self.parseList(self.Qh.get())
-        ClintList = self.parseList(self.Clint.get())
-        for weight in weightList:
-            for dose in doseList:
-                for Fa in FaList:
-                    for ka in kaList:
-                        for Vsys in VsysList:
-                            for ClNH in ClNHList:
-                                for fb in fbList:
-                                    for Kp in KpList:
-                                        for Vinlet in VinletList:
-                                            for Vliver in VliverList:
-                                                for Qh in QhList:
-                                                    for Clint in ClintList:
-                                                        legend="Weight=%f Dose=%f Fa=%f ka=%f Vsys=%f ClNH=%f fb=%f Kp=%f Vinlet=%f Vliver=%f Qh=%f Clint=%f"%\
-                                                               (weight, dose, Fa, ka, Vsys, ClNH, fb, Kp, Vinlet, Vliver, Qh, Clint)
-                                                        print("Simulating %s"%legend)
-                                                        legends.append(legend)
-                                                        model.setDose(Fa*dose*weight)
-                                                        Ii = model.simulate([ka,Vsys*weight,ClNH*weight,fb,Kp,
-                                                                             Vinlet*weight,Vliver*weight,Qh*weight*model.model.deltaT,
-                                                                             Clint*weight],t)
-                                                        I.append((t,Ii))
-
-        if len(I)>0:
-            fh=open(self._getPath("profiles.txt"),'w')
-            fhSummary=open(self._getPath("summary.txt"),"w")
-            for toPlot, legend in izip(I,legends):
+        design = self.getDesign()
+        N = design.shape[0]
+        weight, dose, Fa, ka, Vsys, ClNH, fb, Kp, Vinlet, Vliver, Qh, Clint = design.T
+
+        # Simulations are integrated in chunks to limit the memory of the time x state x simulation arrays
+        # and the profiles are written as soon as each chunk is done
+        Nsamples = int(math.ceil((model.model.tF-model.model.t0)/model.model.deltaT))+1
+        Nchunk = max(1,2**22/(Nsamples*model.model.getStateDimension()))
+        fh=open(self._getPath("profiles.txt"),'w')
+        fhSummary=open(self._getPath("summary.txt"),"w")
+        for i0 in range(0,N,Nchunk):
+            i1 = min(i0+Nchunk,N)
+            chunk = slice(i0,i1)
+            w = weight[chunk]
+            I = model.simulateBatch(Fa[chunk]*dose[chunk]*w, ka[chunk,np.newaxis],
+                                    np.column_stack([Vsys[chunk]*w,ClNH[chunk]*w,fb[chunk],Kp[chunk],
+                                                     Vinlet[chunk]*w,Vliver[chunk]*w,Qh[chunk]*w*model.model.deltaT,
+                                                     Clint[chunk]*w]),t)
+            for i in range(i0,i1):
+                legend="Weight=%f Dose=%f Fa=%f ka=%f Vsys=%f ClNH=%f fb=%f Kp=%f Vinlet=%f Vliver=%f Qh=%f Clint=%f"%\
+                       tuple(design[i])
+                print("Simulating %s"%legend)
                 fh.write("SimulateLiver::"+legend+"\n")
                 fhSummary.write("Simulated %s\n"%(legend))
-                t, I3 = toPlot
-                for n in range(t.size):
-                    fh.write("%f %f %f %f\n"%(t[n],I3[0][n],I3[1][n],I3[2][n]))
+                np.savetxt(fh, np.column_stack([t,I[0][i-i0],I[1][i-i0],I[2][i-i0]]), fmt="%f")
                 fh.write("\n")
-            fh.close()
-            fhSummary.close()
+        fh.close()
+        fhSummary.close()
 
     #--------------------------- INFO functions --------------------------------------------
     def _summary(self):
@@ -54,6 +54,7 @@ class ProtPKPDTwoCompartmentsAutoinduction(ProtPKPDODEBase):
                       help="Bounds for time delay, central clearance and volume and peripheral clearance and volume. "\
                       'Make sure that the bounds are expressed in the expected units (estimated from the sample itself).'\
                       'Be careful that Cl bounds must be given here. If you have an estimate of the elimination rate, this is Ke=Cl/V. Consequently, Cl=Ke*V ')
+        form.addParallelSection(threads=1, mpi=0)
 
     def createModel(self):
         return PK_TwocompartmentsAutoinduction()
@@ -59,6 +59,7 @@ class ProtPKPDTwoCompartmentsClintMetabolite(ProtPKPDODEBase):
                       help="Bounds for time delay, maximum processivity, Michaelis constant, volume and peripheral clearance and volume, clearance and volume of the metabolite. "\
                       'Make sure that the bounds are expressed in the expected units (estimated from the sample itself).'\
                       'Be careful that Cl bounds must be given here. If you have an estimate of the elimination rate, this is Ke=Cl/V. Consequently, Cl=Ke*V ')
+        form.addParallelSection(threads=1, mpi=0)
 
     def getXYvars(self):
         self.varNameX=self.predictor.get()
@@ -54,7 +54,7 @@ class PKPDExperimentViewer(Viewer):
     _environments = [DESKTOP_TKINTER]
 
     def visualize(self, obj, **kwargs):
-        obj.load()
+        obj.load(lazy=True)
         self.experimentWindow = self.tkWindow(ExperimentWindow,
                                            title='Experiment Viewer',
                                            experiment=obj,
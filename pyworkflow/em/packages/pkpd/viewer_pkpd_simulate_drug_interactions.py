@@ -26,6 +26,7 @@
 
 from itertools import izip
 import numpy as np
+import os
 
 from pyworkflow.viewer import Viewer, DESKTOP_TKINTER
 from pyworkflow.em.plotter import EmPlotter
@@ -35,6 +36,7 @@ from protocol_pkpd_simulate_drug_interactions import ProtPKPDSimulateDrugInterac
 class PKPDSimulateDrugInteractionsViewer(Viewer):
     _targets = [ProtPKPDSimulateDrugInteractions]
     _environments = [DESKTOP_TKINTER]
+    MAX_LEGENDS = 20 # Larger grids are plotted without legend
 
     def addLimits(self,plotter,previousType,minX,maxX):
         if previousType=="ReversibleLiver":
@@ -92,77 +94,69 @@ class PKPDSimulateDrugInteractionsViewer(Viewer):
             plotter.draw()
 
 
-    def visualize(self, obj, **kwargs):
-        prot = obj
-        fnProfiles = prot._getPath("profiles.txt")
+    def readInteractions(self, fnInteractions):
+        """List of (type, I, R, legends) with the R of all the combinations of each type (one row per combination)"""
+        fh = np.load(fnInteractions)
+        retval = []
+        for Rtype in fh["types"]:
+            legend = str(fh[Rtype+"_legend"])
+            names = [str(name) for name in fh[Rtype+"_names"]]
+            legends = [legend%dict(izip(names, parameters)) for parameters in fh[Rtype+"_parameters"]]
+            retval.append((Rtype, fh[Rtype+"_I"], fh[Rtype+"_R"], legends))
+        fh.close()
+        return retval
+
+    def readProfiles(self, fnProfiles):
+        """Same as readInteractions for the profiles.txt written by previous versions of the protocol"""
         fh = open(fnProfiles,"r")
-        Rtype = []
-        Rlegends = []
-        R = []
+        retval = []
         state = 0
         for line in fh:
             if state==0:
                 tokens = line.split("::")
-                Rtype.append(tokens[0])
-                Rlegends.append(tokens[1].strip())
+                Rtype = tokens[0]
+                legend = tokens[1].strip()
                 Ri=[]
                 state=1
             elif state==1:
                 tokens=line.strip().split()
                 if len(tokens)==0:
-                    R.append(Ri)
+                    Ri = np.asarray(Ri,dtype=np.float64)
+                    if len(retval)==0 or retval[-1][0]!=Rtype:
+                        retval.append((Rtype, Ri[:,0], [], []))
+                    retval[-1][2].append(Ri[:,-1])
+                    retval[-1][3].append(legend)
                     state=0
                 else:
-                    if len(Ri)==0:
-                        for n in range(len(tokens)):
-                            Ri.append([])
-                for n in range(len(tokens)):
-                    Ri[n].append(tokens[n])
+                    Ri.append(tokens)
         fh.close()
+        return [(Rtype, I, np.asarray(R), legends) for Rtype, I, R, legends in retval]
 
-        plotter = None
-        previousType = ""
-        for legend, Ri, Rtypei  in izip(Rlegends, R, Rtype):
-            if plotter is None or Rtypei!=previousType:
-                if previousType!="":
-                    self.addLimits(plotter,previousType,minX,maxX)
-                plotter = EmPlotter()
-                doShow = True
-                if Rtypei=="ReversibleLiver" or Rtypei=="TimeDependentLiver" or Rtypei=="InductionLiver" or Rtypei=="StaticLiver" or Rtypei=="TransporterLiver":
-                    Ilabel="[Ih] [uM]"
-                elif Rtypei=="ReversibleGut" or Rtypei=="TimeDependentGut" or Rtypei=="InductionGut" or Rtypei=="StaticGut" or Rtypei=="TransporterGut":
-                    Ilabel="[Ig] [uM]"
-                elif Rtypei=="TransporterRenal":
-                    Ilabel="[Cmax] [uM]"
-                ax = plotter.createSubPlot("Plot", Ilabel, "R")
-                previousType = Rtypei
-                minX = None
-                maxX = None
-            else:
-                doShow = False
-                ax = plotter.getLastSubPlot()
-
-            x = np.asarray(Ri[0],dtype=np.float64)
-            if len(Ri)==2:
-                y=np.asarray(Ri[1],dtype=np.float64)
-            else:
-                y=np.asarray(Ri[2],dtype=np.float64)
-            ax.plot(x, y, label=legend)
-
-            minXi = np.min(x)
-            maxXi = np.max(x)
-            if minX==None:
-                minX=minXi
-                maxX=maxXi
-            minX=min(minXi,minX)
-            maxX=min(maxXi,maxX)
+    def visualize(self, obj, **kwargs):
+        prot = obj
+        fnInteractions = prot._getPath("interactions.npz")
+        if os.path.exists(fnInteractions):
+            simulations = self.readInteractions(fnInteractions)
+        else:
+            simulations = self.readProfiles(prot._getPath("profiles.txt"))
 
-            leg = ax.legend()
-            if leg:
-                leg.draggable()
+        for Rtype, x, R, legends in simulations:
+            plotter = EmPlotter()
+            if Rtype=="ReversibleLiver" or Rtype=="TimeDependentLiver" or Rtype=="InductionLiver" or Rtype=="StaticLiver" or Rtype=="TransporterLiver":
+                Ilabel="[Ih] [uM]"
+            elif Rtype=="ReversibleGut" or Rtype=="TimeDependentGut" or Rtype=="InductionGut" or Rtype=="StaticGut" or Rtype=="TransporterGut":
+                Ilabel="[Ig] [uM]"
+            elif Rtype=="TransporterRenal":
+                Ilabel="[Cmax] [uM]"
+            ax = plotter.createSubPlot("Plot", Ilabel, "R")
 
-            if doShow:
-                plotter.show()
-            else:
-                plotter.draw()
-        self.addLimits(plotter,previousType,minX,maxX)
+            # All the curves of the type are plotted at once
+            lines = ax.plot(x, R.T)
+            if len(legends)<=self.MAX_LEGENDS:
+                for line, legend in izip(lines, legends):
+                    line.set_label(legend)
+                leg = ax.legend()
+                if leg:
+                    leg.draggable()
+            plotter.show()
+            self.addLimits(plotter,Rtype,np.min(x),np.max(x))
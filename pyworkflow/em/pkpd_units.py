@@ -24,6 +24,9 @@
 # *
 # **************************************************************************
 
+import math
+import numpy as np
+
 class PKPDUnit:
     UNIT_TIME_H = 1
     UNIT_TIME_MIN = 2
@@ -246,6 +249,7 @@ class PKPDUnit:
         UNIT_WEIGHTINVTIME_umol_SEC: "umol/s",
         UNIT_WEIGHTINVTIME_nmol_SEC: "nmol/s",
     }
+    stringDictionary = dict((unitString, unitCode) for unitCode, unitString in unitDictionary.items())
 
     def __init__(self,unitString=""):
         self.unit = self._fromString(unitString)
@@ -282,9 +286,9 @@ class PKPDUnit:
         if unitString == "":
             return None
 
-        for _unitKey, _unitString in cls.unitDictionary.items():
-            if _unitString == unitString:
-                return _unitKey
+        unitCode = cls.stringDictionary.get(unitString, None)
+        if unitCode is not None:
+            return unitCode
         if unitString == "ug/mL":
             return PKPDUnit.UNIT_CONC_mg_L
         elif unitString == "mg/mL":
@@ -292,533 +296,172 @@ class PKPDUnit:
         return None
 
 
+# Every unit code is described by the base units it is made of (e.g. mg*h/L is
+# {mg:1, h:1, L:-1}). From this decomposition we derive its dimension vector
+# (mass, amount of substance, volume, time) and its scale with respect to
+# g, mol, L and s. All the unit algebra below is done on these tables.
+DIM_MASS = 0
+DIM_MOL = 1
+DIM_VOLUME = 2
+DIM_TIME = 3
+
+baseUnits = {
+    "kg":   (DIM_MASS, 1e3),
+    "g":    (DIM_MASS, 1.0),
+    "mg":   (DIM_MASS, 1e-3),
+    "ug":   (DIM_MASS, 1e-6),
+    "ng":   (DIM_MASS, 1e-9),
+    "mmol": (DIM_MOL, 1e-3),
+    "umol": (DIM_MOL, 1e-6),
+    "nmol": (DIM_MOL, 1e-9),
+    "L":    (DIM_VOLUME, 1.0),
+    "mL":   (DIM_VOLUME, 1e-3),
+    "uL":   (DIM_VOLUME, 1e-6),
+    "nL":   (DIM_VOLUME, 1e-9),
+    "h":    (DIM_TIME, 3600.0),
+    "min":  (DIM_TIME, 60.0),
+    "s":    (DIM_TIME, 1.0),
+}
+
+def _parseUnitString(unitString):
+    """ Decompose a unit string (e.g. mg*h^2/L) into a dictionary base unit -> exponent.
+    Returns None if the string cannot be decomposed. """
+    parts = unitString.split("/")
+    if len(parts)>2:
+        return None
+    components = {}
+    for sign, part in zip([1,-1],parts):
+        for token in part.split("*"):
+            if token=="1":
+                continue
+            if "^" in token:
+                token, exponent = token.split("^")
+                exponent = int(exponent)
+            else:
+                exponent = 1
+            if not token in baseUnits:
+                return None
+            components[token] = components.get(token,0)+sign*exponent
+    return components
+
+def _getDimensionScale(components):
+    dims = [0]*4
+    scale = 1.0
+    for token, exponent in components.iteritems():
+        dim, factor = baseUnits[token]
+        dims[dim] += exponent
+        scale *= factor**exponent
+    return tuple(dims), scale
+
+def _getSignature(components):
+    return tuple(sorted([(token, exponent) for token, exponent in components.iteritems() if exponent!=0]))
+
+def _getScaleKey(scale):
+    return round(math.log10(scale),6)
+
+unitComponents = {}  # code -> {base unit: exponent}
+unitDimensions = {}  # code -> (dimension vector, scale)
+_signatureToCode = {}
+_dimensionScaleToCode = {}
+for _code in sorted(PKPDUnit.unitDictionary.keys()):
+    _components = _parseUnitString(PKPDUnit.unitDictionary[_code])
+    if _code==PKPDUnit.UNIT_NONE or _components is None:
+        continue
+    _dims, _scale = _getDimensionScale(_components)
+    unitComponents[_code] = _components
+    unitDimensions[_code] = (_dims, _scale)
+    # The lowest code wins, e.g. mg/L over ug/mL
+    _signatureToCode.setdefault(_getSignature(_components), _code)
+    _dimensionScaleToCode.setdefault((_dims, _getScaleKey(_scale)), _code)
+
+def _findUnit(components):
+    code = _signatureToCode.get(_getSignature(components), None)
+    if code is None:
+        dims, scale = _getDimensionScale(components)
+        code = _dimensionScaleToCode.get((dims, _getScaleKey(scale)), PKPDUnit.UNIT_NONE)
+    return code
+
+def _combineUnits(unitX, unitY, signY):
+    if not unitX in unitComponents or not unitY in unitComponents:
+        return PKPDUnit.UNIT_NONE
+    components = dict(unitComponents[unitX])
+    for token, exponent in unitComponents[unitY].iteritems():
+        components[token] = components.get(token,0)+signY*exponent
+    return _findUnit(components)
+
+def _isRate(unit):
+    dims = unitDimensions[unit][0]
+    return dims[DIM_TIME]==-1 and dims[DIM_VOLUME]==0 and dims[DIM_MASS]+dims[DIM_MOL]==1
+
+def getConversionFactor(unitsIn, unitsOut):
+    """ Factor K such that x [unitsIn] = K*x [unitsOut]. None if the conversion is not possible. """
+    if unitsIn==unitsOut:
+        return 1.0
+    if not unitsIn in unitDimensions or not unitsOut in unitDimensions:
+        return None
+    dimsIn, scaleIn = unitDimensions[unitsIn]
+    dimsOut, scaleOut = unitDimensions[unitsOut]
+    if dimsIn!=dimsOut:
+        if not _isRate(unitsIn) or _isRate(unitsOut):
+            return None
+        # Infusion rates are expressed as amount per minute
+        K, unitsIn = changeRateToMinutes(1.0, unitsIn)
+        dimsIn, scaleIn = unitDimensions[changeRateToWeight(unitsIn)]
+        if dimsIn!=dimsOut:
+            return None
+        return K*scaleIn/scaleOut
+    return scaleIn/scaleOut
+
 def convertUnits(x, unitsIn, unitsOut):
+    """ x can be a scalar or a numpy array """
     if unitsIn==unitsOut:
         return x
-
-    if unitsIn == PKPDUnit.UNIT_WEIGHT_g:
-        if unitsOut == PKPDUnit.UNIT_WEIGHT_g:
-            return x
-        elif unitsOut == PKPDUnit.UNIT_WEIGHT_mg:
-            return 1e3*x
-        elif unitsOut == PKPDUnit.UNIT_WEIGHT_ug:
-            return 1e6*x
-        elif unitsOut == PKPDUnit.UNIT_WEIGHT_ng:
-            return 1e9*x
-        else:
-            raise Exception("Unknown unit conversion from %s to %s"%(PKPDUnit.unitDictionary[unitsIn],PKPDUnit.unitDictionary[unitsOut]))
-
-    elif unitsIn == PKPDUnit.UNIT_WEIGHT_mg:
-        if unitsOut == PKPDUnit.UNIT_WEIGHT_g:
-            return 1e-3*x
-        elif unitsOut == PKPDUnit.UNIT_WEIGHT_mg:
-            return x
-        elif unitsOut == PKPDUnit.UNIT_WEIGHT_ug:
-            return 1e3*x
-        elif unitsOut == PKPDUnit.UNIT_WEIGHT_ng:
-            return 1e6*x
-        else:
-            raise Exception("Unknown unit conversion from %s to %s"%(PKPDUnit.unitDictionary[unitsIn],PKPDUnit.unitDictionary[unitsOut]))
-
-    elif unitsIn == PKPDUnit.UNIT_WEIGHT_ug:
-        if unitsOut == PKPDUnit.UNIT_WEIGHT_g:
-            return 1e-6*x
-        elif unitsOut == PKPDUnit.UNIT_WEIGHT_mg:
-            return 1e-3*x
-        elif unitsOut == PKPDUnit.UNIT_WEIGHT_ug:
-            return x
-        elif unitsOut == PKPDUnit.UNIT_WEIGHT_ng:
-            return 1e3*x
-        else:
-            raise Exception("Unknown unit conversion from %s to %s"%(PKPDUnit.unitDictionary[unitsIn],PKPDUnit.unitDictionary[unitsOut]))
-
-    elif unitsIn == PKPDUnit.UNIT_WEIGHT_ng:
-        if unitsOut == PKPDUnit.UNIT_WEIGHT_g:
-            return 1e-9*x
-        elif unitsOut == PKPDUnit.UNIT_WEIGHT_mg:
-            return 1e-6*x
-        elif unitsOut == PKPDUnit.UNIT_WEIGHT_ug:
-            return 1e-3*x
-        elif unitsOut == PKPDUnit.UNIT_WEIGHT_ng:
-            return x
-        else:
-            raise Exception("Unknown unit conversion from %s to %s"%(PKPDUnit.unitDictionary[unitsIn],PKPDUnit.unitDictionary[unitsOut]))
-
-    elif unitsIn == PKPDUnit.UNIT_WEIGHT_mmol:
-        if unitsOut == PKPDUnit.UNIT_WEIGHT_mmol:
-            return x
-        elif unitsOut == PKPDUnit.UNIT_WEIGHT_umol:
-            return 1e3*x
-        elif unitsOut == PKPDUnit.UNIT_WEIGHT_nmol:
-            return 1e6*x
-        else:
-            raise Exception("Unknown unit conversion from %s to %s"%(PKPDUnit.unitDictionary[unitsIn],PKPDUnit.unitDictionary[unitsOut]))
-
-    elif unitsIn == PKPDUnit.UNIT_WEIGHT_umol:
-        if unitsOut == PKPDUnit.UNIT_WEIGHT_mmol:
-            return 1e-3*x
-        elif unitsOut == PKPDUnit.UNIT_WEIGHT_umol:
-            return x
-        elif unitsOut == PKPDUnit.UNIT_WEIGHT_nmol:
-            return 1e3*x
-        else:
-            raise Exception("Unknown unit conversion from %s to %s"%(PKPDUnit.unitDictionary[unitsIn],PKPDUnit.unitDictionary[unitsOut]))
-
-    elif unitsIn == PKPDUnit.UNIT_WEIGHT_nmol:
-        if unitsOut == PKPDUnit.UNIT_WEIGHT_mmol:
-            return 1e-6*x
-        elif unitsOut == PKPDUnit.UNIT_WEIGHT_umol:
-            return 1e-3*x
-        elif unitsOut == PKPDUnit.UNIT_WEIGHT_nmol:
-            return x
-        else:
-            raise Exception("Unknown unit conversion from %s to %s"%(PKPDUnit.unitDictionary[unitsIn],PKPDUnit.unitDictionary[unitsOut]))
-
-    elif unitsIn == PKPDUnit.UNIT_CONC_g_L:
-        if unitsOut == PKPDUnit.UNIT_CONC_mg_L or unitsOut==PKPDUnit.UNIT_CONC_ug_mL:
-            return 1e3*x
-        elif unitsOut == PKPDUnit.UNIT_CONC_ug_L:
-            return 1e6*x
-        elif unitsOut == PKPDUnit.UNIT_CONC_ng_L:
-            return 1e9*x
-        elif unitsOut == PKPDUnit.UNIT_CONC_g_mL:
-            return 1e-3*x
-        elif unitsOut == PKPDUnit.UNIT_CONC_g_uL:
-            return 1e-6*x
-
-    elif unitsIn == PKPDUnit.UNIT_CONC_mg_L  or unitsIn==PKPDUnit.UNIT_CONC_ug_mL:
-        if unitsOut == PKPDUnit.UNIT_CONC_g_L:
-            return 1e-3*x
-        elif unitsOut == PKPDUnit.UNIT_CONC_mg_L  or unitsOut==PKPDUnit.UNIT_CONC_ug_mL:
-            return 1
-        elif unitsOut == PKPDUnit.UNIT_CONC_ug_L:
-            return 1e3*x
-        elif unitsOut == PKPDUnit.UNIT_CONC_ng_L:
-            return 1e6*x
-        elif unitsOut == PKPDUnit.UNIT_CONC_g_mL:
-            return x
-        elif unitsOut == PKPDUnit.UNIT_CONC_g_uL:
-            return 1e-3*x
-
-    elif unitsIn == PKPDUnit.UNIT_CONC_ug_L:
-        if unitsOut == PKPDUnit.UNIT_CONC_g_L:
-            return 1e-6*x
-        elif unitsOut == PKPDUnit.UNIT_CONC_mg_L  or unitsOut==PKPDUnit.UNIT_CONC_ug_mL:
-            return 1e-3*x
-        elif unitsOut == PKPDUnit.UNIT_CONC_ng_L:
-            return 1e3*x
-        elif unitsOut == PKPDUnit.UNIT_CONC_g_mL:
-            return 1e-3*x
-        elif unitsOut == PKPDUnit.UNIT_CONC_g_uL:
-            return x
-
-    elif unitsIn == PKPDUnit.UNIT_CONC_ng_L:
-        if unitsOut == PKPDUnit.UNIT_CONC_g_L:
-            return 1e-9*x
-        elif unitsOut == PKPDUnit.UNIT_CONC_mg_L or unitsOut==PKPDUnit.UNIT_CONC_ug_mL:
-            return 1e-6*x
-        elif unitsOut == PKPDUnit.UNIT_CONC_ug_L:
-            return 1e-3*x
-        elif unitsOut == PKPDUnit.UNIT_CONC_g_mL:
-            return x
-        elif unitsOut == PKPDUnit.UNIT_CONC_g_uL:
-            return 1e3*x
-
-    elif unitsIn == PKPDUnit.UNIT_CONC_g_mL:
-        if unitsOut == PKPDUnit.UNIT_CONC_g_L:
-            return 1e3*x
-        elif unitsOut == PKPDUnit.UNIT_CONC_mg_L or unitsOut==PKPDUnit.UNIT_CONC_ug_mL:
-            return x
-        elif unitsOut == PKPDUnit.UNIT_CONC_ug_L:
-            return 1e-3*x
-        elif unitsOut == PKPDUnit.UNIT_CONC_ng_L:
-            return 1e-6*x
-        elif unitsOut == PKPDUnit.UNIT_CONC_g_uL:
-            return 1e-3*x
-
-    elif unitsIn == PKPDUnit.UNIT_CONC_g_uL:
-        if unitsOut == PKPDUnit.UNIT_CONC_g_L:
-            return 1e6*x
-        elif unitsOut == PKPDUnit.UNIT_CONC_mg_L or unitsOut==PKPDUnit.UNIT_CONC_ug_mL:
-            return 1e3*x
-        elif unitsOut == PKPDUnit.UNIT_CONC_ug_L:
-            return x
-        elif unitsOut == PKPDUnit.UNIT_CONC_ng_L:
-            return 1e-3*x
-        elif unitsOut == PKPDUnit.UNIT_CONC_g_mL:
-            return 1e3*x
-
-    elif unitsIn == PKPDUnit.UNIT_TIME_H:
-        if unitsOut == PKPDUnit.UNIT_TIME_MIN:
-            return 60*x
-        elif unitsOut == PKPDUnit.UNIT_TIME_SEC:
-            return 3600*x
-
-    elif unitsIn == PKPDUnit.UNIT_TIME_MIN:
-        if unitsOut == PKPDUnit.UNIT_TIME_H:
-            return x/60
-        elif unitsOut == PKPDUnit.UNIT_TIME_SEC:
-            return 60*x
-
-    elif unitsIn == PKPDUnit.UNIT_TIME_SEC:
-        if unitsOut == PKPDUnit.UNIT_TIME_H:
-            return x/3600
-        elif unitsOut == PKPDUnit.UNIT_TIME_MIN:
-            return x/60
-
-    elif unitsIn == PKPDUnit.UNIT_TIMECONC_MIN_mg_L:
-        if unitsOut == PKPDUnit.UNIT_TIMECONC_H_mg_L:
-            return x/60
-
-    elif unitsIn == PKPDUnit.UNIT_WEIGHTINVTIME_g_MIN:
-        if unitsOut == PKPDUnit.UNIT_WEIGHT_g:
-            return x
-        elif unitsOut == PKPDUnit.UNIT_WEIGHT_mg:
-            return 1e3*x
-        elif unitsOut == PKPDUnit.UNIT_WEIGHT_ug:
-            return 1e6*x
-        elif unitsOut == PKPDUnit.UNIT_WEIGHT_ng:
-            return 1e9*x
-
-    elif unitsIn == PKPDUnit.UNIT_WEIGHTINVTIME_mg_MIN:
-        if unitsOut == PKPDUnit.UNIT_WEIGHT_g:
-            return 1e-3*x
-        elif unitsOut == PKPDUnit.UNIT_WEIGHT_mg:
-            return x
-        elif unitsOut == PKPDUnit.UNIT_WEIGHT_ug:
-            return 1e3*x
-        elif unitsOut == PKPDUnit.UNIT_WEIGHT_ng:
-            return 1e6*x
-
-    elif unitsIn == PKPDUnit.UNIT_WEIGHTINVTIME_ug_MIN:
-        if unitsOut == PKPDUnit.UNIT_WEIGHT_g:
-            return 1e-6*x
-        elif unitsOut == PKPDUnit.UNIT_WEIGHT_mg:
-            return 1e-3*x
-        elif unitsOut == PKPDUnit.UNIT_WEIGHT_ug:
-            return x
-        elif unitsOut == PKPDUnit.UNIT_WEIGHT_ng:
-            return 1e3*x
-
-    elif unitsIn == PKPDUnit.UNIT_WEIGHTINVTIME_ng_MIN:
-        if unitsOut == PKPDUnit.UNIT_WEIGHT_g:
-            return 1e-9*x
-        elif unitsOut == PKPDUnit.UNIT_WEIGHT_mg:
-            return 1e-6*x
-        elif unitsOut == PKPDUnit.UNIT_WEIGHT_ug:
-            return 1e-3*x
-        elif unitsOut == PKPDUnit.UNIT_WEIGHT_ng:
-            return x
-
-    elif unitsIn == PKPDUnit.UNIT_WEIGHTINVTIME_umol_MIN:
-        if unitsOut == PKPDUnit.UNIT_WEIGHT_umol:
-            return x
-
-    return None
+    K = getConversionFactor(unitsIn, unitsOut)
+    if K is None:
+        if unitsIn>=PKPDUnit.UNIT_WEIGHT_kg and unitsIn<=PKPDUnit.UNIT_WEIGHT_nmol:
+            raise Exception("Unknown unit conversion from %s to %s"%(strUnit(unitsIn),strUnit(unitsOut)))
+        return None
+    if isinstance(x,list):
+        x = np.asarray(x,dtype=np.double)
+    return K*x
+
+def _getRateUnit(unit, timeUnit):
+    """ Replace the time in the denominator of a rate by timeUnit (None to remove it).
+    Returns the new unit and the time that was replaced """
+    components = unitComponents[unit]
+    for token in ["h","min","s"]:
+        if components.get(token,0)==-1:
+            newComponents = dict(components)
+            del newComponents[token]
+            if timeUnit is not None:
+                newComponents[timeUnit] = -1
+            return _findUnit(newComponents), token
+    return PKPDUnit.UNIT_NONE, None
 
 def changeRateToMinutes(amount,unit):
-    if unit==PKPDUnit.UNIT_WEIGHTINVTIME_g_H:
-        return (amount/60,PKPDUnit.UNIT_WEIGHTINVTIME_g_MIN)
-    elif unit==PKPDUnit.UNIT_WEIGHTINVTIME_g_SEC:
-        return (amount*60,PKPDUnit.UNIT_WEIGHTINVTIME_g_MIN)
-
-    elif unit==PKPDUnit.UNIT_WEIGHTINVTIME_mg_H:
-        return (amount/60,PKPDUnit.UNIT_WEIGHTINVTIME_mg_MIN)
-    elif unit==PKPDUnit.UNIT_WEIGHTINVTIME_mg_SEC:
-        return (amount*60,PKPDUnit.UNIT_WEIGHTINVTIME_mg_MIN)
-
-    elif unit==PKPDUnit.UNIT_WEIGHTINVTIME_ug_H:
-        return (amount/60,PKPDUnit.UNIT_WEIGHTINVTIME_ug_MIN)
-    elif unit==PKPDUnit.UNIT_WEIGHTINVTIME_ug_SEC:
-        return (amount*60,PKPDUnit.UNIT_WEIGHTINVTIME_ug_MIN)
-
-    elif unit==PKPDUnit.UNIT_WEIGHTINVTIME_ng_H:
-        return (amount/60,PKPDUnit.UNIT_WEIGHTINVTIME_ng_MIN)
-    elif unit==PKPDUnit.UNIT_WEIGHTINVTIME_ng_SEC:
-        return (amount*60,PKPDUnit.UNIT_WEIGHTINVTIME_ng_MIN)
-
-    elif unit==PKPDUnit.UNIT_WEIGHTINVTIME_umol_H:
-        return (amount/60,PKPDUnit.UNIT_WEIGHTINVTIME_umol_MIN)
-    elif unit==PKPDUnit.UNIT_WEIGHTINVTIME_umol_SEC:
-        return (amount*60,PKPDUnit.UNIT_WEIGHTINVTIME_umol_MIN)
-
-    else:
-        return (amount,unit)
+    if unit in unitDimensions and _isRate(unit):
+        newUnit, token = _getRateUnit(unit, "min")
+        if token!="min" and newUnit!=PKPDUnit.UNIT_NONE:
+            return (amount*baseUnits["min"][1]/baseUnits[token][1], newUnit)
+    return (amount,unit)
 
 def changeRateToWeight(unit):
-    if unit==PKPDUnit.UNIT_WEIGHTINVTIME_g_MIN:
-        return PKPDUnit.UNIT_WEIGHT_g
-    elif unit==PKPDUnit.UNIT_WEIGHTINVTIME_mg_MIN:
-        return PKPDUnit.UNIT_WEIGHT_mg
-    elif unit==PKPDUnit.UNIT_WEIGHTINVTIME_ug_MIN:
-        return PKPDUnit.UNIT_WEIGHT_ug
-    elif unit==PKPDUnit.UNIT_WEIGHTINVTIME_ng_MIN:
-        return PKPDUnit.UNIT_WEIGHT_ng
-    elif unit==PKPDUnit.UNIT_WEIGHTINVTIME_umol_MIN:
-        return PKPDUnit.UNIT_WEIGHT_umol
-    else:
-        return unit
+    if unit in unitDimensions and _isRate(unit):
+        newUnit, token = _getRateUnit(unit, None)
+        if token=="min" and newUnit!=PKPDUnit.UNIT_NONE:
+            return newUnit
+    return unit
 
 def multiplyUnits(unitX,unitY):
-    if unitX==PKPDUnit.UNIT_TIME_H:
-        if unitY==PKPDUnit.UNIT_CONC_g_L:
-            return PKPDUnit.UNIT_TIMECONC_H_g_L
-        elif unitY==PKPDUnit.UNIT_CONC_mg_L:
-            return PKPDUnit.UNIT_TIMECONC_H_mg_L
-        elif unitY==PKPDUnit.UNIT_CONC_ug_L:
-            return PKPDUnit.UNIT_TIMECONC_H_ug_L
-        elif unitY==PKPDUnit.UNIT_CONC_ng_L:
-            return PKPDUnit.UNIT_TIMECONC_H_ng_L
-        elif unitY==PKPDUnit.UNIT_CONC_g_mL:
-            return PKPDUnit.UNIT_TIMECONC_H_g_mL
-        elif unitY==PKPDUnit.UNIT_CONC_g_uL:
-            return PKPDUnit.UNIT_TIMECONC_H_g_uL
-        elif unitY==PKPDUnit.UNIT_CONC_ug_mL:
-            return PKPDUnit.UNIT_TIMECONC_H_ug_mL
-        elif unitY==PKPDUnit.UNIT_CONC_mmol_L:
-            return PKPDUnit.UNIT_TIMECONC_H_mmol_L
-        elif unitY==PKPDUnit.UNIT_CONC_umol_L:
-            return PKPDUnit.UNIT_TIMECONC_H_umol_L
-        elif unitY==PKPDUnit.UNIT_CONC_nmol_L:
-            return PKPDUnit.UNIT_TIMECONC_H_nmol_L
-
-        elif unitY==PKPDUnit.UNIT_TIMECONC_H_g_L:
-            return PKPDUnit.UNIT_TIME2CONC_H2_g_L
-        elif unitY==PKPDUnit.UNIT_TIMECONC_H_mg_L:
-            return PKPDUnit.UNIT_TIME2CONC_H2_mg_L
-        elif unitY==PKPDUnit.UNIT_TIMECONC_H_ug_L:
-            return PKPDUnit.UNIT_TIME2CONC_H2_ug_L
-        elif unitY==PKPDUnit.UNIT_TIMECONC_H_ng_L:
-            return PKPDUnit.UNIT_TIME2CONC_H2_ng_L
-        elif unitY==PKPDUnit.UNIT_TIMECONC_H_g_mL:
-            return PKPDUnit.UNIT_TIME2CONC_H2_g_mL
-        elif unitY==PKPDUnit.UNIT_TIMECONC_H_g_uL:
-            return PKPDUnit.UNIT_TIME2CONC_H2_g_uL
-        elif unitY==PKPDUnit.UNIT_TIMECONC_H_ug_mL:
-            return PKPDUnit.UNIT_TIME2CONC_H2_ug_mL
-        elif unitY==PKPDUnit.UNIT_TIMECONC_H_mmol_L:
-            return PKPDUnit.UNIT_TIME2CONC_H2_mmol_L
-        elif unitY==PKPDUnit.UNIT_TIMECONC_H_umol_L:
-            return PKPDUnit.UNIT_TIME2CONC_H2_umol_L
-        elif unitY==PKPDUnit.UNIT_TIMECONC_H_nmol_L:
-            return PKPDUnit.UNIT_TIME2CONC_H2_nmol_L
-
-        else:
-            return PKPDUnit.UNIT_NONE
-
-    elif unitX==PKPDUnit.UNIT_TIME_MIN:
-        if unitY==PKPDUnit.UNIT_CONC_g_L:
-            return PKPDUnit.UNIT_TIMECONC_MIN_g_L
-        elif unitY==PKPDUnit.UNIT_CONC_mg_L:
-            return PKPDUnit.UNIT_TIMECONC_MIN_mg_L
-        elif unitY==PKPDUnit.UNIT_CONC_ug_L:
-            return PKPDUnit.UNIT_TIMECONC_MIN_ug_L
-        elif unitY==PKPDUnit.UNIT_CONC_ng_L:
-            return PKPDUnit.UNIT_TIMECONC_MIN_ng_L
-        elif unitY==PKPDUnit.UNIT_CONC_g_mL:
-            return PKPDUnit.UNIT_TIMECONC_MIN_g_mL
-        elif unitY==PKPDUnit.UNIT_CONC_g_uL:
-            return PKPDUnit.UNIT_TIMECONC_MIN_g_uL
-        elif unitY==PKPDUnit.UNIT_CONC_ug_mL:
-            return PKPDUnit.UNIT_TIMECONC_MIN_ug_mL
-        elif unitY==PKPDUnit.UNIT_CONC_mmol_L:
-            return PKPDUnit.UNIT_TIMECONC_MIN_mmol_L
-        elif unitY==PKPDUnit.UNIT_CONC_umol_L:
-            return PKPDUnit.UNIT_TIMECONC_MIN_umol_L
-        elif unitY==PKPDUnit.UNIT_CONC_nmol_L:
-            return PKPDUnit.UNIT_TIMECONC_MIN_nmol_L
-
-        elif unitY==PKPDUnit.UNIT_TIMECONC_MIN_g_L:
-            return PKPDUnit.UNIT_TIME2CONC_MIN2_g_L
-        elif unitY==PKPDUnit.UNIT_TIMECONC_MIN_mg_L:
-            return PKPDUnit.UNIT_TIME2CONC_MIN2_mg_L
-        elif unitY==PKPDUnit.UNIT_TIMECONC_MIN_ug_L:
-            return PKPDUnit.UNIT_TIME2CONC_MIN2_ug_L
-        elif unitY==PKPDUnit.UNIT_TIMECONC_MIN_ng_L:
-            return PKPDUnit.UNIT_TIME2CONC_MIN2_ng_L
-        elif unitY==PKPDUnit.UNIT_TIMECONC_MIN_g_mL:
-            return PKPDUnit.UNIT_TIME2CONC_MIN2_g_mL
-        elif unitY==PKPDUnit.UNIT_TIMECONC_MIN_g_uL:
-            return PKPDUnit.UNIT_TIME2CONC_MIN2_g_uL
-        elif unitY==PKPDUnit.UNIT_TIMECONC_MIN_ug_mL:
-            return PKPDUnit.UNIT_TIME2CONC_MIN2_ug_mL
-        elif unitY==PKPDUnit.UNIT_TIMECONC_MIN_mmol_L:
-            return PKPDUnit.UNIT_TIME2CONC_MIN2_mmol_L
-        elif unitY==PKPDUnit.UNIT_TIMECONC_MIN_umol_L:
-            return PKPDUnit.UNIT_TIME2CONC_MIN2_umol_L
-        elif unitY==PKPDUnit.UNIT_TIMECONC_MIN_nmol_L:
-            return PKPDUnit.UNIT_TIME2CONC_MIN2_nmol_L
-
-        else:
-            return PKPDUnit.UNIT_NONE
-
-    elif unitX==PKPDUnit.UNIT_VOLUMEINVTIME_mL_MIN:
-        if unitY==PKPDUnit.UNIT_CONC_g_mL:
-            return PKPDUnit.UNIT_WEIGHTINVTIME_g_MIN
-        elif unitY==PKPDUnit.UNIT_CONC_g_L:
-            return PKPDUnit.UNIT_WEIGHTINVTIME_mg_MIN
-        elif unitY==PKPDUnit.UNIT_CONC_ug_mL:
-            return PKPDUnit.UNIT_WEIGHTINVTIME_ug_MIN
-
-    elif unitX==PKPDUnit.UNIT_VOLUMEINVTIME_L_MIN:
-        if unitY==PKPDUnit.UNIT_CONC_g_L:
-            return PKPDUnit.UNIT_WEIGHTINVTIME_g_MIN
-        elif unitY==PKPDUnit.UNIT_CONC_mg_L:
-            return PKPDUnit.UNIT_WEIGHTINVTIME_mg_MIN
-        elif unitY==PKPDUnit.UNIT_CONC_ug_L:
-            return PKPDUnit.UNIT_WEIGHTINVTIME_ug_MIN
-        elif unitY==PKPDUnit.UNIT_CONC_umol_L:
-            return PKPDUnit.UNIT_WEIGHTINVTIME_umol_MIN
-
+    return _combineUnits(unitX,unitY,1)
 
 def divideUnits(unitX,unitY):
-    if unitX==PKPDUnit.UNIT_WEIGHT_g:
-        if unitY==PKPDUnit.UNIT_CONC_g_L:
-            return PKPDUnit.UNIT_VOLUME_L
-        elif unitY==PKPDUnit.UNIT_CONC_mg_L:
-            return PKPDUnit.UNIT_NONE
-        elif unitY==PKPDUnit.UNIT_CONC_ug_L:
-            return PKPDUnit.UNIT_NONE
-        elif unitY==PKPDUnit.UNIT_CONC_ng_L:
-            return PKPDUnit.UNIT_NONE
-
-        elif unitY==PKPDUnit.UNIT_CONC_g_mL:
-            return PKPDUnit.UNIT_VOLUME_mL
-
-        elif unitY==PKPDUnit.UNIT_CONC_g_uL:
-            return PKPDUnit.UNIT_VOLUME_uL
-        else:
-            return PKPDUnit.UNIT_NONE
-
-    elif unitX==PKPDUnit.UNIT_WEIGHT_mg:
-        if unitY==PKPDUnit.UNIT_CONC_g_L:
-            return PKPDUnit.UNIT_VOLUME_mL
-        elif unitY==PKPDUnit.UNIT_CONC_mg_L:
-            return PKPDUnit.UNIT_VOLUME_L
-        elif unitY==PKPDUnit.UNIT_CONC_ug_L:
-            return PKPDUnit.UNIT_NONE
-        elif unitY==PKPDUnit.UNIT_CONC_ng_L:
-            return PKPDUnit.UNIT_NONE
-
-        elif unitY==PKPDUnit.UNIT_CONC_g_mL:
-            return PKPDUnit.UNIT_VOLUME_uL
-
-        elif unitY==PKPDUnit.UNIT_CONC_g_uL:
-            return PKPDUnit.UNIT_VOLUME_nL
-        else:
-            return PKPDUnit.UNIT_NONE
-
-    elif unitX==PKPDUnit.UNIT_WEIGHT_ug:
-        if unitY==PKPDUnit.UNIT_CONC_g_L:
-            return PKPDUnit.UNIT_VOLUME_uL
-        elif unitY==PKPDUnit.UNIT_CONC_mg_L:
-            return PKPDUnit.UNIT_VOLUME_mL
-        elif unitY==PKPDUnit.UNIT_CONC_ug_L:
-            return PKPDUnit.UNIT_VOLUME_L
-        elif unitY==PKPDUnit.UNIT_CONC_ng_L:
-            return PKPDUnit.UNIT_NONE
-
-        elif unitY==PKPDUnit.UNIT_CONC_g_mL:
-            return PKPDUnit.UNIT_VOLUME_nL
-        elif unitY==PKPDUnit.UNIT_CONC_g_uL:
-            return PKPDUnit.UNIT_NONE
-
-        elif unitY==PKPDUnit.UNIT_CONC_ug_mL:
-            return PKPDUnit.UNIT_VOLUME_mL
-
-        else:
-            return PKPDUnit.UNIT_NONE
-
-    elif unitX==PKPDUnit.UNIT_WEIGHT_ng:
-        if unitY==PKPDUnit.UNIT_CONC_g_L:
-            return PKPDUnit.UNIT_VOLUME_nL
-        elif unitY==PKPDUnit.UNIT_CONC_mg_L:
-            return PKPDUnit.UNIT_VOLUME_uL
-        elif unitY==PKPDUnit.UNIT_CONC_ug_L:
-            return PKPDUnit.UNIT_VOLUME_mL
-        elif unitY==PKPDUnit.UNIT_CONC_ng_L:
-            return PKPDUnit.UNIT_VOLUME_L
-
-        elif unitY==PKPDUnit.UNIT_CONC_g_mL:
-            return PKPDUnit.UNIT_NONE
-
-        elif unitY==PKPDUnit.UNIT_CONC_g_uL:
-            return PKPDUnit.UNIT_NONE
-        else:
-            return PKPDUnit.UNIT_NONE
-
-    elif unitX==PKPDUnit.UNIT_WEIGHT_mmol:
-        if unitY==PKPDUnit.UNIT_CONC_mmol_L:
-            return PKPDUnit.UNIT_VOLUME_L
-        else:
-            return PKPDUnit.UNIT_NONE
-
-    elif unitX==PKPDUnit.UNIT_WEIGHT_umol:
-        if unitY==PKPDUnit.UNIT_CONC_umol_L:
-            return PKPDUnit.UNIT_VOLUME_L
-        else:
-            return PKPDUnit.UNIT_NONE
-
-    elif unitX==PKPDUnit.UNIT_WEIGHT_nmol:
-        if unitY==PKPDUnit.UNIT_CONC_nmol_L:
-            return PKPDUnit.UNIT_VOLUME_L
-        else:
-            return PKPDUnit.UNIT_NONE
-
-    elif unitX==PKPDUnit.UNIT_VOLUME_L:
-        if unitY==PKPDUnit.UNIT_TIME_H:
-            return PKPDUnit.UNIT_VOLUMEINVTIME_L_H
-        elif unitY==PKPDUnit.UNIT_TIME_MIN:
-            return PKPDUnit.UNIT_VOLUMEINVTIME_L_MIN
-        elif unitY==PKPDUnit.UNIT_TIME_SEC:
-            return PKPDUnit.UNIT_VOLUMEINVTIME_L_SEC
-        else:
-            return PKPDUnit.UNIT_NONE
-
-    elif unitX==PKPDUnit.UNIT_VOLUME_mL:
-        if unitY==PKPDUnit.UNIT_TIME_H:
-            return PKPDUnit.UNIT_VOLUMEINVTIME_mL_H
-        elif unitY==PKPDUnit.UNIT_TIME_MIN:
-            return PKPDUnit.UNIT_VOLUMEINVTIME_mL_MIN
-        elif unitY==PKPDUnit.UNIT_TIME_SEC:
-            return PKPDUnit.UNIT_VOLUMEINVTIME_mL_SEC
-        else:
-            return PKPDUnit.UNIT_NONE
-
-    elif unitX==PKPDUnit.UNIT_VOLUME_uL:
-        if unitY==PKPDUnit.UNIT_TIME_H:
-            return PKPDUnit.UNIT_VOLUMEINVTIME_uL_H
-        elif unitY==PKPDUnit.UNIT_TIME_MIN:
-            return PKPDUnit.UNIT_VOLUMEINVTIME_uL_MIN
-        elif unitY==PKPDUnit.UNIT_TIME_SEC:
-            return PKPDUnit.UNIT_VOLUMEINVTIME_uL_SEC
-        else:
-            return PKPDUnit.UNIT_NONE
-
-    elif unitX==PKPDUnit.UNIT_VOLUME_nL:
-        if unitY==PKPDUnit.UNIT_TIME_H:
-            return PKPDUnit.UNIT_VOLUMEINVTIME_nL_H
-        elif unitY==PKPDUnit.UNIT_TIME_MIN:
-            return PKPDUnit.UNIT_VOLUMEINVTIME_nL_MIN
-        elif unitY==PKPDUnit.UNIT_TIME_SEC:
-            return PKPDUnit.UNIT_VOLUMEINVTIME_nL_SEC
-        else:
-            return PKPDUnit.UNIT_NONE
-
-    else:
-        return PKPDUnit.UNIT_NONE
-
+    return _combineUnits(unitX,unitY,-1)
 
 def inverseUnits(unit):
-    if unit == PKPDUnit.UNIT_TIME_H:
-        return PKPDUnit.UNIT_INVTIME_H
-    elif unit == PKPDUnit.UNIT_TIME_MIN:
-        return PKPDUnit.UNIT_INVTIME_MIN
-    elif unit == PKPDUnit.UNIT_TIME_SEC:
-        return PKPDUnit.UNIT_INVTIME_SEC
-
-    else:
+    if not unit in unitComponents:
         return PKPDUnit.UNIT_NONE
+    return _findUnit(dict([(token,-exponent) for token, exponent in unitComponents[unit].iteritems()]))
 
 def createUnit(unitName):
     unit = PKPDUnit()
@@ -32,6 +32,7 @@ import os
 from pyworkflow.em.protocol import *
 from pyworkflow.em.data import PKPDExperiment, PKPDFitting
 import pyworkflow.protocol.params as params
+from pyworkflow.protocol.constants import LEVEL_ADVANCED
 
 class ProtPKPD(EMProtocol):
     def printSection(self, msg):
@@ -88,6 +89,18 @@ class ProtPKPD(EMProtocol):
         """
         self.setExperiment(self.loadInputExperiment())
 
+    def setupDEOptimizer(self, optimizer):
+        """ Copy the differential evolution parameters of the form (see addDEToForm)
+        to a PKPDDEOptimizer. Protocols without them keep the optimizer defaults.
+        """
+        if hasattr(self,"DEpopsize"):
+            optimizer.popsize = self.DEpopsize.get()
+            optimizer.maxiter = self.DEmaxiter.get()
+            optimizer.tol = self.DEtol.get()
+            optimizer.seed = None if self.DEseed.get()<0 else self.DEseed.get()
+        if hasattr(self,"DEbatch"):
+            optimizer.batch = self.DEbatch.get()
+
 def addDoseToForm(form):
     form.addParam('doses', params.TextParam, height=5, width=70, label="Doses", default="",
                   help="Structure: [Dose Name] ; [via=ViaName] ; [doseType] ; [time description] ; [dose description]\n"\
@@ -100,3 +113,23 @@ def addDoseToForm(form):
                        "Infusion0 ; via=Intravenous; infusion; t=0.500000:0.750000 h; d=60*weight/1000 mg\n"\
                        "Bolus1 ; via=Oral; bolus; t=2.000000 h; d=100 mg\n"\
                        "Treatment ; via=Oral; repeated_bolus; t=0:8:48 h; d=100 mg")
+
+def addDEToForm(form, condition=None, batch=False):
+    form.addParam('DEpopsize', params.IntParam, label="Global search: population size", default=15, condition=condition,
+                  expertLevel=LEVEL_ADVANCED,
+                  help='The population of the differential evolution has this number of members per parameter')
+    form.addParam('DEmaxiter', params.IntParam, label="Global search: maximum generations", default=1000, condition=condition,
+                  expertLevel=LEVEL_ADVANCED)
+    form.addParam('DEtol', params.FloatParam, label="Global search: tolerance", default=0.01, condition=condition,
+                  expertLevel=LEVEL_ADVANCED,
+                  help='The search stops when the standard deviation of the goal function in the population is below '
+                       'this fraction of its mean')
+    form.addParam('DEseed', params.IntParam, label="Global search: random seed", default=-1, condition=condition,
+                  expertLevel=LEVEL_ADVANCED,
+                  help='Seed of the differential evolution. If -1, it is taken from the system and results are not reproducible')
+    if batch:
+        form.addParam('DEbatch', params.BooleanParam, label="Global search: evaluate generations at once", default=False,
+                      condition=condition, expertLevel=LEVEL_ADVANCED,
+                      help='All the trial parameters of a generation are created from the previous one and simulated '
+                           'together, which is much faster than simulating them one by one. Otherwise, scipy\'s '
+                           'differential evolution is used and the population is updated after each trial')
@@ -41,6 +41,9 @@ class SqliteMapper(Mapper):
             self.db = SqliteObjectsDb(dbName)
         except Exception, ex:
             raise Exception('Error creating SqliteMapper, dbName: %s\n error: %s' % (dbName, ex))
+        # Ids of the top-level objects modified through this mapper
+        self._changedIds = set()
+        self._dataVersion = self.db.getDataVersion()
     
     def close(self):
         self.db.close()
@@ -77,11 +80,61 @@ class SqliteMapper(Mapper):
             namePrefix = sid
         else:
             namePrefix = joinExt(namePrefix, sid)
-        self.insertChilds(obj, namePrefix)
+        # The insert above holds the write lock of the db and its id is
+        # the largest one, so the ids of the childs are assigned here and 
+        # all of them are inserted at once
+        rows = []
+        self.__insertChildsBatch(obj, namePrefix, rows, obj._objId + 1)
+        self.db.insertObjects(rows)
+        
+    def __markChanged(self, obj):
+        """ Register the top-level object containing obj as changed. """
+        if self._changedIds is None:
+            return
+        if obj._objParentId is None:
+            self._changedIds.add(obj._objId)
+        else:
+            try:
+                self._changedIds.add(int(obj._objName.split('.')[0]))
+            except ValueError:
+                self._changedIds = None # we can not tell what changed
+        
+    def popChangedIds(self):
+        """ Return the ids of the top-level objects modified since the
+        last call. None is returned if other connection has committed
+        changes to the db, since then the modified objects are unknown.
+        """
+        changedIds = self._changedIds
+        dataVersion = self.db.getDataVersion()
+        if dataVersion != self._dataVersion:
+            changedIds = None
+        self._changedIds = set()
+        self._dataVersion = dataVersion
+        return changedIds
+    
+    def discardChangedIds(self, objIds):
+        """ Forget about the changes made to these top-level objects. """
+        if self._changedIds is not None:
+            self._changedIds.difference_update(objIds)
+        
+    def __insertChildsBatch(self, obj, namePrefix, rows, firstId):
+        for key, attr in obj.getAttributesToStore():
+            if not hasattr(attr, '_objDoStore'):
+                print "MAPPER: object '%s' doesn't seem to be an Object subclass," % attr
+                print "       it does not have attribute '_objDoStore'. Insert skipped."
+                continue
+            attr._objName = joinExt(namePrefix, key)
+            attr._objParentId = obj._objId
+            value = self.__getObjectValue(attr)
+            attr._objId = rows[-1][0] + 1 if rows else firstId
+            rows.append((attr._objId, attr._objParentId, attr._objName, attr.getClassName(),
+                         value, attr._objLabel, attr._objComment))
+            self.__insertChildsBatch(attr, joinExt(namePrefix, attr.strId()), rows, firstId)
         
     def insert(self, obj):
         """Insert a new object into the system, the id will be set"""
         self.__insert(obj)
+        self.__markChanged(obj)
         
     def insertChild(self, obj, key, attr, namePrefix=None):
         if not hasattr(attr, '_objDoStore'):
@@ -94,6 +147,7 @@ class SqliteMapper(Mapper):
         attr._objName = joinExt(namePrefix, key)
         attr._objParentId = obj._objId
         self.__insert(attr, namePrefix)
+        self.__markChanged(attr)
         
     def insertChilds(self, obj, namePrefix=None):
         """ Insert childs of an object, if namePrefix is None,
@@ -108,10 +162,12 @@ class SqliteMapper(Mapper):
     def deleteChilds(self, obj):
         namePrefix = self.__getNamePrefix(obj)
         self.db.deleteChildObjects(namePrefix)
+        self.__markChanged(obj)
         
     def deleteAll(self):
         """ Delete all objects stored """
         self.db.deleteAll()
+        self._changedIds = None
                 
     def delete(self, obj):
         """Delete an object and all its childs"""
@@ -132,6 +188,7 @@ class SqliteMapper(Mapper):
     def updateTo(self, obj, level=1):
         self.__initUpdateDict()
         self.__updateTo(obj, level)
+        self.__markChanged(obj)
         # Update pending pointers to objects
         for ptr in self.updatePendingPointers:
             self.db.updateObject(ptr._objId, ptr._objName, ptr.getClassName(),
@@ -199,13 +256,16 @@ class SqliteMapper(Mapper):
                 objValue = None
         obj.set(objValue)
         
-    def fillObject(self, obj, objRow):
+    def fillObject(self, obj, objRow, childRows=None):
+        """ Fill the object and all its childs. If childRows is None, the
+        rows of the childs will be read from the db. """
         self.fillObjectWithRow(obj, objRow)
-        namePrefix = self.__getNamePrefix(obj)
-        childs = self.db.selectObjectsByAncestor(namePrefix)
+        if childRows is None:
+            namePrefix = self.__getNamePrefix(obj)
+            childRows = self.db.selectObjectsByAncestor(namePrefix)
         #childsDict = {obj._objId: obj}
         
-        for childRow in childs:
+        for childRow in childRows:
             childParts = childRow['name'].split('.')
             childName = childParts[-1]
             parentId = int(childParts[-2])
@@ -225,18 +285,43 @@ class SqliteMapper(Mapper):
             self.fillObjectWithRow(childObj, childRow)  
             #childsDict[childObj._objId] = childObj  
               
-    def __objFromRow(self, objRow):
+    def __getRowNamePrefix(self, objRow):
+        """ Same as __getNamePrefix but from the row of an object. """
+        objName = self._getStrValue(objRow['name'])
+        objId = str(objRow['id'])
+        if objName and '.' in objName:
+            return replaceExt(objName, objId)
+        return objId
+        
+    def __selectChildRows(self, objRows):
+        """ Read in a single query the childs of all objects in objRows.
+        Return a dictionary with the list of child rows for each name prefix. """
+        prefixes = set(self.__getRowNamePrefix(objRow) for objRow in objRows)
+        childRowsDict = dict((prefix, []) for prefix in prefixes)
+        if prefixes:
+            for childRow in self.db.selectObjectsByAncestors(prefixes):
+                parts = childRow['name'].split('.')
+                # The child may belong to several of the selected objects
+                for i in range(1, len(parts)):
+                    prefix = '.'.join(parts[:i])
+                    if prefix in childRowsDict:
+                        childRowsDict[prefix].append(childRow)
+        return childRowsDict
+        
+    def __objFromRow(self, objRow, childRows=None):
         objClassName = objRow['classname']
         
         obj = self._buildObject(objClassName)
         if obj is not None:
-            self.fillObject(obj, objRow)
+            self.fillObject(obj, objRow, childRows)
         
         return obj
         
     def __iterObjectsFromRows(self, objRows, objectFilter=None):
+        objRows = list(objRows)
+        childRowsDict = self.__selectChildRows(objRows)
         for objRow in objRows:
-            obj = self.__objFromRow(objRow)
+            obj = self.__objFromRow(objRow, childRowsDict[self.__getRowNamePrefix(objRow)])
             if (obj is not None and 
                 objectFilter is None or objectFilter(obj)):
                 yield obj
@@ -359,7 +444,7 @@ class SqliteObjectsDb(SqliteDb):
     # Maintain the current version of the DB schema
     # useful for future updates and backward compatibility
     # version should be an integer number
-    VERSION = 1
+    VERSION = 2
     
     SELECT = "SELECT id, parent_id, name, classname, value, label, comment, datetime(creation, 'localtime') as creation FROM Objects WHERE "
     DELETE = "DELETE FROM Objects WHERE "
@@ -368,6 +453,8 @@ class SqliteObjectsDb(SqliteDb):
     SELECT_RELATION = "SELECT object_%s_id AS id FROM Relations WHERE name=? AND object_%s_id=?"
     SELECT_RELATIONS = "SELECT * FROM Relations WHERE "
     
+    MAX_ANCESTORS = 400 # Each ancestor takes two variables and one select of a query
+    
     
     def selectCmd(self, whereStr, orderByStr=' ORDER BY id'):
         return self.SELECT + whereStr + orderByStr
@@ -417,13 +504,24 @@ class SqliteObjectsDb(SqliteDb):
                       object_parent_extended TEXT DEFAULT NULL, -- extended property to consider internal objects
                       object_child_extended TEXT DEFAULT NULL
                       )""")
+        self.__createIndexes()
         self.commit()
         
+    def __createIndexes(self):
+        """ Indexes used to find the childs and the relations of an object """
+        self.executeCommand("CREATE INDEX IF NOT EXISTS Objects_parent_id ON Objects(parent_id)")
+        self.executeCommand("CREATE INDEX IF NOT EXISTS Objects_name ON Objects(name)")
+        self.executeCommand("CREATE INDEX IF NOT EXISTS Objects_classname ON Objects(classname)")
+        self.executeCommand("CREATE INDEX IF NOT EXISTS Relations_parent_id ON Relations(parent_id)")
+        self.executeCommand("CREATE INDEX IF NOT EXISTS Relations_name_parent ON Relations(name, object_parent_id)")
+        self.executeCommand("CREATE INDEX IF NOT EXISTS Relations_name_child ON Relations(name, object_child_id)")
+        
     def __updateTables(self):
         """ This method is intended to update the table schema
         in the case of dealing with old database version.
         """
-        if self.getVersion() < self.VERSION: # This applies for version 1
+        version = self.getVersion()
+        if version < 1:
             # Add the extra column for pointer extended attribute in Relations table
             # from version 1 on, there is not needed since the table will 
             # already contains this column
@@ -434,6 +532,9 @@ class SqliteObjectsDb(SqliteDb):
             if not 'object_child_extended' in columns:    
                 self.executeCommand("ALTER TABLE Relations "
                                     "ADD COLUMN object_child_extended  TEXT DEFAULT NULL")
+        if version < 2:
+            self.__createIndexes()
+        if version < self.VERSION:
             self.setVersion(self.VERSION)
         
         
@@ -459,6 +560,21 @@ class SqliteObjectsDb(SqliteDb):
                              object_parent_extended, object_child_extended))
         return self.cursor.lastrowid
     
+    def getDataVersion(self):
+        """ Return a number that changes when other connections
+        commit changes to the db. """
+        self.executeCommand("PRAGMA data_version")
+        return self.cursor.fetchone()[0]
+        
+    def insertObjects(self, rows):
+        """ Insert several objects at once. Each row is:
+        (id, parent_id, name, classname, value, label, comment) """
+        if rows:
+            self.executeCommand("SELECT datetime('now')")
+            creation = self.cursor.fetchone()[0]
+            self.executeMany("INSERT INTO Objects (id, parent_id, name, classname, value, label, comment, creation) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                             [row + (creation,) for row in rows])
+    
     def updateObject(self, objId, name, classname, value, parent_id, label, comment):
         """Update object data """
         self.executeCommand("UPDATE Objects SET parent_id=?, name=?, classname=?, value=?, label=?, comment=? WHERE id=?",
@@ -479,11 +595,39 @@ class SqliteObjectsDb(SqliteDb):
             self.executeCommand(self.selectCmd("parent_id=?"), (parent_id,))
         return self._results(iterate)  
     
+    def __ancestorWhere(self, ancestor_namePrefix):
+        """ Condition equivalent to name LIKE 'prefix.%' that can use the
+        index on name ('/' is the character after '.') """
+        return "(name>=? AND name<?)", (ancestor_namePrefix + '.', ancestor_namePrefix + '/')
+    
     def selectObjectsByAncestor(self, ancestor_namePrefix, iterate=False):
         """Select all objects in the hierarchy of ancestor_id"""
-        self.executeCommand(self.selectCmd("name LIKE '%s.%%'" % ancestor_namePrefix))
+        whereStr, whereTuple = self.__ancestorWhere(ancestor_namePrefix)
+        self.executeCommand(self.selectCmd(whereStr), whereTuple)
         return self._results(iterate)          
     
+    def selectObjectsByAncestors(self, ancestor_namePrefixes):
+        """ Select all objects in the hierarchy of several ancestors, 
+        sorted by id """
+        ancestor_namePrefixes = list(ancestor_namePrefixes)
+        rows = []
+        # Each ancestor is a range query over the name index, they are joined
+        # with UNION ALL since sqlite does not use the index for OR of ranges.
+        # Queries are split to keep below the sqlite limits of variables and
+        # compound selects.
+        for i in range(0, len(ancestor_namePrefixes), self.MAX_ANCESTORS):
+            selectList = []
+            whereTuple = ()
+            for prefix in ancestor_namePrefixes[i:i+self.MAX_ANCESTORS]:
+                whereStr, prefixTuple = self.__ancestorWhere(prefix)
+                selectList.append(self.SELECT + whereStr)
+                whereTuple += prefixTuple
+            self.executeCommand(' UNION ALL '.join(selectList) + ' ORDER BY id', whereTuple)
+            rows += self._results()
+        if len(ancestor_namePrefixes) > self.MAX_ANCESTORS:
+            rows.sort(key=lambda row: row['id'])
+        return rows
+    
     def selectObjectsBy(self, iterate=False, **args):     
         """More flexible select where the constrains can be passed
         as a dictionary, the concatenation is done by an AND"""
@@ -504,7 +648,8 @@ class SqliteObjectsDb(SqliteDb):
     def deleteChildObjects(self, ancestor_namePrefix):
         """ Delete from db all objects that are childs 
         of an ancestor, now them will have the same starting prefix"""
-        self.executeCommand(self.DELETE + "name LIKE '%s.%%'" % ancestor_namePrefix)
+        whereStr, whereTuple = self.__ancestorWhere(ancestor_namePrefix)
+        self.executeCommand(self.DELETE + whereStr, whereTuple)
         
     def deleteAll(self):
         """ Delete all objects from the db. """
@@ -535,9 +680,13 @@ class SqliteObjectsDb(SqliteDb):
 
 class SqliteFlatMapper(Mapper):
     """Specific Flat Mapper implementation using Sqlite database"""
+    # Number of inserts sent together to the db
+    INSERT_BATCH_SIZE = 1000
+    
     def __init__(self, dbName, dictClasses=None, tablePrefix=''):
         Mapper.__init__(self, dictClasses)
         self._objTemplate = None
+        self._insertRows = [] # Inserts not yet sent to the db
         try:
             self.db = SqliteFlatDb(dbName, tablePrefix)
             self.doCreateTables = self.db.missingTables()
@@ -548,43 +697,60 @@ class SqliteFlatMapper(Mapper):
             raise Exception('Error creating SqliteFlatMapper, dbName: %s, tablePrefix: %s\n error: %s' % (dbName, tablePrefix, ex))
     
     def commit(self):
+        self.flush()
         self.db.commit()
         
     def close(self):
+        self.flush()
         self.db.close()
         
+    def flush(self):
+        """ Send to the db the pending inserts. This is done before any 
+        other access to the db, so it is only needed when the db is 
+        read from a different connection. """
+        if self._insertRows:
+            self.db.insertObjects(self._insertRows)
+            self._insertRows = []
+        
     def insert(self, obj):
         if self.doCreateTables:
             self.db.createTables(obj.getObjDict(includeClass=True))
             self.doCreateTables = False
         """Insert a new object into the system, the id will be set"""
-        self.db.insertObject(obj.getObjId(), obj.isEnabled(), obj.getObjLabel(), obj.getObjComment(), 
-                             *obj.getObjDict().values())
+        self._insertRows.append((obj.getObjId(), obj.isEnabled(), obj.getObjLabel(), obj.getObjComment()) 
+                                + tuple(obj.getObjDict().values()))
+        if len(self._insertRows) >= self.INSERT_BATCH_SIZE:
+            self.flush()
         
     def enableAppend(self):
         """ This will allow to append items to existing db. 
         This is by default not allow, since most sets are not 
         modified after creation.
         """
+        self.flush()
         if not self.doCreateTables:
             obj = self.selectFirst()
             if obj is not None:
                 self.db.setupCommands(obj.getObjDict(includeClass=True))
         
     def clear(self):
+        self._insertRows = []
         self.db.clear()
         self.doCreateTables = True
     
     def deleteAll(self):
         """ Delete all objects stored """
+        self.flush()
         self.db.deleteAll()
                 
     def delete(self, obj):
         """Delete an object and all its childs"""
+        self.flush()
         self.db.deleteObject(obj.getObjId())
     
     def updateTo(self, obj, level=1):
         """ Update database entry with new object values. """ 
+        self.flush()
         if self.db.INSERT_OBJECT is None:
             self.db.setupCommands(obj.getObjDict(includeClass=True))
         args = list(obj.getObjDict().values())
@@ -593,6 +759,7 @@ class SqliteFlatMapper(Mapper):
             
     def selectById(self, objId):
         """Build the object which id is objId"""
+        self.flush()
         objRow = self.db.selectObjectById(objId)
         if objRow is None:
             obj = None
@@ -692,6 +859,7 @@ class SqliteFlatMapper(Mapper):
          
     def selectBy(self, iterate=False, objectFilter=None, **args):
         """Select object meetings some criteria"""
+        self.flush()
         objRows = self.db.selectObjectsBy(**args)
         return self.__objectsFromRows(objRows, iterate, objectFilter)
     
@@ -700,6 +868,7 @@ class SqliteFlatMapper(Mapper):
                       , orderBy='id'
                       , direction='ASC'
                       , where='1'):
+        self.flush()
         # Just a sanity check for emtpy sets, that doesn't contains 'Properties' table
         if not self.db.hasTable('Properties'):
             return iter([]) if iterate else []
@@ -713,6 +882,7 @@ class SqliteFlatMapper(Mapper):
         return self.__objectsFromRows(objRows, iterate, objectFilter) 
 
     def aggregate(self, operations, operationLabel, groupByLabels=None):
+        self.flush()
         rows = self.db.aggregate(operations, operationLabel, groupByLabels)
         results = []
         for row in rows:
@@ -728,6 +898,7 @@ class SqliteFlatMapper(Mapper):
         #convert row to dictionary
 
     def count(self):
+        self.flush()
         if self.doCreateTables:
             return 0
         return self.db.count()   
@@ -946,6 +1117,11 @@ class SqliteFlatDb(SqliteDb):
         """
         self.executeCommand(self.INSERT_OBJECT, args)
 
+    def insertObjects(self, rows):
+        """ Insert several objects at once, each row contains the same
+        values as the arguments of insertObject. """
+        self.executeMany(self.INSERT_OBJECT, rows)
+
     def updateObject(self, *args):
         """Update object data """
         self.executeCommand(self.UPDATE_OBJECT, args)
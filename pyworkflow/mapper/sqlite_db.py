@@ -27,6 +27,7 @@
 This module contains some sqlite basic tools to handle Databases.
 """
 
+import os
 from sqlite3 import dbapi2 as sqlite
 
 from pyworkflow.utils import envVarOn
@@ -37,6 +38,9 @@ class SqliteDb():
     It will create connection, execute queries and commands.
     """
     OPEN_CONNECTIONS = {} # Store all conections made
+    # Optional pragmas for new connections, e.g. WAL and NORMAL
+    JOURNAL_MODE = os.environ.get('SCIPION_SQLITE_JOURNAL_MODE', None)
+    SYNCHRONOUS = os.environ.get('SCIPION_SQLITE_SYNCHRONOUS', None)
     
     def __init__(self):
         self._reuseConnections = False
@@ -50,13 +54,19 @@ class SqliteDb():
             self.connection = sqlite.Connection(dbName, timeout, check_same_thread=False)
             self.connection.row_factory = sqlite.Row
             self.OPEN_CONNECTIONS[dbName] = self.connection
+            if self.JOURNAL_MODE:
+                self.connection.execute('PRAGMA journal_mode=%s' % self.JOURNAL_MODE)
+            if self.SYNCHRONOUS:
+                self.connection.execute('PRAGMA synchronous=%s' % self.SYNCHRONOUS)
             
         self.cursor = self.connection.cursor()
         # Define some shortcuts functions
         if envVarOn('SCIPION_DEBUG_SQLITE'):
             self.executeCommand = self._debugExecute
+            self.executeMany = self._debugExecuteMany
         else:
             self.executeCommand = self.cursor.execute
+            self.executeMany = self.cursor.executemany
         self.commit = self.connection.commit
         
     @classmethod
@@ -83,6 +93,13 @@ class SqliteDb():
             print "ARGUMENTS: ", args[1:]
             raise ex
             
+    def _debugExecuteMany(self, command, rows):
+        try:
+            return self.cursor.executemany(command, rows)
+        except Exception, ex:
+            print ">>>> FAILED cursor.executemany on db: '%s'" % self._dbName
+            print "COMMAND: ", command
+            raise ex
         
         #return self.cursor.fetchone()
     
@@ -41,6 +41,7 @@ import pyworkflow.protocol as pwprot
 import pyworkflow.object as pwobj
 import pyworkflow.utils as pwutils
 from pyworkflow.mapper import SqliteMapper
+from pyworkflow.utils.reflection import getSubclasses
 from pyworkflow.protocol.constants import MODE_RESTART
 
 PROJECT_DBNAME = 'project.sqlite'
@@ -79,6 +80,10 @@ class Project(object):
         self.configPath = self.__addPath(PROJECT_CONFIG)
         self.runs = None
         self._runsGraph = None
+        self._runsGraphInfo = {} # Outputs and inputs ids of each run
+        self._runsGraphOutputs = {} # Node of the run that produces each output (and of each run)
+        self._runsGraphChanged = set() # Ids of the runs changed since the graph was built
+        self._runsDbStamp = {} # Run db stamp of the last update of each run
         self._transformGraph = None
         self._sourceGraph = None
         self.address = ''
@@ -163,9 +168,9 @@ class Project(object):
         all globas and update with data and protocols from em.
         """
         #TODO: REMOVE THE USE OF globals() here
-        classesDict = dict(pwobj.__dict__)
-        classesDict.update(em.getProtocols())
-        classesDict.update(em.getObjects())
+        classesDict = em.ClassesDict(pwobj.__dict__)
+        classesDict.update(getSubclasses(em.Protocol, em.__dict__))
+        classesDict.update(getSubclasses(em.EMObject, em.__dict__))
         return SqliteMapper(sqliteFn, classesDict)
     
     def load(self, dbPath=None, hostsConf=None, protocolsConf=None, chdir=True, 
@@ -363,8 +368,24 @@ class Project(object):
             self.mapper.store(protocol)
         self.mapper.commit()
         
+    def _getRunDbStamp(self, protocol):
+        """ Return the modification time and size of the run db
+        (and of its WAL file, if any) to detect changes on it.
+        """
+        stamp = []
+        dbPath = os.path.join(self.path, protocol.getDbPath())
+        for fn in [dbPath, dbPath + '-wal']:
+            if os.path.exists(fn):
+                st = os.stat(fn)
+                stamp.append((st.st_mtime, st.st_size))
+        return tuple(stamp)
+    
     def _updateProtocol(self, protocol, tries=0):
         if not self.isReadOnly():
+            # Nothing to read if the run db has not changed since the last update
+            dbStamp = self._getRunDbStamp(protocol)
+            if dbStamp and self._runsDbStamp.get(protocol.getDbPath()) == dbStamp:
+                return
             try:
                 # Backup the values of 'jobId', 'label' and 'comment'
                 # to be restored after the .copy
@@ -388,6 +409,8 @@ class Project(object):
                 protocol.setObjComment(comment)
                 
                 self.mapper.store(protocol)
+                self._runsDbStamp[protocol.getDbPath()] = dbStamp
+                self._runsGraphChanged.add(protocol.getObjId())
                 
                 # Close DB connections
                 prot2.getProject().closeMapper()
@@ -795,6 +818,8 @@ class Project(object):
             
     def getRuns(self, iterate=False, refresh=True):
         """ Return the existing protocol runs in the project. 
+        When refreshing, only the runs modified in the db since the
+        last load are read again.
         """
         if self.runs is None or refresh:
             # Close db open connections to db files
@@ -802,9 +827,14 @@ class Project(object):
                 for r in self.runs:
                     r.closeMappers()
             
-            self.runs = self.mapper.selectByClass("Protocol", iterate=False)
+            changedIds = self.mapper.popChangedIds()
+            if self.runs is None or changedIds is None:
+                self.__loadRuns()
+            elif changedIds:
+                self.__reloadRuns(changedIds)
+            
+            updatedIds = []
             for r in self.runs:
-                self._setProtocolMapper(r)
                 # Update nodes that are running and are not invoked by other protocols
                 if r.isActive():
                     if not r.isChild():
@@ -812,10 +842,37 @@ class Project(object):
                         #                                                                   r.getStatus()))
                         
                         self._updateProtocol(r)
+                        updatedIds.append(r.getObjId())
             self.mapper.commit()
+            # The updated runs are already stored as they are in memory
+            self.mapper.discardChangedIds(updatedIds)
         
         return self.runs
     
+    def __loadRuns(self):
+        """ Read all runs from the db. """
+        self.runs = self.mapper.selectByClass("Protocol", iterate=False)
+        for r in self.runs:
+            self._setProtocolMapper(r)
+        self._runsGraphInfo = {}
+        self._runsGraphChanged = set()
+        self._runsGraph = None
+        
+    def __reloadRuns(self, changedIds):
+        """ Read again from the db only the runs with these ids,
+        runs that do not exist anymore are removed. """
+        runsDict = dict((r.getObjId(), r) for r in self.runs)
+        
+        for objId in changedIds:
+            runsDict.pop(objId, None)
+            for obj in self.mapper.selectBy(id=objId):
+                if isinstance(obj, pwprot.Protocol):
+                    self._setProtocolMapper(obj)
+                    runsDict[objId] = obj
+            self._runsGraphChanged.add(objId)
+            
+        self.runs = [runsDict[objId] for objId in sorted(runsDict)]
+    
     def iterSubclasses(self, classesName, objectFilter=None):
         """ Retrieve all objects from the project that are instances
             of any of the classes in classesName list.
@@ -826,47 +883,134 @@ class Project(object):
             for obj in self.mapper.selectByClass(objClass.strip(), iterate=True, objectFilter=objectFilter):
                 yield obj
     
+    def __getRunGraphInfo(self, run):
+        """ Return the ids of the outputs of a run and the ids of the
+        objects pointed by its inputs (together with their parent ids).
+        They are kept until the run changes.
+        """
+        runId = run.getObjId()
+        if runId not in self._runsGraphInfo:
+            outputIds = [attr.getObjId() for _, attr in run.iterOutputAttributes(em.EMObject)]
+            inputIds = []
+            for _, attr in run.iterInputAttributes():
+                if attr.hasValue():
+                    pointed = attr.getObjValue()
+                    if pointed is not None:
+                        inputIds.append((pointed.getObjId(), pointed._objParentId))
+            self._runsGraphInfo[runId] = (outputIds, inputIds)
+            
+        return self._runsGraphInfo[runId]
+    
+    def __linkRunNode(self, node, inputIds):
+        """ Add the edges from the runs that produce the inputs of a run
+        to its node, or from the root if there is none of them.
+        """
+        outputDict = self._runsGraphOutputs
+        
+        def _checkInputId(pointedId):
+            """ Check if an object id is registered as output"""
+            if pointedId is not None:
+                if pointedId in outputDict:
+                    parentNode = outputDict[pointedId]
+                    if parentNode is node:
+                        print "WARNING: Found a cyclic dependence from node %s to itself, problably a bug. " % pointedId
+                    else:
+                        parentNode.addChild(node)
+                        return True
+            return False
+        
+        # Only checking pointed object and its parent, if more levels
+        # we need to go up to get the correct dependencies
+        for pointedId, parentId in inputIds:
+            if not _checkInputId(pointedId):
+                _checkInputId(parentId)
+        
+    def __updateRunsGraph(self, runs):
+        """ Update in the runs graph the nodes of the runs changed since
+        it was built. Only the edges of the runs whose inputs or outputs
+        have changed are linked again. Return False if the graph has to be
+        built again because runs have been created or deleted.
+        """
+        g = self._runsGraph
+        rootNode = g.getRoot()
+        runsDict = dict((r.getObjId(), r) for r in runs)
+        if set(runsDict) != set(n.run.getObjId() for n in g.getNodes() if n is not rootNode):
+            return False
+        
+        changedIds = self._runsGraphChanged
+        self._runsGraphChanged = set()
+        relinkIds = set()
+        for runId in changedIds:
+            if runId not in runsDict:
+                continue # not in the graph (e.g. a child run)
+            r = runsDict[runId]
+            node = g.getNode(r.strId())
+            node.run = r
+            node.setLabel(r.getRunName())
+            oldOutputIds, oldInputIds = self._runsGraphInfo.pop(runId, ([], []))
+            outputIds, inputIds = self.__getRunGraphInfo(r)
+            if inputIds != oldInputIds:
+                relinkIds.add(runId)
+            if outputIds != oldOutputIds:
+                for outputId in oldOutputIds:
+                    if self._runsGraphOutputs.get(outputId) is node:
+                        del self._runsGraphOutputs[outputId]
+                for outputId in outputIds:
+                    self._runsGraphOutputs[outputId] = node
+                # The runs that use these outputs may have other parents now
+                changedOutputIds = set(oldOutputIds) ^ set(outputIds)
+                for otherId, otherRun in runsDict.iteritems():
+                    for pointedId, parentId in self.__getRunGraphInfo(otherRun)[1]:
+                        if pointedId in changedOutputIds or parentId in changedOutputIds:
+                            relinkIds.add(otherId)
+                            break
+        
+        if relinkIds:
+            relinkIds = sorted(relinkIds)
+            relinkNodes = [g.getNode(runsDict[runId].strId()) for runId in relinkIds]
+            for node in relinkNodes:
+                for parentNode in list(node.getParents()):
+                    parentNode.removeChild(node)
+            for runId, node in zip(relinkIds, relinkNodes):
+                self.__linkRunNode(node, self.__getRunGraphInfo(runsDict[runId])[1])
+            for node in relinkNodes:
+                if node.isRoot():
+                    rootNode.addChild(node)
+            # Keep the childs in the order of the runs, as when the graph is built
+            nodeIndex = dict((n, i) for i, n in enumerate(g.getNodes()))
+            for node in [rootNode] + g.getNodes():
+                node.getChilds().sort(key=nodeIndex.get)
+        return True
+    
     def getRunsGraph(self, refresh=True):
         """ Build a graph taking into account the dependencies between
         different runs, ie. which outputs serves as inputs of other protocols. 
+        After it is built, only the nodes of the runs that change are updated.
         """
-        if refresh or self._runsGraph is None:
-            outputDict = {} # Store the output dict
+        if refresh or self._runsGraph is None or self._runsGraphChanged:
             runs = [r for r in self.getRuns(refresh=refresh) if not r.isChild()]
+        
+        if self._runsGraph is not None and self._runsGraphChanged:
+            if not self.__updateRunsGraph(runs):
+                self._runsGraph = None
+        
+        if self._runsGraph is None:
+            for runId in self._runsGraphChanged:
+                self._runsGraphInfo.pop(runId, None)
+            self._runsGraphChanged = set()
+            self._runsGraphOutputs = {}
             g = pwutils.graph.Graph(rootName='PROJECT')
             
             for r in runs:
                 n = g.createNode(r.strId())
                 n.run = r
                 n.setLabel(r.getRunName())
-                outputDict[r.getObjId()] = n
-                for _, attr in r.iterOutputAttributes(em.EMObject):
-                    outputDict[attr.getObjId()] = n # mark this output as produced by r
-                
-            def _checkInputAttr(node, pointed):
-                """ Check if an attr is registered as output"""
-                if pointed is not None:
-                    pointedId = pointed.getObjId()
-                    
-                    if pointedId in outputDict:
-                        parentNode = outputDict[pointedId]
-                        if parentNode is node:
-                            print "WARNING: Found a cyclic dependence from node %s to itself, problably a bug. " % pointedId
-                        else:
-                            parentNode.addChild(node)
-                            return True
-                return False
+                self._runsGraphOutputs[r.getObjId()] = n
+                for outputId in self.__getRunGraphInfo(r)[0]:
+                    self._runsGraphOutputs[outputId] = n # mark this output as produced by r
                 
             for r in runs:
-                node = g.getNode(r.strId())
-                for _, attr in r.iterInputAttributes():
-                    if attr.hasValue():
-                        pointed = attr.getObjValue()
-                        # Only checking pointed object and its parent, if more levels
-                        # we need to go up to get the correct dependencies
-                        if not _checkInputAttr(node, pointed):
-                            parent = self.mapper.getParent(pointed)
-                            _checkInputAttr(node, parent)
+                self.__linkRunNode(g.getNode(r.strId()), self.__getRunGraphInfo(r)[1])
             rootNode = g.getRoot()
             rootNode.run = None
             rootNode.label = "PROJECT"
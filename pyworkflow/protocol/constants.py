@@ -55,6 +55,7 @@ MODE_CHOICES = ('Continue', 'Restart')#, 'Continue')
 # Steps execution mode
 STEPS_SERIAL = 0      # Execute steps serially, some of the steps can be mpi programs
 STEPS_PARALLEL = 1    # Execute steps in parallel, through threads or mpi
+STEPS_PROCESSES = 2   # Execute steps in parallel, worker steps in separate processes
 
 
 # Level of expertise for the input parameters, mainly used in the protocol form
@@ -27,13 +27,17 @@
 This module have the classes for execution of protocol steps.
 The basic one will run steps, one by one, after completion.
 There is one based on threads to execute steps in parallel
-using different threads and the last one with MPI processes.
+using different threads, one with MPI processes and the last
+one running function steps in worker processes.
 """
 
 import time
 import datetime
 import traceback
 import threading
+import multiprocessing
+from collections import deque
+from Queue import Empty
 
 import pyworkflow.utils.process as process
 import constants as cts
@@ -186,3 +190,128 @@ class MPIStepExecutor(ThreadStepExecutor):
         # that there are no more jobs to do and they can finish.
         for node in range(1, self.numberOfProcs+1):
             self.comm.send('None', dest=node, tag=(TAG_RUN_JOB+node))
+
+
+def runStepInWorker(step, resultQueue):
+    """ Run a step in a worker process and send its final status
+    to the parent through resultQueue. The step database is only
+    written by the parent.
+    """
+    error = None
+    try:
+        step._run()
+    except Exception as e:
+        error = str(e)
+        traceback.print_exc()
+    resultQueue.put((step._index, error, step._resultFiles.get(),
+                     datetime.datetime.now()))
+
+
+class ProcessStepExecutor(StepExecutor):
+    """ Run steps in parallel using worker processes, so that CPU bound
+    python steps are not serialized by the GIL. Only steps inserted with
+    worker=True are sent to the workers; the rest (e.g. steps storing
+    outputs in the database) run in this process. Each worker is forked
+    when its step is ready, so it sees the results of previous steps.
+    """
+    def __init__(self, hostConfig, nProcs):
+        StepExecutor.__init__(self, hostConfig)
+        self.numberOfProcs = nProcs
+
+    def runSteps(self, steps, stepStartedCallback, stepFinishedCallback):
+        """ Keep a queue of the steps whose prerequisites are finished
+        and wait for the workers to report the end of their steps.
+        """
+        resultQueue = multiprocessing.Queue()
+        runningSteps = {}  # worker process of each running step ({index: process})
+
+        # Number of unfinished prerequisites and dependent steps of each step
+        pending = {}
+        dependents = dict((s._index, []) for s in steps)
+        for s in steps:
+            pending[s._index] = 0
+            for i in s._prerequisites:
+                dependents[i].append(s._index)
+                if not steps[i-1].isFinished():
+                    pending[s._index] += 1
+        ready = deque(s for s in steps
+                      if s.getStatus() == cts.STATUS_NEW and pending[s._index] == 0)
+
+        def stepDone(step):
+            """ Call the final callback and queue the steps waiting for this one. """
+            doContinue = stepFinishedCallback(step)
+            if step.isFinished():
+                for i in dependents[step._index]:
+                    pending[i] -= 1
+                    if pending[i] == 0 and steps[i-1].getStatus() == cts.STATUS_NEW:
+                        ready.append(steps[i-1])
+            return doContinue
+
+        def setResult(result):
+            """ Update a step with the result sent by its worker. """
+            index, error, resultFiles, endTime = result
+            runningSteps.pop(index).join()
+            step = steps[index-1]
+            step._resultFiles.set(resultFiles)
+            if error is None:
+                step.setStatus(cts.STATUS_INTERACTIVE if step.isInteractive()
+                               else cts.STATUS_FINISHED)
+            else:
+                step.setFailed(error)
+            step.endTime.set(endTime)
+            return step
+
+        def waitStep():
+            """ Wait for the result of a worker. Return the step that has
+            finished or None if no step finished in a few seconds.
+            """
+            try:
+                return setResult(resultQueue.get(timeout=5))
+            except Empty:
+                pass
+            # Check that no worker died without reporting (whatever its exit
+            # code, e.g. sys.exit(0) inside the step)
+            for index, p in runningSteps.items():
+                if not p.is_alive():
+                    try:
+                        # The result may have arrived just before exiting
+                        return setResult(resultQueue.get(timeout=1))
+                    except Empty:
+                        pass
+                    runningSteps.pop(index)
+                    step = steps[index-1]
+                    step.setFailed("Worker process exited with code %s without "
+                                   "reporting the end of the step" % p.exitcode)
+                    return step
+            return None
+
+        doContinue = True
+        while doContinue:
+            # Start all the ready steps while there are free workers
+            while doContinue and ready and len(runningSteps) < self.numberOfProcs:
+                step = ready.popleft()
+                step.setRunning()
+                stepStartedCallback(step)
+                if getattr(step, '_worker', False):
+                    p = multiprocessing.Process(target=runStepInWorker,
+                                                args=(step, resultQueue))
+                    p.daemon = True
+                    p.start()
+                    runningSteps[step._index] = p
+                else:
+                    step.run()
+                    doContinue = stepDone(step)
+
+            if not doContinue or not runningSteps:
+                break  # failed, or nothing else can be run
+
+            step = waitStep()
+            if step is not None:
+                doContinue = stepDone(step)
+
+        # Wait for the steps still running in the workers
+        while runningSteps:
+            step = waitStep()
+            if step is not None:
+                stepFinishedCallback(step)
+
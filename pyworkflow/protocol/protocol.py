@@ -41,7 +41,7 @@ from pyworkflow.utils import redStr, greenStr, magentaStr, envVarOn, runJob
 from pyworkflow.utils.path import (makePath, join, missingPaths, cleanPath, cleanPattern,
                                    getFiles, exists, renderTextFile, copyFile)
 from pyworkflow.utils.log import ScipionLogger
-from executor import StepExecutor, ThreadStepExecutor, MPIStepExecutor
+from executor import StepExecutor, ThreadStepExecutor, MPIStepExecutor, ProcessStepExecutor
 from constants import *
 from params import Form
 import scipion
@@ -194,10 +194,13 @@ class FunctionStep(Step):
             funcName: the name assigned to that function (will be stored)
             *funcArgs: argument list passed to the function (serialized and stored)
             **kwargs: extra parameters.
+                worker: run in a worker process with ProcessStepExecutor,
+                        the function should not write to the database.
         """ 
         Step.__init__(self)
         self._func = func # Function should be set before run
         self._args = funcArgs
+        self._worker = kwargs.get('worker', False)
         self.funcName = String(funcName)
         self.argsStr = String(pickle.dumps(funcArgs))
         self.setInteractive(kwargs.get('interactive', False))
@@ -800,7 +803,7 @@ class Protocol(Step):
                   (step.funcName.get(), step._index))
         self.info("  %s" % dt.datetime.strptime(step.endTime.get(),
                                                 "%Y-%m-%d %H:%M:%S.%f"))
-        if step.isFailed() and self.stepsExecutionMode == STEPS_PARALLEL:
+        if step.isFailed() and self.stepsExecutionMode in [STEPS_PARALLEL, STEPS_PROCESSES]:
             # In parallel mode the executor will exit to close
             # all working threads, so we need to close
             self._endRun()
@@ -1550,6 +1553,10 @@ def runProtocolMain(projectPath, protDbPath, protId):
         elif protocol.numberOfThreads > 1:
             executor = ThreadStepExecutor(hostConfig,
                                           protocol.numberOfThreads.get()-1) 
+    elif protocol.stepsExecutionMode == STEPS_PROCESSES:
+        if protocol.numberOfThreads > 1:
+            executor = ProcessStepExecutor(hostConfig,
+                                           protocol.numberOfThreads.get())
     if executor is None:
         executor = StepExecutor(hostConfig)
     protocol.setStepsExecutor(executor)
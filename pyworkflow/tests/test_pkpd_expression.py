@@ -0,0 +1,70 @@
+# **************************************************************************
+# *
+# * Authors:     Carlos Oscar Sorzano (info@kinestat.com)
+# *
+# * Kinestat Pharma
+# *
+# * This program is free software; you can redistribute it and/or modify
+# * it under the terms of the GNU General Public License as published by
+# * the Free Software Foundation; either version 2 of the License, or
+# * (at your option) any later version.
+# *
+# * This program is distributed in the hope that it will be useful,
+# * but WITHOUT ANY WARRANTY; without even the implied warranty of
+# * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# * GNU General Public License for more details.
+# *
+# * You should have received a copy of the GNU General Public License
+# * along with this program; if not, write to the Free Software
+# * Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA
+# * 02111-1307  USA
+# *
+# *  All comments concerning this program package may be sent to the
+# *  e-mail address 'jmdelarosa@cnb.csic.es'
+# *
+
+
+
+import numpy as np
+from pyworkflow.tests import *
+from pyworkflow.em.data import PKPDExpression
+
+
+class TestPKPDExpression(BaseTest):
+    """ The expressions evaluated for all samples at once must give the same as evaluated sample by sample """
+    weight = np.array([60.0, 70.0, 85.0, 0.0])
+    sex = np.array(['M', 'F', 'M', 'F'], dtype=object)
+
+    def checkExpression(self, expression):
+        compiledExpression = PKPDExpression(expression)
+        columns = [self.weight if varName=="w" else self.sex for varName in compiledExpression.variables]
+        N = len(self.weight)
+        values = compiledExpression.evaluateColumns(columns, N).tolist()
+        for n in range(N):
+            value = compiledExpression.evaluate([column[n] for column in columns])
+            self.assertEqual(values[n], value, "%s for sample %d: %s != %s"%(expression,n,values[n],value))
+            # A boolean where a value is expected (or viceversa) would compare equal for 0 and 1
+            self.assertEqual(isinstance(values[n],(bool,np.bool_)), isinstance(value,(bool,np.bool_)),
+                             "%s for sample %d: %s != %s"%(expression,n,type(values[n]),type(value)))
+        return compiledExpression
+
+    def testComparisons(self):
+        for expression in ["$(w)>70", "$(w)>70 and $(sex)=='M'", "not $(w)>70 or $(sex)=='F'", "60<$(w)<80",
+                           "($(w)>=70 or $(w)==0) and not $(sex)=='M'"]:
+            # These are vectorized
+            self.assertTrue(self.checkExpression(expression).vectorCode is not None, expression)
+
+    def testArithmetic(self):
+        for expression in ["$(w)*60/1000", "$(w)*2 if $(w)>70 else 1.0", "2.0"]:
+            self.checkExpression(expression)
+
+    def testBoolOpValues(self):
+        # and/or return one of their operands, not a boolean
+        for expression in ["$(w)>70 and 1 or 0", "$(w) or 5.0", "$(sex)=='M' and $(w)", "$(w)>70 and $(sex)"]:
+            self.checkExpression(expression)
+
+    def testNonFinite(self):
+        # Evaluated sample by sample a division by zero raises instead of giving inf
+        compiledExpression = PKPDExpression("1/$(w)")
+        self.assertRaises(ZeroDivisionError, compiledExpression.evaluateColumns, [self.weight], len(self.weight))
+        self.checkExpression("1/($(w)+1)")
@@ -29,8 +29,8 @@ from pyworkflow.em import *
 from tests import *
 from pyworkflow.mapper import SqliteMapper
 from pyworkflow.utils import dateStr
-from pyworkflow.protocol.constants import MODE_RESUME, STATUS_FINISHED
-from pyworkflow.protocol.executor import StepExecutor
+from pyworkflow.protocol.constants import MODE_RESUME, STATUS_FINISHED, STATUS_FAILED
+from pyworkflow.protocol.executor import StepExecutor, ProcessStepExecutor
 
     
 #Protocol for tests, runs in resume mode, and sleeps for??
@@ -66,6 +66,38 @@ class MyParallelProtocol(MyProtocol):
             self._insertFunctionStep('sleepStep')
     
             
+class MyProcessesProtocol(MyProtocol):
+    def _insertAllSteps(self):
+        step1 = self._insertFunctionStep('sleepStep', 1, '1', worker=True)
+        deps = [self._insertFunctionStep('sleepStep', i, str(i), worker=True,
+                                         prerequisites=[step1])
+                for i in range(2, 5)]
+        self._insertFunctionStep('sleepStep', 5, '5', prerequisites=deps)
+
+
+class MyDyingWorkerProtocol(MyProtocol):
+    def failStep(self):
+        raise Exception("Failed step")
+
+    def exitStep(self):
+        import time, os
+        time.sleep(1)
+        os._exit(1)
+
+    def _insertAllSteps(self):
+        self._insertFunctionStep('failStep', worker=True, prerequisites=[])
+        self._insertFunctionStep('exitStep', worker=True, prerequisites=[])
+
+
+class MyExitingWorkerProtocol(MyProtocol):
+    def exitStep(self):
+        import sys
+        sys.exit(0)
+
+    def _insertAllSteps(self):
+        self._insertFunctionStep('exitStep', worker=True)
+
+
 # TODO: this test seems not to be finished.
 class TestProtocolExecution(BaseTest):
     
@@ -87,3 +119,42 @@ class TestProtocolExecution(BaseTest):
         prot2 = mapper2.selectById(prot.getObjId())
         
         self.assertEqual(prot.endTime.get(), prot2.endTime.get())
+
+    def test_ProcessStepExecutor(self):
+        fn = self.getOutputPath("protocol_processes.sqlite")
+        mapper = SqliteMapper(fn, globals())
+        prot = MyProcessesProtocol(mapper=mapper, workingDir=self.getOutputPath(''))
+        prot._stepsExecutor = ProcessStepExecutor(hostConfig=None, nProcs=3)
+        prot.run()
+
+        for step in prot._steps:
+            self.assertEqual(step.getStatus(), STATUS_FINISHED)
+        # Steps 2, 3 and 4 run at the same time after step 1
+        self.assertTrue(prot._steps[3].initTime.get() < prot._steps[1].endTime.get())
+        self.assertTrue(prot._steps[1].initTime.get() > prot._steps[0].endTime.get())
+        # Result files come back from the workers
+        self.assertTrue(prot._steps[1]._resultFiles.hasValue())
+
+    def test_ProcessStepExecutorDyingWorker(self):
+        # The second worker dies without reporting after the first step has failed
+        fn = self.getOutputPath("protocol_dying.sqlite")
+        mapper = SqliteMapper(fn, globals())
+        prot = MyDyingWorkerProtocol(mapper=mapper, workingDir=self.getOutputPath(''))
+        prot._stepsExecutor = ProcessStepExecutor(hostConfig=None, nProcs=2)
+        prot.run()
+
+        self.assertEqual(prot._steps[0].getStatus(), STATUS_FAILED)
+        self.assertEqual(prot._steps[1].getStatus(), STATUS_FAILED)
+        # The step still running when the first one failed is also stored
+        for step in prot.loadSteps():
+            self.assertEqual(step.getStatus(), STATUS_FAILED)
+
+    def test_ProcessStepExecutorExitingWorker(self):
+        # The worker exits with code 0 without reporting the end of the step
+        fn = self.getOutputPath("protocol_exiting.sqlite")
+        mapper = SqliteMapper(fn, globals())
+        prot = MyExitingWorkerProtocol(mapper=mapper, workingDir=self.getOutputPath(''))
+        prot._stepsExecutor = ProcessStepExecutor(hostConfig=None, nProcs=2)
+        prot.run()
+
+        self.assertEqual(prot._steps[0].getStatus(), STATUS_FAILED)
@@ -142,11 +142,11 @@ class TestGabrielssonPK06Workflow(TestWorkflow):
         fe = float(experiment.samples['Individual'].descriptors['fe'])
         Ka = float(experiment.samples['Individual'].descriptors['Oral_Ka'])
         tlag = float(experiment.samples['Individual'].descriptors['Oral_tlag'])
-        self.assertTrue(Cl>0.084 and Cl<0.087) # Gabrielsson, p 548, Cle=6.0257 1/h=0.1004 1/min
-        self.assertTrue(V>250 and V<275) # Gabrielsson, p 548, Vd=290.34
+        self.assertTrue(Cl>0.087 and Cl<0.092) # Gabrielsson, p 548, Cle=6.0257 1/h=0.1004 1/min
+        self.assertTrue(V>280 and V<300) # Gabrielsson, p 548, Vd=290.34
         self.assertTrue(fe>0.08 and fe<0.09) # Gabrielsson, p 548, fe=0.0698
-        self.assertTrue(Ka>0.004 and Ka<0.006) # Gabrielsson, p 548, Ka=0.4207 1/h=0.00701 1/min
-        self.assertTrue(tlag>13 and tlag<17) # Gabrielsson, p 548, tlag=0.3129 h=18.77 min
+        self.assertTrue(Ka>0.006 and Ka<0.01) # Gabrielsson, p 548, Ka=0.4207 1/h=0.00701 1/min
+        self.assertTrue(tlag>17 and tlag<20) # Gabrielsson, p 548, tlag=0.3129 h=18.77 min
         fitting = PKPDFitting()
         fitting.load(protEV1MonoCompartmentUrine.outputFitting.fnFitting)
         self.assertTrue(fitting.sampleFits[0].R2>0.965)
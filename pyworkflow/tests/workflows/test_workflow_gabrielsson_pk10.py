@@ -90,7 +90,7 @@ class TestGabrielssonPK10Workflow(TestWorkflow):
         protPKPDPOTwoCompartments = self.newProtocol(ProtPKPDTwoCompartments,
                                                      objLabel='pkpd - ev1 two-compartments',
                                                      globalSearch=False,
-                                                     bounds='(10.0, 20.0); (0.25, 0.45); (0.02, 0.06); (0.9, 1.15); (40.0, 70.0); (1.0, 3.0); (40.0, 70.0)')
+                                                     bounds='(10.0, 19.0); (0.25, 0.45); (0.02, 0.06); (0.9, 1.15); (40.0, 70.0); (1.0, 3.0); (40.0, 70.0)')
         protPKPDPOTwoCompartments.inputExperiment.set(protImportPO.outputExperiment)
         self.launchProtocol(protPKPDPOTwoCompartments)
         self.assertIsNotNone(protPKPDPOTwoCompartments.outputExperiment.fnPKPD, "There was a problem with the two-compartmental model ")
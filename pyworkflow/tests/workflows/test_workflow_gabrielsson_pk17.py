@@ -66,8 +66,8 @@ class TestGabrielssonPK17Workflow(TestWorkflow):
         experiment.load(protPKPDPMonoCompartment.outputExperiment.fnPKPD)
         Cl = float(experiment.samples['Individual'].descriptors['Cl'])
         V = float(experiment.samples['Individual'].descriptors['V'])
-        self.assertTrue(Cl>35.5 and Cl<36.5) # Gabrielsson p. 631: Cl=43.28
-        self.assertTrue(V>1550 and V<1650) # Gabrielsson p. 631: V=1377.66
+        self.assertTrue(Cl>38 and Cl<39.5) # Gabrielsson p. 631: Cl=43.28
+        self.assertTrue(V>1400 and V<1460) # Gabrielsson p. 631: V=1377.66
         fitting = PKPDFitting()
         fitting.load(protPKPDPMonoCompartment.outputFitting.fnFitting)
         self.assertTrue(fitting.sampleFits[0].R2>0.8)
@@ -264,5 +264,35 @@ class TestGabrielssonPK19Workflow(TestWorkflow):
         self.assertTrue(fitting.sampleFits[1].R2>0.97)
         self.assertTrue(fitting.sampleFits[2].R2>0.97)
 
+    def testParallelGroupFit(self):
+        print "Import Experiment (intravenous doses) Individual"
+        protImportIndividual = self.newProtocol(ProtImportExperiment,
+                                      objLabel='pkpd - import experiment Individual (parallel)',
+                                      inputFile=self.expIFn)
+        self.launchProtocol(protImportIndividual)
+        self.assertIsNotNone(protImportIndividual.outputExperiment.fnPKPD, "There was a problem with the import")
+
+        # The groups are fitted one after the other and in 3 processes, the results must be the same
+        experiments = []
+        for numberOfThreads in [1, 3]:
+            print "Fitting a two-compartments model with %d threads ..."%numberOfThreads
+            protPKPDTwoCompartment = self.newProtocol(ProtPKPDTwoCompartments,
+                                                      objLabel='pkpd - iv two-compartments, %d threads'%numberOfThreads,
+                                                      globalSearch=False, numberOfThreads=numberOfThreads,
+                                                      bounds='(0.0, 0.1); (0.0, 3.0); (0.0, 0.25); (0.0, 4.0)')
+            protPKPDTwoCompartment.inputExperiment.set(protImportIndividual.outputExperiment)
+            self.launchProtocol(protPKPDTwoCompartment)
+            self.assertIsNotNone(protPKPDTwoCompartment.outputExperiment.fnPKPD, "There was a problem with the two-compartmental model ")
+            experiment = PKPDExperiment()
+            experiment.load(protPKPDTwoCompartment.outputExperiment.fnPKPD)
+            experiments.append(experiment)
+
+        experimentSerial, experimentParallel = experiments
+        self.assertEqual(sorted(experimentSerial.samples.keys()), sorted(experimentParallel.samples.keys()))
+        for sampleName, sample in experimentSerial.samples.iteritems():
+            for varName in ['V', 'Cl', 'Clp', 'Vp']:
+                self.assertAlmostEqual(float(sample.descriptors[varName]),
+                                       float(experimentParallel.samples[sampleName].descriptors[varName]), 6)
+
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,96 @@
+# **************************************************************************
+# *
+# * Authors:     Carlos Oscar Sorzano (info@kinestat.com)
+# *
+# * Kinestat Pharma
+# *
+# * This program is free software; you can redistribute it and/or modify
+# * it under the terms of the GNU General Public License as published by
+# * the Free Software Foundation; either version 2 of the License, or
+# * (at your option) any later version.
+# *
+# * This program is distributed in the hope that it will be useful,
+# * but WITHOUT ANY WARRANTY; without even the implied warranty of
+# * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# * GNU General Public License for more details.
+# *
+# * You should have received a copy of the GNU General Public License
+# * along with this program; if not, write to the Free Software
+# * Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA
+# * 02111-1307  USA
+# *
+# *  All comments concerning this program package may be sent to the
+# *  e-mail address 'jmdelarosa@cnb.csic.es'
+# *
+
+
+import unittest, sys
+import numpy as np
+from pyworkflow.em import *
+from pyworkflow.tests import *
+from pyworkflow.em.packages.pkpd import *
+from test_workflow import TestWorkflow
+
+class TestPKPDEV1Workflow(TestWorkflow):
+    """ Fit a first order absorption monocompartment model, solved analytically, to simulated data """
+
+    @classmethod
+    def setUpClass(cls):
+        tests.setupTestProject(cls)
+        # Cp(t) of a monocompartment with ev1 absorption, D=100 ug, Ka=0.05 min^-1, Cl=0.3 L/min, V=30 L
+        D, Ka, Cl, V = 100.0, 0.05, 0.3, 30.0
+        Ke = Cl/V
+        t = np.array([10, 15, 20, 30, 40, 60, 90, 120, 180, 210, 240, 300, 360], dtype=float)
+        Cp = D*Ka/(V*(Ka-Ke))*(np.exp(-Ke*t)-np.exp(-Ka*t))
+        cls.exptFn = cls.proj.getPath('experiment_ev1.pkpd')
+        fh = open(cls.exptFn, 'w')
+        fh.write("[EXPERIMENT] ===========================\ncomment = \ntitle = EV1 simulation\n\n"
+                 "[VARIABLES] ============================\n"
+                 "Cp ; ug/L ; numeric[%f] ; measurement ; Plasma concentration\n"
+                 "t ; min ; numeric[%f] ; time ; \n\n"
+                 "[VIAS] ================================\n"
+                 "Oral; ev1; tlag=0.000000 min; bioavailability=1.000000\n\n"
+                 "[DOSES] ================================\n"
+                 "Bolus1; via=Oral; bolus; t=0.000000 min; d=100 ug\n\n"
+                 "[SAMPLES] ================================\n"
+                 "Individual1; dose=Bolus1\n\n"
+                 "[MEASUREMENTS] ===========================\n"
+                 "Individual1 ; t; Cp\n")
+        for ti, Cpi in zip(t, Cp):
+            fh.write("%f %f\n" % (ti, Cpi))
+        fh.close()
+
+    def testPKPDEV1Workflow(self):
+        print "Import Experiment"
+        protImport = self.newProtocol(ProtImportExperiment,
+                                      objLabel='pkpd - import experiment',
+                                      inputFile=self.exptFn)
+        self.launchProtocol(protImport)
+        self.assertIsNotNone(protImport.outputExperiment.fnPKPD, "There was a problem with the import")
+
+        # Local optimization only, from the middle of the bounds
+        print "Fitting monocompartmental model..."
+        protEV1MonoCompartment = self.newProtocol(ProtPKPDMonoCompartment,
+                                                  objLabel='pkpd - ev1 monocompartment',
+                                                  globalSearch=False,
+                                                  bounds='(0.0, 0.2); (0.0, 1.0); (0.0, 100.0)')
+        protEV1MonoCompartment.inputExperiment.set(protImport.outputExperiment)
+        self.launchProtocol(protEV1MonoCompartment)
+        self.assertIsNotNone(protEV1MonoCompartment.outputExperiment.fnPKPD, "There was a problem with the monocompartmental model ")
+        self.assertIsNotNone(protEV1MonoCompartment.outputFitting.fnFitting, "There was a problem with the monocompartmental model ")
+
+        experiment = PKPDExperiment()
+        experiment.load(protEV1MonoCompartment.outputExperiment.fnPKPD)
+        Cl = float(experiment.samples['Individual1'].descriptors['Cl'])
+        V = float(experiment.samples['Individual1'].descriptors['V'])
+        Ka = float(experiment.samples['Individual1'].descriptors['Oral_Ka'])
+        self.assertAlmostEqual(Cl, 0.3, 2)
+        self.assertAlmostEqual(V, 30.0, 0)
+        self.assertAlmostEqual(Ka, 0.05, 3)
+
+        fitting = PKPDFitting()
+        fitting.load(protEV1MonoCompartment.outputFitting.fnFitting)
+        self.assertTrue(fitting.sampleFits[0].R2>0.999)
+
+if __name__ == "__main__":
+    unittest.main()
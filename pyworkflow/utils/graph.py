@@ -65,6 +65,12 @@ class Node(object):
                 self._childs.append(n)
                 n._parents.append(self)
                 
+    def removeChild(self, *nodes):
+        for n in nodes:
+            if n in self._childs:
+                self._childs.remove(n)
+                n._parents.remove(self)
+                
     def getParent(self):
         """ Return the first parent in the list,
         if the node isRoot, None is returned.
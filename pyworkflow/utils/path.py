@@ -393,9 +393,30 @@ def createUniqueFileName(fn):
 
     return None
 
+# MD5 strings already computed in this process. A file is only hashed again if its inode, size, modification or
+# status change time are different. The status change time cannot be set by the user, so a file that is rewritten
+# and given back its old modification time is still hashed again
+_md5Cache = {}
+MD5_CHUNK_SIZE = 1024*1024
+
 def getMD5String(fn):
-    fnTime = time.strftime("%Y-%m-%d-%M:%S\n",time.gmtime(getmtime(fn)))
-    return hashlib.md5(fnTime+open(fn, 'rb').read()).hexdigest()
+    fileStat = os.stat(fn)
+    fileId = (fileStat.st_dev, fileStat.st_ino, fileStat.st_size, fileStat.st_mtime, fileStat.st_ctime)
+    fnKey = os.path.abspath(fn)
+    if fnKey in _md5Cache and _md5Cache[fnKey][0]==fileId:
+        return _md5Cache[fnKey][1]
+
+    fnTime = time.strftime("%Y-%m-%d-%M:%S\n",time.gmtime(fileStat.st_mtime))
+    md5 = hashlib.md5(fnTime)
+    fh = open(fn, 'rb')
+    chunk = fh.read(MD5_CHUNK_SIZE)
+    while chunk:
+        md5.update(chunk)
+        chunk = fh.read(MD5_CHUNK_SIZE)
+    fh.close()
+    md5String = md5.hexdigest()
+    _md5Cache[fnKey] = (fileId, md5String)
+    return md5String
 
 def writeMD5(fn):
     if not exists(fn):
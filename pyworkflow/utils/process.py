@@ -31,6 +31,8 @@ This module handles process execution
 import sys
 import os.path
 import resource
+import multiprocessing
+from StringIO import StringIO
 from subprocess import check_call
 
 from utils import greenStr, envVarOn
@@ -110,3 +112,54 @@ def killWithChilds(pid):
         c.kill()
     print "Terminating process pid: %d" % pid
     proc.kill()
+
+
+# Methods called by the workers of each MethodPool, they are inherited when the pool is created
+_poolMethods = {}
+
+def _callPoolMethod(args):
+    """ Call the method of a pool in a worker. What it prints is returned
+    together with the result so that the parent writes it in order.
+    """
+    poolId, methodArgs = args
+    stdout = sys.stdout
+    sys.stdout = StringIO()
+    done = False
+    try:
+        result = _poolMethods[poolId](*methodArgs)
+        done = True
+    finally:
+        log = sys.stdout.getvalue()
+        sys.stdout = stdout
+        if not done:
+            # The exception is passed to the parent, but the log would be lost
+            sys.stdout.write(log)
+            sys.stdout.flush()
+    return result, log
+
+
+class MethodPool():
+    """ Pool of forked processes that call a method, usually bound to an object
+    (e.g. a protocol or a model). The workers inherit the method and its object
+    when the pool is created, so they are not pickled. What the method prints in
+    a worker is written to the stdout of this process together with its result.
+    """
+    def __init__(self, method, numberOfProcs):
+        self._id = id(self)
+        _poolMethods[self._id] = method
+        self._pool = multiprocessing.Pool(numberOfProcs)
+
+    def imap(self, argsList, chunksize=1):
+        """ Generator of method(*args) for each args in argsList, in order """
+        for result, log in self._pool.imap(_callPoolMethod, [(self._id, args) for args in argsList], chunksize):
+            sys.stdout.write(log)
+            yield result
+
+    def map(self, argsList):
+        return list(self.imap(argsList))
+
+    def close(self):
+        """ Stop the workers, even if they are still running """
+        self._pool.terminate()
+        self._pool.join()
+        _poolMethods.pop(self._id, None)